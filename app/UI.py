@@ -1,3 +1,7 @@
+import json
+import time
+import uuid
+
 import streamlit as st
 import requests
 from requests.auth import HTTPBasicAuth
@@ -22,6 +26,10 @@ if "user" not in st.session_state:
 if "history" not in st.session_state:
     st.session_state.history = []
 
+# server-side conversation memory; a new id starts a fresh conversation
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
 if "greeted" not in st.session_state:
     st.session_state.greeted = False
 
@@ -213,6 +221,7 @@ with st.sidebar:
         if st.button("Logout"):
             st.session_state.user = None
             st.session_state.history = []
+            st.session_state.session_id = uuid.uuid4().hex
             st.session_state.greeted = False
             st.rerun()
 
@@ -298,10 +307,14 @@ role_full = st.session_state.user["role"]
 if "c-levelexecutives" in role_full.lower():
     tab_chat, tab_upload, tab_admin = st.tabs(["💬 Chat", "📤 Upload Docs", "⚙️ Admin"])
 
-    # fetch roles once for upload + admin
+    # roles for upload + admin; revalidated with the ETag so reruns get an empty 304
     try:
-        roles_response = requests.get(f"{API_URL}/roles")
-        roles = roles_response.json().get("roles", [])
+        headers = {"If-None-Match": st.session_state.roles_etag} if st.session_state.get("roles_etag") else {}
+        roles_response = requests.get(f"{API_URL}/roles", headers=headers)
+        if roles_response.status_code != 304:
+            st.session_state.roles = roles_response.json().get("roles", [])
+            st.session_state.roles_etag = roles_response.headers.get("ETag")
+        roles = st.session_state.get("roles", [])
     except Exception:
         roles = []
 else:
@@ -321,44 +334,74 @@ with tab_chat:
         if not question.strip():
             st.warning("Please enter a question.")
         else:
-            with st.spinner("Analyzing your documents…"):
-                resp = requests.post(
-                    f"{API_URL}/chat",
-                    json={"user": st.session_state.user, "message": question},
-                    # backend doesn't require auth for /chat, but this won't hurt
-                    auth=HTTPBasicAuth(st.session_state.user["username"], "")
+            # Stream tokens into the answer card as they arrive
+            answer_box = st.empty()
+            answer = ""
+            sources = []
+            failed = False
+
+            def render_answer(text):
+                answer_box.markdown(
+                    f"""
+                    <div class="answer-card">
+                        <div class="answer-title">✅ Answer</div>
+                        <div class="answer-body">{text}</div>
+                    </div>
+                    """,
+                    unsafe_allow_html=True,
                 )
 
-                if resp.status_code != 200:
-                    st.error("Server error: Could not get a response.")
+            with st.spinner("Analyzing your documents…"):
+                try:
+                    resp = requests.post(
+                        f"{API_URL}/chat/stream",
+                        json={
+                            "user": st.session_state.user,
+                            "session_id": st.session_state.session_id,
+                            "message": question,
+                        },
+                        # backend doesn't require auth for /chat, but this won't hurt
+                        auth=HTTPBasicAuth(st.session_state.user["username"], ""),
+                        stream=True,
+                    )
+                except Exception:
+                    resp = None
+
+                if resp is None or resp.status_code != 200:
+                    failed = True
                 else:
-                    data = resp.json()
-                    answer = data.get("response", "")
+                    with resp:
+                        for line in resp.iter_lines():
+                            if not line:
+                                continue
+                            event = json.loads(line)
+                            if event.get("type") == "token":
+                                answer += event.get("content", "")
+                                render_answer(answer + "▌")
+                            elif event.get("type") == "done":
+                                sources = event.get("sources", [])
+                            elif event.get("type") == "error":
+                                failed = True
+                                break
+
+            if failed:
+                st.error("Server error: Could not get a response.")
+            else:
+                # Answer card
+                render_answer(answer)
 
-                    # Answer card
+                # Sources card
+                if sources:
                     st.markdown(
-                        f"""
-                        <div class="answer-card">
-                            <div class="answer-title">✅ Answer</div>
-                            <div class="answer-body">{answer}</div>
-                        </div>
+                        """
+                        <div class="sources-card">
+                            <b>📄 Sources used:</b><br>
                         """,
                         unsafe_allow_html=True,
                     )
-
-                    # Sources card
-                    sources = data.get("sources", [])
-                    if sources:
-                        st.markdown(
-                            """
-                            <div class="sources-card">
-                                <b>📄 Sources used:</b><br>
-                            """,
-                            unsafe_allow_html=True,
-                        )
-                        for s in sources:
-                            st.markdown(f"- {s}")
-                        st.markdown("</div>", unsafe_allow_html=True)
+                    for s in sources:
+                        st.markdown(f"- {s}")
+                    st.markdown("</div>", unsafe_allow_html=True)
 
 
 # -----------------------------------------------------
@@ -372,20 +415,42 @@ if "c-levelexecutives" in role_full.lower():
         doc_file = st.file_uploader("Upload file (.txt, .md, .csv, .pdf)", type=["txt", "md", "csv", "pdf"])
 
         if st.button("Upload") and doc_file:
-            with st.spinner("Uploading & indexing document..."):
-                try:
-                    res = requests.post(
-                        f"{API_URL}/upload-docs",
-                        data={"role": upload_role},
-                        files={"file": doc_file},
-                        auth=HTTPBasicAuth(st.session_state.user["username"], "")
+            auth = HTTPBasicAuth(st.session_state.user["username"], "")
+            try:
+                res = requests.post(
+                    f"{API_URL}/upload-docs",
+                    data={"role": upload_role},
+                    files={"file": doc_file},
+                    auth=auth
+                )
+            except Exception as e:
+                res = None
+                st.error(f"Connection error: {e}")
+
+            if res is not None and not res.ok:
+                st.error(f"Upload failed: {res.text}")
+            elif res is not None:
+                # ingestion runs in the background; poll the job until it finishes
+                job_id = res.json().get("job_id")
+                job = {}
+                with st.spinner("Uploading & indexing document..."):
+                    while True:
+                        job_resp = requests.get(f"{API_URL}/jobs/{job_id}", auth=auth)
+                        if not job_resp.ok:
+                            job = {"status": "failed", "error": job_resp.text}
+                            break
+                        job = job_resp.json()
+                        if job.get("status") in ("done", "failed"):
+                            break
+                        time.sleep(1)
+
+                if job.get("status") == "done":
+                    st.success(
+                        f"Indexed {job.get('chunks', 0)} chunks into role '{job.get('role')}' "
+                        f"in {job.get('timings', {}).get('total', 0):.1f}s."
                     )
-                    if res.ok:
-                        st.success(res.json().get("message", "Upload successful."))
-                    else:
-                        st.error(f"Upload failed: {res.text}")
-                except Exception as e:
-                    st.error(f"Connection error: {e}")
+                else:
+                    st.error(f"Indexing failed: {job.get('error', 'unknown error')}")
 
 
 # -----------------------------------------------------
@@ -0,0 +1,229 @@
+"""
+Admin analytics over chat_logs: top queries per role, chunk hit frequency,
+latency percentiles and daily volume.
+
+Reading chat_logs directly means parsing every row's doc_chunk_ids / timings
+JSON on each request, which doesn't stay fast at millions of rows. Instead
+the logs are folded into small per-day rollup tables:
+
+- rollup_daily    (day, role)           -> queries
+- rollup_queries  (day, role, query)    -> hits      (normalized query text)
+- rollup_chunks   (day, chunk_id)       -> hits      (unnested doc_chunk_ids)
+- rollup_latency  (day, role, bucket)   -> hits      (log-spaced total-ms buckets)
+
+refresh() only aggregates rows added since the last run (chat_logs is
+append-only, so its rowid is a watermark) and merges them in with upserts,
+all as set-based DuckDB SQL. Latency percentiles are read off the merged
+bucket counts (within ~LATENCY_BUCKET_GROWTH of the true value).
+"""
+
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from db import STATE_URL, get_conn, flush_writer, state_request
+
+# ----------------------------
+# Config (override via env)
+# ----------------------------
+ANALYTICS_REFRESH_SECONDS = float(os.getenv("ANALYTICS_REFRESH_SECONDS", "30"))
+LATENCY_BUCKET_GROWTH = 1.1          # each latency bucket is 10% wider than the previous
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS analytics_watermark (
+        name TEXT PRIMARY KEY,
+        last_rowid BIGINT
+    )""",
+    """CREATE TABLE IF NOT EXISTS rollup_daily (
+        day DATE, role TEXT, queries BIGINT,
+        PRIMARY KEY (day, role)
+    )""",
+    """CREATE TABLE IF NOT EXISTS rollup_queries (
+        day DATE, role TEXT, query TEXT, hits BIGINT,
+        PRIMARY KEY (day, role, query)
+    )""",
+    """CREATE TABLE IF NOT EXISTS rollup_chunks (
+        day DATE, chunk_id TEXT, hits BIGINT,
+        PRIMARY KEY (day, chunk_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS rollup_latency (
+        day DATE, role TEXT, bucket INTEGER, hits BIGINT,
+        PRIMARY KEY (day, role, bucket)
+    )""",
+]
+
+# rows of chat_logs added since the last refresh; same normalization as answer_cache.normalize_query
+_NEW_LOGS = """
+    CREATE TEMP TABLE new_logs AS
+    SELECT
+        created_at::DATE AS day,
+        lower(role) AS role,
+        rtrim(regexp_replace(lower(trim(query)), '\\s+', ' ', 'g'), ' ?!.') AS query,
+        doc_chunk_ids,
+        TRY_CAST(stage_timings ->> '$.total' AS DOUBLE) AS total_ms
+    FROM chat_logs
+    WHERE rowid > ? AND rowid <= ?
+"""
+
+_MERGES = [
+    """INSERT INTO rollup_daily
+       SELECT day, role, count(*) FROM new_logs GROUP BY ALL
+       ON CONFLICT (day, role) DO UPDATE SET queries = queries + excluded.queries""",
+    """INSERT INTO rollup_queries
+       SELECT day, role, query, count(*) FROM new_logs GROUP BY ALL
+       ON CONFLICT (day, role, query) DO UPDATE SET hits = hits + excluded.hits""",
+    """INSERT INTO rollup_chunks
+       SELECT day, chunk_id, count(*)
+       FROM (
+           SELECT day, unnest(TRY_CAST(doc_chunk_ids AS JSON)::VARCHAR[]) AS chunk_id
+           FROM new_logs
+       )
+       WHERE chunk_id IS NOT NULL AND chunk_id <> ''
+       GROUP BY ALL
+       ON CONFLICT (day, chunk_id) DO UPDATE SET hits = hits + excluded.hits""",
+    f"""INSERT INTO rollup_latency
+        SELECT day, role, ceil(ln(greatest(total_ms, 1)) / ln({LATENCY_BUCKET_GROWTH}))::INTEGER, count(*)
+        FROM new_logs
+        WHERE total_ms IS NOT NULL
+        GROUP BY ALL
+        ON CONFLICT (day, role, bucket) DO UPDATE SET hits = hits + excluded.hits""",
+]
+
+
+def init_rollups():
+    con = get_conn()
+    for statement in _SCHEMA:
+        con.execute(statement)
+    con.close()
+
+
+def _percentile(buckets: List[tuple], total: int, p: float) -> Optional[float]:
+    """Upper bound (ms) of the bucket holding the p-th percentile."""
+    if not total:
+        return None
+    rank = math.ceil(total * p / 100)
+    seen = 0
+    for bucket, hits in buckets:
+        seen += hits
+        if seen >= rank:
+            return round(LATENCY_BUCKET_GROWTH ** bucket, 1)
+    return round(LATENCY_BUCKET_GROWTH ** buckets[-1][0], 1)
+
+
+class ChatAnalytics:
+    def __init__(self, refresh_seconds: float = ANALYTICS_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._refreshed_at = 0.0
+
+    def refresh(self) -> int:
+        """Fold chat_logs rows added since the last refresh into the rollups; returns rows added."""
+        with self._lock:
+            flush_writer()
+            if STATE_URL:
+                # multi-worker mode: the state server refreshes (one at a time) so no row is counted twice
+                added = state_request("POST", "/analytics/refresh")["rows"]
+                self._refreshed_at = time.monotonic()
+                return added
+            con = get_conn()
+            try:
+                last = con.execute(
+                    "SELECT last_rowid FROM analytics_watermark WHERE name = 'chat_logs'"
+                ).fetchone()
+                last = last[0] if last else -1
+                upto = con.execute("SELECT max(rowid) FROM chat_logs").fetchone()[0]
+                if upto is None or upto <= last:
+                    self._refreshed_at = time.monotonic()
+                    return 0
+
+                con.execute("BEGIN TRANSACTION")
+                con.execute(_NEW_LOGS, (last, upto))
+                for statement in _MERGES:
+                    con.execute(statement)
+                con.execute(
+                    "INSERT OR REPLACE INTO analytics_watermark VALUES ('chat_logs', ?)", (upto,)
+                )
+                con.execute("COMMIT")
+                self._refreshed_at = time.monotonic()
+                return upto - last
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+            finally:
+                con.close()
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._refreshed_at >= self.refresh_seconds:
+            self.refresh()
+
+    def _read(self, sql: str, params) -> List[tuple]:
+        self._maybe_refresh()
+        con = get_conn()
+        try:
+            return con.execute(sql, params).fetchall()
+        finally:
+            con.close()
+
+    # ----------------------------
+    # Reports
+    # ----------------------------
+    def top_queries(self, days: int = 30, limit: int = 10, role: Optional[str] = None) -> Dict[str, List[Dict]]:
+        rows = self._read("""
+            SELECT role, query, sum(hits) AS total
+            FROM rollup_queries
+            WHERE day > current_date - ?::INTEGER AND (?::TEXT IS NULL OR role = lower(?))
+            GROUP BY role, query
+            QUALIFY row_number() OVER (PARTITION BY role ORDER BY total DESC, query) <= ?
+            ORDER BY role, total DESC
+        """, (days, role, role, limit))
+
+        by_role: Dict[str, List[Dict]] = {}
+        for r, query, hits in rows:
+            by_role.setdefault(r, []).append({"query": query, "hits": hits})
+        return by_role
+
+    def chunk_hits(self, days: int = 30, limit: int = 20) -> List[Dict]:
+        rows = self._read("""
+            SELECT r.chunk_id, sum(r.hits) AS total, any_value(d.file_name), any_value(d.role), any_value(d.section)
+            FROM rollup_chunks r
+            LEFT JOIN doc_chunks d USING (chunk_id)
+            WHERE r.day > current_date - ?::INTEGER
+            GROUP BY r.chunk_id
+            ORDER BY total DESC, r.chunk_id
+            LIMIT ?
+        """, (days, limit))
+        return [
+            {"chunk_id": chunk_id, "hits": hits, "file_name": file_name, "role": role, "section": section}
+            for chunk_id, hits, file_name, role, section in rows
+        ]
+
+    def latency(self, days: int = 30, role: Optional[str] = None) -> Dict:
+        buckets = self._read("""
+            SELECT bucket, sum(hits)
+            FROM rollup_latency
+            WHERE day > current_date - ?::INTEGER AND (?::TEXT IS NULL OR role = lower(?))
+            GROUP BY bucket
+            ORDER BY bucket
+        """, (days, role, role))
+        total = sum(hits for _, hits in buckets)
+        return {
+            "requests": total,
+            **{f"p{p}_ms": _percentile(buckets, total, p) for p in (50, 90, 95, 99)},
+        }
+
+    def daily_volume(self, days: int = 30) -> List[Dict]:
+        rows = self._read("""
+            SELECT day, role, queries
+            FROM rollup_daily
+            WHERE day > current_date - ?::INTEGER
+            ORDER BY day, role
+        """, (days,))
+
+        volume: Dict[str, Dict] = {}
+        for day, role, queries in rows:
+            entry = volume.setdefault(str(day), {"day": str(day), "queries": 0, "by_role": {}})
+            entry["queries"] += queries
+            entry["by_role"][role] = queries
+        return list(volume.values())
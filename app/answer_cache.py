@@ -0,0 +1,141 @@
+"""
+Semantic answer cache for /chat.
+
+Answers are partitioned by the role filter chat() retrieves with, so a cached
+answer is only ever served to users who could see the same documents. A lookup
+first tries the exact normalized query, then falls back to the closest cached
+query embedding above a cosine-similarity threshold. Each partition is an LRU
+with a TTL; uploading docs for a role drops that role's partition.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+# ----------------------------
+# Config (override via env)
+# ----------------------------
+CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))    # per partition
+CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))    # cosine threshold
+
+# Partition used for unfiltered (c-level) retrieval; it sees every role's docs
+ALL_ROLES = "*"
+
+
+def normalize_query(query: str) -> str:
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip(" ?!.")
+
+
+class _Entry:
+    __slots__ = ("vector", "answer", "expires_at")
+
+    def __init__(self, vector: np.ndarray, answer: Dict, expires_at: float):
+        self.vector = vector
+        self.answer = answer
+        self.expires_at = expires_at
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        ttl_seconds: float = CACHE_TTL_SECONDS,
+        similarity_threshold: float = CACHE_SIMILARITY,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._partitions: Dict[str, "OrderedDict[str, _Entry]"] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def _purge_expired(self, entries: "OrderedDict[str, _Entry]", now: float):
+        expired = [k for k, e in entries.items() if e.expires_at <= now]
+        for k in expired:
+            del entries[k]
+        self._stats["expirations"] += len(expired)
+
+    def lookup(self, partition: str, query: str, vector) -> Optional[Dict]:
+        key = normalize_query(query)
+        now = time.monotonic()
+
+        with self._lock:
+            entries = self._partitions.get(partition)
+            if entries:
+                self._purge_expired(entries, now)
+
+            if not entries:
+                self._stats["misses"] += 1
+                return None
+
+            # 1) exact normalized match
+            entry = entries.get(key)
+            if entry is not None:
+                entries.move_to_end(key)
+                self._stats["hits"] += 1
+                self._stats["exact_hits"] += 1
+                return entry.answer
+
+            # 2) nearest cached query embedding
+            keys = list(entries.keys())
+            matrix = np.stack([entries[k].vector for k in keys])
+            scores = matrix @ self._unit(vector)
+            best = int(np.argmax(scores))
+
+            if scores[best] >= self.similarity_threshold:
+                entries.move_to_end(keys[best])
+                self._stats["hits"] += 1
+                self._stats["semantic_hits"] += 1
+                return entries[keys[best]].answer
+
+            self._stats["misses"] += 1
+            return None
+
+    def store(self, partition: str, query: str, vector, answer: Dict):
+        key = normalize_query(query)
+        entry = _Entry(self._unit(vector), answer, time.monotonic() + self.ttl_seconds)
+
+        with self._lock:
+            entries = self._partitions.setdefault(partition, OrderedDict())
+            entries[key] = entry
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, role: str):
+        """Drop answers that could have used documents of `role`."""
+        with self._lock:
+            for partition in (role, ALL_ROLES):
+                if self._partitions.pop(partition, None) is not None:
+                    self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": {p: len(e) for p, e in self._partitions.items()},
+            }
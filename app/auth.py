@@ -0,0 +1,155 @@
+"""
+Users and roles, persisted in DuckDB (users / roles tables) with
+PBKDF2-hashed passwords.
+
+Every API call authenticates with HTTP Basic, so UserStore keeps everything
+it needs in memory:
+
+- users and roles are loaded once and looked up by dict, never scanned
+- a successful PBKDF2 check is remembered for AUTH_CACHE_TTL_SECONDS, keyed by
+  a cheap keyed digest of the credentials (the password itself is never kept),
+  so only the first request of a session pays for the hash
+- the sorted role list and its ETag are computed once per change
+
+create_user / create_role write through to DuckDB and drop the verification
+cache and the role list.
+"""
+
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import duckdb
+
+from db import load_users, load_roles, insert_user, insert_role
+
+# ----------------------------
+# Config (override via env)
+# ----------------------------
+PBKDF2_ITERATIONS = int(os.getenv("PBKDF2_ITERATIONS", "200000"))
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "300"))
+
+# Accounts created on first start when the users table is empty
+DEFAULT_USERS: Dict[str, Dict[str, str]] = {
+    "Deb": {"password": "password123", "role": "engineering"},
+    "Ved": {"password": "securepass", "role": "marketing"},
+    "Binoy": {"password": "financepass", "role": "finance"},
+    "sangit": {"password": "hrpass123", "role": "hr"},
+    "sandhya": {"password": "ceopass", "role": "c-levelexecutives"},
+    "Karabi": {"password": "employeepass", "role": "employee"},
+}
+
+
+class UserExistsError(Exception):
+    """A user with that name already exists."""
+
+
+def hash_password(password: str, iterations: int = PBKDF2_ITERATIONS) -> str:
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    try:
+        _, iterations, salt, expected = password_hash.split("$")
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+class UserStore:
+    def __init__(self, cache_ttl_seconds: float = AUTH_CACHE_TTL_SECONDS):
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self._users: Dict[str, Dict[str, str]] = {}
+        self._roles: set = set()
+        self._lock = threading.Lock()
+
+        # per-process key: cache entries can't be checked against a guessed password offline
+        self._cache_key = secrets.token_bytes(32)
+        self._verified: Dict[str, Tuple[bytes, float]] = {}
+        self._roles_payload: Optional[Tuple[List[str], str]] = None
+        self._stats = {"verified": 0, "cache_hits": 0, "failures": 0}
+
+    def load(self):
+        """Read users / roles from DuckDB, seeding DEFAULT_USERS into an empty table."""
+        users = load_users()
+        if not users:
+            for username, u in DEFAULT_USERS.items():
+                insert_user(username, hash_password(u["password"]), u["role"])
+                insert_role(u["role"])
+            users = load_users()
+
+        with self._lock:
+            self._users = users
+            # roles that only ever appeared on users still count
+            self._roles = set(load_roles()) | {u["role"] for u in users.values()}
+            self._invalidate()
+
+    def _invalidate(self):
+        self._verified.clear()
+        self._roles_payload = None
+
+    def _credential_digest(self, username: str, password: str) -> bytes:
+        return hmac.new(self._cache_key, f"{username}\0{password}".encode(), hashlib.sha256).digest()
+
+    def authenticate(self, username: str, password: str) -> Optional[Dict[str, str]]:
+        """{"username", "role"} for valid credentials, else None."""
+        user = self._users.get(username)
+        if user is None:
+            self._stats["failures"] += 1
+            return None
+
+        digest = self._credential_digest(username, password)
+        cached = self._verified.get(username)
+        if cached is not None and cached[1] > time.monotonic() and hmac.compare_digest(cached[0], digest):
+            self._stats["cache_hits"] += 1
+            return {"username": username, "role": user["role"]}
+
+        if not verify_password(password, user["password_hash"]):
+            self._stats["failures"] += 1
+            return None
+
+        self._stats["verified"] += 1
+        self._verified[username] = (digest, time.monotonic() + self.cache_ttl_seconds)
+        return {"username": username, "role": user["role"]}
+
+    def roles(self) -> Tuple[List[str], str]:
+        """(sorted roles, ETag)"""
+        payload = self._roles_payload
+        if payload is None:
+            roles = sorted(self._roles)
+            etag = '"' + hashlib.sha256("\n".join(roles).encode()).hexdigest()[:16] + '"'
+            payload = self._roles_payload = (roles, etag)
+        return payload
+
+    def create_user(self, username: str, password: str, role: str):
+        password_hash = hash_password(password)
+        with self._lock:
+            if username in self._users:
+                raise UserExistsError(username)
+            try:
+                insert_user(username, password_hash, role)
+            except duckdb.ConstraintException:
+                # created by another worker since this one last loaded the users table
+                raise UserExistsError(username)
+            if role not in self._roles:
+                insert_role(role)
+            self._users[username] = {"password_hash": password_hash, "role": role}
+            self._roles.add(role)
+            self._invalidate()
+
+    def create_role(self, role: str):
+        with self._lock:
+            if role not in self._roles:
+                insert_role(role)
+                self._roles.add(role)
+            self._invalidate()
+
+    def stats(self) -> Dict:
+        return {**self._stats, "users": len(self._users), "roles": len(self._roles), "cached": len(self._verified)}
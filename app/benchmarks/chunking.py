@@ -0,0 +1,144 @@
+"""
+Markdown-structure-aware vs fixed-size (recursive) chunking on the markdown
+files of resources/data.
+
+For each splitter (MARKDOWN_SPLITTER values "recursive" and "markdown") the
+.md files are split, embedded and written to a throwaway persistent Chroma
+collection, and the script reports:
+
+- chunk count and mean chunk size
+- index size on disk
+- ingestion time (split + embed + write)
+- hit@k: a query is a word window sampled from the raw file text (the same
+  queries for both splitters); it hits if one of the top-k chunks retrieved
+  for its role contains the window's middle words
+- mean context size of the top-k (bigger chunks cost prompt tokens)
+
+    cd app && python -m benchmarks.chunking --queries 200 --k 4
+"""
+
+import argparse
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+
+from langchain_chroma import Chroma
+
+from context import count_tokens
+from embed_doc import BASE_DIR
+from embeddings import create_embeddings
+from benchmarks.corpus import load_chunks, percentile
+
+SPLITTERS = ("recursive", "markdown")
+_MARKUP_RE = re.compile(r"[#*_|`>\[\]]+|-{3,}|={3,}")
+
+
+def _normalize(text: str) -> str:
+    return " ".join(_MARKUP_RE.sub(" ", text).lower().split())
+
+
+def markdown_files(base_dir: str = BASE_DIR):
+    """[(role, file name, text)] for every .md file under base_dir/<department>/."""
+    files = []
+    for department in sorted(os.listdir(base_dir)):
+        dept_path = os.path.join(base_dir, department)
+        if not os.path.isdir(dept_path):
+            continue
+        for fname in sorted(os.listdir(dept_path)):
+            if fname.endswith(".md"):
+                with open(os.path.join(dept_path, fname), encoding="utf-8") as f:
+                    files.append((department.lower(), fname, f.read()))
+    return files
+
+
+def sample_text_queries(files, n: int, seed: int = 7, window: int = 12, anchor: int = 6):
+    """
+    [(query, role, anchor text)]: `window`-word spans of the raw files; the
+    `anchor` middle words are what a retrieved chunk must contain to count.
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n):
+        role, _, text = rng.choice(files)
+        words = _normalize(text).split()
+        if len(words) < window:
+            continue
+        start = rng.randrange(0, len(words) - window + 1)
+        span = words[start:start + window]
+        middle = (window - anchor) // 2
+        queries.append((" ".join(span), role, " ".join(span[middle:middle + anchor])))
+    return queries
+
+
+def dir_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, names in os.walk(path)
+        for f in names
+    )
+
+
+def run(splitter: str, embeddings, queries, args) -> dict:
+    persist_dir = tempfile.mkdtemp(prefix=f"finsolve_chunking_{splitter}_")
+    try:
+        start = time.perf_counter()
+        chunks = [c for c in load_chunks(splitter=splitter) if c.metadata["source"].endswith(".md")]
+        split_seconds = time.perf_counter() - start
+
+        vectordb = Chroma(
+            collection_name=f"bench_chunking_{splitter}",
+            embedding_function=embeddings,
+            persist_directory=persist_dir,
+        )
+        for i in range(0, len(chunks), args.batch_size):
+            batch = chunks[i:i + args.batch_size]
+            vectordb.add_documents(batch, ids=[d.metadata["chunk_id"] for d in batch])
+        ingest_seconds = time.perf_counter() - start
+
+        hits, context_tokens, latencies = 0, [], []
+        for query, role, anchor in queries:
+            t = time.perf_counter()
+            docs = vectordb.similarity_search(query, k=args.k, filter={"role": role})
+            latencies.append((time.perf_counter() - t) * 1000)
+            hits += any(anchor in _normalize(d.page_content) for d in docs)
+            context_tokens.append(sum(count_tokens(d.page_content) for d in docs))
+
+        return {
+            "splitter": splitter,
+            "chunks": len(chunks),
+            "mean_chars": sum(len(c.page_content) for c in chunks) / max(1, len(chunks)),
+            "index_mb": dir_size(persist_dir) / 1e6,
+            "split_seconds": split_seconds,
+            "ingest_seconds": ingest_seconds,
+            "hit": hits / len(queries) if queries else 0.0,
+            "context_tokens": sum(context_tokens) / max(1, len(context_tokens)),
+            "p50_ms": percentile(latencies, 50),
+        }
+    finally:
+        shutil.rmtree(persist_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=4, help="top-k used by /chat")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    embeddings = create_embeddings()
+    queries = sample_text_queries(markdown_files(), args.queries, seed=args.seed)
+
+    print(f"{'splitter':<10} {'chunks':>7} {'chars':>7} {'index MB':>9} {'ingest s':>9} "
+          f"{f'hit@{args.k}':>7} {'ctx tok':>8} {'p50 ms':>7}")
+    for splitter in SPLITTERS:
+        r = run(splitter, embeddings, queries, args)
+        print(f"{r['splitter']:<10} {r['chunks']:>7} {r['mean_chars']:>7.0f} {r['index_mb']:>9.2f} "
+              f"{r['ingest_seconds']:>9.2f} {r['hit']:>7.1%} {r['context_tokens']:>8.0f} {r['p50_ms']:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Sample corpus helpers shared by the benchmark scripts: the chunks of
+resources/data (split exactly like embed_doc.py does), queries derived from
+them, and larger synthetic corpora built by perturbing copies of its files.
+"""
+
+import os
+import random
+import re
+import shutil
+
+from embed_doc import BASE_DIR
+from ingest import split_file, is_supported
+
+
+def load_chunks(base_dir: str = BASE_DIR, splitter: str = None):
+    """All chunks of every supported file under base_dir/<department>/ (splitter: see ingest.split_file)."""
+    chunks = []
+    for department in sorted(os.listdir(base_dir)):
+        dept_path = os.path.join(base_dir, department)
+        if not os.path.isdir(dept_path):
+            continue
+        for fname in sorted(os.listdir(dept_path)):
+            file_path = os.path.join(dept_path, fname)
+            if os.path.isfile(file_path) and is_supported(fname):
+                chunks.extend(split_file(file_path, fname, department.lower(), splitter=splitter))
+    return chunks
+
+
+def sample_queries(chunks, n: int = 100, seed: int = 7):
+    """
+    Pseudo-queries: a short word window taken from randomly chosen chunks,
+    paired with the chunk it came from (the "relevant" chunk).
+    """
+    rng = random.Random(seed)
+    queries = []
+    for doc in rng.sample(chunks, min(n, len(chunks))):
+        words = doc.page_content.split()
+        if len(words) < 6:
+            continue
+        start = rng.randrange(0, max(1, len(words) - 12))
+        queries.append((" ".join(words[start:start + 12]), doc))
+    return queries
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+_NUMBER_RE = re.compile(r"\d+")
+_WORD_RE = re.compile(r"[A-Za-z]{4,}")
+
+
+def _perturb(text: str, rng: random.Random, vocab, word_rate: float) -> str:
+    # same-length random numbers keep ids / dates / amounts well-formed
+    text = _NUMBER_RE.sub(lambda m: str(rng.randrange(10 ** len(m.group()))).zfill(len(m.group())), text)
+    if word_rate and vocab:
+        text = _WORD_RE.sub(lambda m: rng.choice(vocab) if rng.random() < word_rate else m.group(), text)
+    return text
+
+
+def build_synthetic_corpus(out_dir: str, scale: int, base_dir: str = BASE_DIR,
+                           word_rate: float = 0.1, seed: int = 7) -> int:
+    """
+    Write `scale` perturbed copies of every file under base_dir/<department>/
+    to out_dir/<department>/ (numbers re-rolled, ~word_rate of the words of
+    text files swapped for other corpus words, so copies embed differently).
+    Returns the number of files written.
+    """
+    rng = random.Random(seed)
+    files = []
+    for department in sorted(os.listdir(base_dir)):
+        dept_path = os.path.join(base_dir, department)
+        if os.path.isdir(dept_path):
+            files.extend(
+                (department, fname, os.path.join(dept_path, fname))
+                for fname in sorted(os.listdir(dept_path))
+                if is_supported(fname)
+            )
+
+    texts = {}
+    for _, fname, path in files:
+        if not fname.endswith(".pdf"):
+            with open(path, encoding="utf-8", errors="replace") as f:
+                texts[path] = f.read()
+    vocab = sorted({w for text in texts.values() for w in _WORD_RE.findall(text)})
+
+    written = 0
+    for department, fname, path in files:
+        os.makedirs(os.path.join(out_dir, department), exist_ok=True)
+        stem, ext = os.path.splitext(fname)
+        for copy in range(scale):
+            target = os.path.join(out_dir, department, f"{stem}_{copy:05d}{ext}")
+            if path not in texts:
+                shutil.copyfile(path, target)
+            else:
+                # CSV cells only get new numbers so the columns stay intact
+                rate = 0.0 if ext == ".csv" else word_rate
+                with open(target, "w", encoding="utf-8") as f:
+                    f.write(_perturb(texts[path], rng, vocab, rate))
+            written += 1
+    return written
@@ -0,0 +1,113 @@
+"""
+Parity check + benchmark for the embedding backends (EMBEDDING_BACKEND).
+
+Embeds every chunk of resources/data with the reference torch backend and
+with a candidate backend (onnx / onnx-int8), then reports:
+
+- recall@k: overlap between the reference top-k and the candidate top-k for
+  sampled queries, both with a fully re-embedded index (candidate queries vs
+  candidate docs) and a mixed one (candidate queries vs the existing torch
+  index, i.e. switching backends without re-running embed_doc.py);
+- docs/sec for batch document embedding;
+- p50 / p95 single-query latency.
+
+Exits with status 1 if recall@k drops below --min-recall, so it can gate a
+backend switch.
+
+    cd app && python -m benchmarks.embedding_backends --backend onnx-int8
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from embeddings import create_embeddings, EMBEDDING_BACKENDS
+from benchmarks.corpus import load_chunks, sample_queries, percentile
+
+
+def _unit(vectors) -> np.ndarray:
+    m = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+
+def top_k(query_vectors: np.ndarray, doc_vectors: np.ndarray, k: int) -> np.ndarray:
+    scores = query_vectors @ doc_vectors.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def recall_at_k(reference: np.ndarray, candidate: np.ndarray) -> float:
+    k = reference.shape[1]
+    hits = sum(len(set(r) & set(c)) for r, c in zip(reference, candidate))
+    return hits / (len(reference) * k)
+
+
+def measure(backend: str, texts, queries, batch_size: int, latency_runs: int):
+    model = create_embeddings(backend)
+    model.embed_query("warm-up")
+
+    start = time.perf_counter()
+    doc_vectors = []
+    for i in range(0, len(texts), batch_size):
+        doc_vectors.extend(model.embed_documents(texts[i:i + batch_size]))
+    docs_per_sec = len(texts) / (time.perf_counter() - start)
+
+    query_vectors = model.embed_documents(queries)
+
+    latencies = []
+    for q in (queries * (latency_runs // max(1, len(queries)) + 1))[:latency_runs]:
+        t = time.perf_counter()
+        model.embed_query(q)
+        latencies.append((time.perf_counter() - t) * 1000)
+
+    return {
+        "docs": _unit(doc_vectors),
+        "queries": _unit(query_vectors),
+        "docs_per_sec": docs_per_sec,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="onnx-int8", choices=[b for b in EMBEDDING_BACKENDS if b != "torch"])
+    parser.add_argument("--k", type=int, default=4, help="top-k used by /chat")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--latency-runs", type=int, default=200)
+    parser.add_argument("--min-recall", type=float, default=0.9)
+    args = parser.parse_args()
+
+    chunks = load_chunks()
+    texts = [d.page_content for d in chunks]
+    queries = [q for q, _ in sample_queries(chunks, args.queries)]
+    print(f"📚 {len(texts)} chunks, {len(queries)} queries, k={args.k}")
+
+    results = {}
+    for backend in ("torch", args.backend):
+        print(f"⏳ Embedding with {backend}…")
+        results[backend] = measure(backend, texts, queries, args.batch_size, args.latency_runs)
+
+    ref, cand = results["torch"], results[args.backend]
+    ref_top = top_k(ref["queries"], ref["docs"], args.k)
+    full = recall_at_k(ref_top, top_k(cand["queries"], cand["docs"], args.k))
+    mixed = recall_at_k(ref_top, top_k(cand["queries"], ref["docs"], args.k))
+
+    print(f"\n{'backend':<10} {'docs/sec':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, r in results.items():
+        print(f"{name:<10} {r['docs_per_sec']:>10.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}")
+
+    print(f"\nrecall@{args.k} vs torch: re-embedded index {full:.3f}, existing torch index {mixed:.3f}")
+
+    if min(full, mixed) < args.min_recall:
+        print(f"❌ recall@{args.k} below {args.min_recall}")
+        sys.exit(1)
+    print("✅ parity OK")
+
+
+if __name__ == "__main__":
+    main()
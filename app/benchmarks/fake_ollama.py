@@ -0,0 +1,97 @@
+"""
+Stand-in for Ollama's /api/generate used by the load tests.
+
+Answers every prompt with filler tokens at a configurable rate after a
+configurable prompt-processing delay, streamed or not, and reports the same
+stats fields Ollama does (prompt_eval_count, eval_count, *_duration in ns),
+so the API's queueing, streaming and /metrics paths behave as they would
+against a real model without needing one.
+
+    cd app && python -m benchmarks.fake_ollama --port 11435 --tokens-per-sec 40
+    OLLAMA_URL=http://localhost:11435/api/generate uvicorn main:app
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+# ----------------------------
+# Config (override via env / CLI)
+# ----------------------------
+FAKE_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "200"))       # before the first token
+FAKE_TOKENS_PER_SEC = float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "40"))
+FAKE_ANSWER_TOKENS = int(os.getenv("FAKE_LLM_ANSWER_TOKENS", "64"))
+FAKE_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))          # fraction answered with HTTP 500
+
+_WORDS = ("the", "report", "shows", "revenue", "growth", "in", "Q3", "with", "costs", "down", "and", "margin", "up")
+
+app = FastAPI()
+
+
+def _stats(prompt: str, started: float, prompt_seconds: float) -> dict:
+    total = time.perf_counter() - started
+    return {
+        "done": True,
+        "prompt_eval_count": len(prompt.split()),
+        "prompt_eval_duration": int(prompt_seconds * 1e9),
+        "eval_count": FAKE_ANSWER_TOKENS,
+        "eval_duration": int((total - prompt_seconds) * 1e9),
+        "load_duration": 0,
+        "total_duration": int(total * 1e9),
+    }
+
+
+@app.post("/api/generate")
+async def generate(request: Request):
+    body = await request.json()
+    prompt = body.get("prompt", "")
+    started = time.perf_counter()
+
+    if random.random() < FAKE_ERROR_RATE:
+        raise HTTPException(500, "fake ollama: injected error")
+
+    await asyncio.sleep(FAKE_LATENCY_MS / 1000.0)
+    prompt_seconds = time.perf_counter() - started
+    delay = 1.0 / FAKE_TOKENS_PER_SEC if FAKE_TOKENS_PER_SEC > 0 else 0.0
+    tokens = [(" " if i else "") + _WORDS[i % len(_WORDS)] for i in range(FAKE_ANSWER_TOKENS)]
+
+    if body.get("stream"):
+        async def stream():
+            for token in tokens:
+                await asyncio.sleep(delay)
+                yield json.dumps({"model": body.get("model"), "response": token, "done": False}) + "\n"
+            yield json.dumps({"model": body.get("model"), "response": "", **_stats(prompt, started, prompt_seconds)}) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    await asyncio.sleep(delay * len(tokens))
+    return {"model": body.get("model"), "response": "".join(tokens), **_stats(prompt, started, prompt_seconds)}
+
+
+@app.get("/api/tags")
+def tags():
+    return {"models": [{"name": os.getenv("OLLAMA_MODEL", "llama3.2")}]}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency-ms", type=float, default=FAKE_LATENCY_MS, help="delay before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=FAKE_TOKENS_PER_SEC)
+    parser.add_argument("--answer-tokens", type=int, default=FAKE_ANSWER_TOKENS)
+    parser.add_argument("--error-rate", type=float, default=FAKE_ERROR_RATE)
+    args = parser.parse_args()
+
+    FAKE_LATENCY_MS = args.latency_ms
+    FAKE_TOKENS_PER_SEC = args.tokens_per_sec
+    FAKE_ANSWER_TOKENS = args.answer_tokens
+    FAKE_ERROR_RATE = args.error_rate
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,92 @@
+"""
+Hybrid (BM25 + vector, RRF) vs plain vector retrieval on resources/data.
+
+Builds a throwaway in-memory Chroma collection and lexical index from the
+sample corpus and compares, per method, hit@k (is the chunk a query was taken
+from in the top-k) and p50 / p95 retrieval latency. Two query sets are used:
+word windows sampled from chunks, and exact-term questions about employee ids
+from hr_data.csv (the case dense search tends to miss).
+
+    cd app && python -m benchmarks.hybrid_retrieval
+"""
+
+import argparse
+import re
+import tempfile
+import time
+
+from langchain_chroma import Chroma
+
+from embeddings import create_embeddings
+from lexical_index import LexicalIndex, hybrid_search
+from benchmarks.corpus import load_chunks, sample_queries, percentile
+
+_EMPLOYEE_ID_RE = re.compile(r"employee_id: (\w+)")
+
+
+def employee_id_queries(chunks, n: int):
+    queries = []
+    for doc in chunks:
+        match = _EMPLOYEE_ID_RE.search(doc.page_content)
+        if match:
+            queries.append((f"What is the attendance and manager of {match.group(1)}?", doc))
+        if len(queries) >= n:
+            break
+    return queries
+
+
+def run(name, search, queries, embeddings, k):
+    hits, latencies = 0, []
+    for query, expected in queries:
+        vector = embeddings.embed_query(query)
+        start = time.perf_counter()
+        docs = search(query, vector, expected.metadata["role"])
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += any(d.metadata.get("chunk_id") == expected.metadata["chunk_id"] for d in docs[:k])
+    return {
+        "name": name,
+        "hit": hits / len(queries) if queries else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--candidates", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    chunks = load_chunks()
+    embeddings = create_embeddings()
+
+    vectordb = Chroma(collection_name="bench_hybrid", embedding_function=embeddings)
+    vectordb.add_documents(chunks, ids=[d.metadata["chunk_id"] for d in chunks])
+
+    lexical = LexicalIndex(path=tempfile.mktemp(suffix=".pkl"))
+    lexical.add_documents(chunks)
+    print(f"📚 {len(chunks)} chunks indexed")
+
+    def vector_only(query, vector, role):
+        return vectordb.similarity_search_by_vector(vector, k=args.k, filter={"role": role})
+
+    def hybrid(query, vector, role):
+        return hybrid_search(vectordb, lexical, query, vector, role=role, k=args.k, candidates=args.candidates)
+
+    query_sets = {
+        "sampled text": sample_queries(chunks, args.queries),
+        "employee ids": employee_id_queries(chunks, args.queries),
+    }
+
+    print(f"\n{'queries':<14} {'method':<8} {'hit@' + str(args.k):>7} {'p50 ms':>8} {'p95 ms':>8}")
+    for label, queries in query_sets.items():
+        for name, search in (("vector", vector_only), ("hybrid", hybrid)):
+            r = run(name, search, queries, embeddings, args.k)
+            print(f"{label:<14} {r['name']:<8} {r['hit']:>7.3f} {r['p50']:>8.2f} {r['p95']:>8.2f}")
+
+    vectordb.delete_collection()
+
+
+if __name__ == "__main__":
+    main()
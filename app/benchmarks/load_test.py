@@ -0,0 +1,319 @@
+"""
+Load test for the API: /chat, /chat/stream, /upload-docs and /login driven
+at a fixed concurrency, reporting per-endpoint p50 / p95 / p99 latency, RPS
+and error rate (plus time to first token for /chat/stream).
+
+By default the harness starts its own stack so runs are reproducible: the
+fake Ollama stub (benchmarks/fake_ollama.py, configurable latency and token
+rate) and the API under uvicorn, in a scratch directory holding a copy of the
+current chroma_db / finsolve.db (run embed_doc.py first). Pass --url to load
+an API that is already running instead.
+
+    cd app && python -m benchmarks.load_test --concurrency 32 --requests 1000
+    cd app && python -m benchmarks.load_test --mix chat=1 --cache-bust --tokens-per-sec 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.corpus import load_chunks, sample_queries, percentile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (username, password, role) from auth.DEFAULT_USERS (seeded into an empty users table)
+CHAT_USERS = [
+    ("Binoy", "financepass", "finance"),
+    ("Ved", "securepass", "marketing"),
+    ("Deb", "password123", "engineering"),
+    ("sangit", "hrpass123", "hr"),
+    ("Karabi", "employeepass", "employee"),
+    ("sandhya", "ceopass", "c-levelexecutives"),
+]
+ADMIN = ("sandhya", "ceopass")
+UPLOAD_ROLES = ["finance", "marketing", "engineering", "hr", "general"]
+
+DEFAULT_MIX = "chat=70,chat_stream=10,login=15,upload=5"
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    unknown = set(weights) - {"chat", "chat_stream", "login", "upload"}
+    if unknown:
+        raise SystemExit(f"unknown endpoints in --mix: {sorted(unknown)}")
+    return weights
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    def add(self, endpoint: str, seconds: float, status: int, ok: bool):
+        self.latencies[endpoint].append(seconds * 1000)
+        self.statuses[endpoint][status] += 1
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def report(self, wall: float) -> List[Dict]:
+        rows = []
+        for endpoint in sorted(self.latencies):
+            values = self.latencies[endpoint]
+            rows.append({
+                "endpoint": endpoint,
+                "requests": len(values),
+                "errors": self.errors[endpoint],
+                "error_rate": self.errors[endpoint] / len(values) if values else 0.0,
+                "rps": len(values) / wall if wall > 0 else 0.0,
+                "p50_ms": percentile(values, 50),
+                "p95_ms": percentile(values, 95),
+                "p99_ms": percentile(values, 99),
+                "statuses": dict(self.statuses[endpoint]),
+            })
+        return rows
+
+
+# ----------------------------
+# Requests
+# ----------------------------
+async def do_chat(client, rng, queries, cache_bust, recorder):
+    username, _, role = rng.choice(CHAT_USERS)
+    message = rng.choice(queries)
+    if cache_bust:
+        message += f" ({rng.random():.8f})"
+    start = time.perf_counter()
+    response = await client.post("/chat", json={"user": {"username": username, "role": role}, "message": message})
+    recorder.add("chat", time.perf_counter() - start, response.status_code, response.status_code == 200)
+
+
+async def do_chat_stream(client, rng, queries, cache_bust, recorder):
+    username, _, role = rng.choice(CHAT_USERS)
+    message = rng.choice(queries)
+    if cache_bust:
+        message += f" ({rng.random():.8f})"
+    payload = {"user": {"username": username, "role": role}, "message": message}
+
+    start = time.perf_counter()
+    first_token = None
+    ok = False
+    async with client.stream("POST", "/chat/stream", json=payload) as response:
+        if response.status_code != 200:
+            await response.aread()
+            recorder.add("chat_stream", time.perf_counter() - start, response.status_code, False)
+            return
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["type"] == "token" and first_token is None:
+                first_token = time.perf_counter() - start
+            ok = event["type"] == "done"
+    recorder.add("chat_stream", time.perf_counter() - start, response.status_code, ok)
+    if first_token is not None:
+        recorder.add("chat_stream:first_token", first_token, response.status_code, ok)
+
+
+async def do_login(client, rng, queries, cache_bust, recorder):
+    username, password, _ = rng.choice(CHAT_USERS)
+    start = time.perf_counter()
+    response = await client.get("/login", auth=(username, password))
+    recorder.add("login", time.perf_counter() - start, response.status_code, response.status_code == 200)
+
+
+async def do_upload(client, rng, queries, cache_bust, recorder):
+    n = rng.randrange(1_000_000)
+    body = f"# Load test memo {n}\n\n" + " ".join(rng.choice(queries) for _ in range(5))
+    start = time.perf_counter()
+    response = await client.post(
+        "/upload-docs",
+        data={"role": rng.choice(UPLOAD_ROLES)},
+        files={"file": (f"loadtest_{n}.md", body.encode())},
+        auth=ADMIN,
+    )
+    recorder.add("upload", time.perf_counter() - start, response.status_code, response.status_code == 202)
+
+
+ENDPOINTS = {"chat": do_chat, "chat_stream": do_chat_stream, "login": do_login, "upload": do_upload}
+
+
+async def run_load(url, mix, concurrency, total, duration, queries, cache_bust, seed, timeout):
+    """Run the load; returns (per-endpoint result rows, wall seconds)."""
+    recorder = Recorder()
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    issued = 0
+    deadline = time.perf_counter() + duration if duration else None
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        async def worker(worker_id: int):
+            nonlocal issued
+            rng = random.Random(seed + worker_id)
+            while True:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                if deadline is None:
+                    if issued >= total:
+                        return
+                    issued += 1
+                endpoint = rng.choices(names, weights)[0]
+                start = time.perf_counter()
+                try:
+                    await ENDPOINTS[endpoint](client, rng, queries, cache_bust, recorder)
+                except httpx.HTTPError:
+                    # connection errors / timeouts count as errors with status 0
+                    recorder.add(endpoint, time.perf_counter() - start, 0, False)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        wall = time.perf_counter() - start
+
+    return recorder.report(wall), wall
+
+
+# ----------------------------
+# Self-hosted stack: fake Ollama + API in a scratch directory
+# ----------------------------
+def _wait_for(url: str, timeout: float, process) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"process for {url} exited with {process.returncode}")
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"{url} not ready after {timeout:.0f}s")
+
+
+def start_stack(args):
+    workdir = tempfile.mkdtemp(prefix="finsolve_loadtest_")
+    if not os.path.isdir(os.path.join(APP_DIR, "chroma_db")):
+        print("⚠️ no chroma_db found, run embed_doc.py first (answers will come from an empty index)")
+    else:
+        shutil.copytree(os.path.join(APP_DIR, "chroma_db"), os.path.join(workdir, "chroma_db"))
+    if os.path.exists(os.path.join(APP_DIR, "finsolve.db")):
+        shutil.copy(os.path.join(APP_DIR, "finsolve.db"), workdir)
+
+    env = {
+        **os.environ,
+        "PYTHONPATH": APP_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        "FAKE_LLM_LATENCY_MS": str(args.latency_ms),
+        "FAKE_LLM_TOKENS_PER_SEC": str(args.tokens_per_sec),
+        "FAKE_LLM_ANSWER_TOKENS": str(args.answer_tokens),
+        "FAKE_LLM_ERROR_RATE": str(args.llm_error_rate),
+        "OLLAMA_URL": f"http://127.0.0.1:{args.llm_port}/api/generate",
+    }
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "benchmarks.fake_ollama:app",
+             "--port", str(args.llm_port), "--log-level", "warning"],
+            cwd=APP_DIR, env=env,
+        ),
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", APP_DIR,
+             "--port", str(args.api_port), "--log-level", "warning"],
+            cwd=workdir, env=env,
+        ),
+    ]
+    try:
+        _wait_for(f"http://127.0.0.1:{args.llm_port}/api/tags", 30, processes[0])
+        # /ready turns 200 once the embedding model is loaded
+        _wait_for(f"http://127.0.0.1:{args.api_port}/ready", args.startup_timeout, processes[1])
+    except BaseException:
+        stop_stack(processes, workdir)
+        raise
+    return f"http://127.0.0.1:{args.api_port}", processes, workdir
+
+
+def stop_stack(processes, workdir):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_report(rows, wall):
+    print(f"\n⏱️ {wall:.1f}s wall clock")
+    print(f"{'endpoint':<24} {'reqs':>6} {'err%':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for r in rows:
+        print(
+            f"{r['endpoint']:<24} {r['requests']:>6} {r['error_rate'] * 100:>5.1f}% {r['rps']:>8.1f} "
+            f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f}"
+        )
+    for r in rows:
+        if r["errors"]:
+            print(f"  {r['endpoint']}: status counts {r['statuses']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="load an already running API instead of starting one")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight")
+    parser.add_argument("--requests", type=int, default=500, help="total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="run for this many seconds instead")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint weights, e.g. chat=70,login=30")
+    parser.add_argument("--queries", type=int, default=200, help="distinct questions sampled from resources/data")
+    parser.add_argument("--cache-bust", action="store_true", help="make every question unique (no answer cache hits)")
+    parser.add_argument("--timeout", type=float, default=300, help="per-request timeout (s)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="also write the results to this file")
+
+    stack = parser.add_argument_group("self-hosted stack (without --url)")
+    stack.add_argument("--api-port", type=int, default=8765)
+    stack.add_argument("--llm-port", type=int, default=11435)
+    stack.add_argument("--latency-ms", type=float, default=200, help="fake LLM delay before the first token")
+    stack.add_argument("--tokens-per-sec", type=float, default=40, help="fake LLM generation speed")
+    stack.add_argument("--answer-tokens", type=int, default=64, help="fake LLM answer length")
+    stack.add_argument("--llm-error-rate", type=float, default=0.0, help="fraction of fake LLM calls that fail")
+    stack.add_argument("--startup-timeout", type=float, default=300, help="seconds to wait for /ready")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    queries = [q for q, _ in sample_queries(load_chunks(), args.queries, seed=args.seed)]
+    print(f"📚 {len(queries)} questions, mix {mix}, concurrency {args.concurrency}")
+
+    processes, workdir = [], None
+    url = args.url
+    if url is None:
+        url, processes, workdir = start_stack(args)
+        print(f"🚀 API on {url}, fake LLM on :{args.llm_port}")
+
+    try:
+        rows, wall = asyncio.run(run_load(
+            url, mix, args.concurrency, args.requests, args.duration,
+            queries, args.cache_bust, args.seed, args.timeout,
+        ))
+    finally:
+        if processes:
+            stop_stack(processes, workdir)
+
+    print_report(rows, wall)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "wall_seconds": wall, "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
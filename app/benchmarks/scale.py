@@ -0,0 +1,131 @@
+"""
+Ingestion throughput and retrieval latency on synthetic corpora 10x, 100x and
+1000x the size of resources/data.
+
+For each scale a synthetic corpus is written to a scratch directory
+(corpus.build_synthetic_corpus) and indexed by running embed_doc.py there, so
+the real pipeline, Chroma shards, lexical index and DuckDB metadata are
+exercised without touching the app's own chroma_db / finsolve.db. Retrieval
+is then timed against the result: one role shard, the all-roles fan-out, and
+hybrid (BM25 + vector) search.
+
+    cd app && python -m benchmarks.scale --scales 10 100
+    cd app && python -m benchmarks.scale --scales 1000 --workers 8 --batch-size 128
+
+The 1000x corpus is several hundred thousand chunks and takes a while to embed
+on CPU.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from embeddings import create_embeddings
+from lexical_index import LexicalIndex, hybrid_search
+from pipeline import INGEST_WORKERS, EMBED_BATCH_SIZE
+from vector_store import ShardedChroma
+from benchmarks.corpus import build_synthetic_corpus, load_chunks, sample_queries, percentile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def ingest(workdir: str, workers: int, batch_size: int) -> float:
+    """Run embed_doc.py with `workdir` as cwd; returns wall seconds."""
+    env = {**os.environ, "PYTHONPATH": APP_DIR + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, os.path.join(APP_DIR, "embed_doc.py"),
+         "--workers", str(workers), "--batch-size", str(batch_size)],
+        cwd=workdir, env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def time_search(search, queries) -> dict:
+    latencies = []
+    for query, vector, role in queries:
+        start = time.perf_counter()
+        search(query, vector, role)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {f"p{p}_ms": percentile(latencies, p) for p in (50, 95, 99)}
+
+
+def run_scale(scale: int, args, embeddings, queries) -> dict:
+    root = tempfile.mkdtemp(prefix=f"finsolve_scale{scale}_")
+    # embed_doc.py reads ../resources/data relative to its working directory
+    data_dir = os.path.join(root, "resources", "data")
+    workdir = os.path.join(root, "app")
+    os.makedirs(workdir)
+    try:
+        files = build_synthetic_corpus(data_dir, scale, seed=args.seed)
+        seconds = ingest(workdir, args.workers, args.batch_size)
+
+        store = ShardedChroma(os.path.join(workdir, "chroma_db"), embedding_function=embeddings)
+        lexical = LexicalIndex.load(os.path.join(workdir, "chroma_db", "lexical_index.pkl"))
+        chunks = sum(store.counts().values())
+
+        result = {
+            "scale": scale,
+            "files": files,
+            "chunks": chunks,
+            "ingest_seconds": seconds,
+            "files_per_sec": files / seconds,
+            "chunks_per_sec": chunks / seconds,
+            "search": {
+                "shard": time_search(
+                    lambda q, v, role: store.similarity_search_by_vector(v, k=args.k, filter={"role": role}), queries),
+                "fan-out": time_search(
+                    lambda q, v, role: store.similarity_search_by_vector(v, k=args.k), queries),
+                "hybrid": time_search(
+                    lambda q, v, role: hybrid_search(store, lexical, q, v, role=role, k=args.k, candidates=args.candidates),
+                    queries),
+            },
+        }
+        print_result(result)
+        return result
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def print_result(r: dict):
+    print(
+        f"\n📦 {r['scale']}x: {r['files']} files, {r['chunks']} chunks indexed in {r['ingest_seconds']:.1f}s "
+        f"({r['files_per_sec']:.1f} files/s, {r['chunks_per_sec']:.1f} chunks/s)"
+    )
+    print(f"   {'search':<8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, t in r["search"].items():
+        print(f"   {name:<8} {t['p50_ms']:>8.2f} {t['p95_ms']:>8.2f} {t['p99_ms']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--candidates", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directories")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    embeddings = create_embeddings()
+    sampled = sample_queries(load_chunks(), args.queries, seed=args.seed)
+    vectors = embeddings.embed_documents([q for q, _ in sampled])
+    queries = [(q, v, doc.metadata["role"]) for (q, doc), v in zip(sampled, vectors)]
+
+    results = [run_scale(scale, args, embeddings, queries) for scale in args.scales]
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
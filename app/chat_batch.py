@@ -0,0 +1,66 @@
+"""
+Runs a file of questions through /chat/batch as one user and writes the
+answers as NDJSON (one line per question, plus the summary line).
+
+Questions are read one per line (blank lines and "#" comments are skipped);
+the user logs in first, so each run answers as that user's role:
+
+    python chat_batch.py questions/finance.txt -u Binoy -p financepass -o finance.ndjson
+"""
+
+import argparse
+import json
+import sys
+
+import httpx
+
+API_URL = "http://127.0.0.1:8000"
+
+
+def read_questions(path: str):
+    with (sys.stdin if path == "-" else open(path, encoding="utf-8")) as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+def main(args):
+    questions = read_questions(args.questions)
+    if not questions:
+        sys.exit("No questions to run")
+
+    with httpx.Client(base_url=args.url, timeout=httpx.Timeout(10.0, read=None)) as client:
+        login = client.get("/login", auth=(args.username, args.password))
+        if login.status_code != 200:
+            sys.exit(f"Login failed: {login.text}")
+        user = {"username": args.username, "role": login.json()["role"]}
+        print(f"🚀 {len(questions)} questions as {user['username']} ({user['role']})", file=sys.stderr)
+
+        out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+        try:
+            with client.stream("POST", "/chat/batch", json={"user": user, "questions": questions}) as response:
+                if response.status_code != 200:
+                    response.read()
+                    sys.exit(f"Batch failed: {response.text}")
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    out.write(line + "\n")
+                    out.flush()
+                    event = json.loads(line)
+                    if event["type"] == "error":
+                        print(f"❌ #{event['index']}: {event['detail']}", file=sys.stderr)
+                    elif event["type"] == "done":
+                        print(f"🎉 {event['answered']} answered ({event['cached']} from cache), "
+                              f"{event['errors']} errors in {event['elapsed_ms'] / 1000:.1f}s", file=sys.stderr)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", help="text file with one question per line ('-' for stdin)")
+    parser.add_argument("-u", "--username", required=True)
+    parser.add_argument("-p", "--password", required=True)
+    parser.add_argument("-o", "--output", help="NDJSON output file (default: stdout)")
+    parser.add_argument("--url", default=API_URL, help="FinSolve API base URL")
+    main(parser.parse_args())
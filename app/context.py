@@ -0,0 +1,185 @@
+"""
+Context assembly for the RAG prompt.
+
+Retrieved chunks overlap (CHUNK_OVERLAP characters are repeated between
+neighbours) and often come from the same few files, so joining them as-is
+wastes prompt tokens, and prefill time on a CPU-bound Ollama host grows with
+every token. assemble_context() turns the ranked chunks into a compact
+context:
+
+- drops exact duplicates and chunks whose text is contained in another one
+- merges neighbouring chunks of the same file (consecutive chunk_index),
+  removing the overlapping text, into one block per run
+- keeps blocks in retrieval rank order and stops at CONTEXT_TOKEN_BUDGET,
+  cutting the last block at a word boundary if it only partly fits
+
+Token counts are estimated at ~4 characters per token; Ollama's exact
+prompt_eval_count is exported on /metrics.
+"""
+
+import math
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from ingest import CHUNK_OVERLAP
+
+# ----------------------------
+# Config (override via env)
+# ----------------------------
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CHARS_PER_TOKEN = 4
+MIN_PARTIAL_TOKENS = 50          # don't bother adding a block cut shorter than this
+MIN_OVERLAP_CHARS = 10           # shorter suffix/prefix matches are coincidence
+
+BLOCK_SEPARATOR = "\n\n-----\n\n"
+
+PROMPT_TEMPLATE = """
+You are FinSolve-AI, an enterprise assistant.
+Your task is to give **long, detailed, well-structured answers** using ONLY the context provided.
+
+### Instructions:
+- Provide a **clear, multi-paragraph answer**
+- Include explanations, examples, reasoning steps
+- If the context contains multiple points, **summarize and connect them**
+- Never guess beyond the provided context
+- Write in a professional but easy-to-understand tone
+- Minimum length: **6–10 sentences**
+
+### User Role:
+{role}
+
+### Context:
+{context}
+
+{history}### Question:
+{question}
+
+### Final Answer (detailed and structured):
+"""
+
+
+def count_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+@dataclass
+class AssembledContext:
+    text: str
+    docs: List = field(default_factory=list)     # chunks that made it into the context
+    tokens: int = 0
+    input_tokens: int = 0                          # before dedup / merge / budget
+    dropped: int = 0                               # chunks left out (duplicates or over budget)
+
+    @property
+    def sources(self) -> List[str]:
+        return [d.metadata.get("source", "unknown") for d in self.docs]
+
+    @property
+    def chunk_ids(self) -> List[str]:
+        return [d.metadata.get("chunk_id", "") for d in self.docs]
+
+
+def _join_overlapping(a: str, b: str) -> str:
+    """a + b without the text b repeats from the end of a."""
+    longest = min(len(a), len(b), CHUNK_OVERLAP * 2)
+    for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if a.endswith(b[:size]):
+            return a + b[size:]
+    return a + "\n" + b
+
+
+def _dedupe(docs) -> List:
+    kept = []
+    for d in docs:
+        text = d.page_content.strip()
+        if not text or any(text in k.page_content for k in kept):
+            continue
+        # an earlier, shorter chunk that this one contains is redundant now
+        kept = [k for k in kept if k.page_content.strip() not in text]
+        kept.append(d)
+    return kept
+
+
+def _blocks(docs) -> List[Dict]:
+    """Group runs of neighbouring chunks of one file, in rank order."""
+    blocks: List[Dict] = []
+    by_file: Dict[tuple, List[Dict]] = {}
+    for rank, d in enumerate(docs):
+        # chunk_index is only comparable within one version of the file
+        key = (d.metadata.get("role"), d.metadata.get("source"), d.metadata.get("file_hash"))
+        index = d.metadata.get("chunk_index")
+        block = None
+        if index is not None:
+            # chunks without a chunk_index (legacy / migrated) are never merged
+            block = next(
+                (b for b in by_file.get(key, [])
+                 if b["first"] is not None and b["first"] - 1 <= index <= b["last"] + 1),
+                None,
+            )
+        if block is None:
+            block = {"rank": rank, "docs": [], "first": index, "last": index}
+            blocks.append(block)
+            by_file.setdefault(key, []).append(block)
+        else:
+            block["first"] = min(block["first"], index)
+            block["last"] = max(block["last"], index)
+        block["docs"].append(d)
+
+    for block in blocks:
+        ordered = sorted(block["docs"], key=lambda d: d.metadata.get("chunk_index") or 0)
+        text = ordered[0].page_content.strip()
+        for d in ordered[1:]:
+            text = _join_overlapping(text, d.page_content.strip())
+        block["text"] = text
+    return sorted(blocks, key=lambda b: b["rank"])
+
+
+def _truncate(text: str, tokens: int) -> str:
+    cut = text[: tokens * CHARS_PER_TOKEN]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > 0 else cut) + " …"
+
+
+def assemble_context(docs, budget: int = CONTEXT_TOKEN_BUDGET) -> AssembledContext:
+    # what joining every chunk as-is would have cost
+    input_tokens = count_tokens(BLOCK_SEPARATOR.join(d.page_content for d in docs))
+    unique = _dedupe(docs)
+
+    parts, used, tokens = [], [], 0
+    separator_tokens = count_tokens(BLOCK_SEPARATOR)
+    for block in _blocks(unique):
+        text = block["text"]
+        cost = count_tokens(text) + (separator_tokens if parts else 0)
+        remaining = budget - tokens
+        if cost > remaining:
+            # the first block always goes in (cut to the budget); later ones only if a useful part fits
+            if parts and remaining < MIN_PARTIAL_TOKENS:
+                break
+            text = _truncate(text, remaining - (separator_tokens if parts else 0))
+            cost = count_tokens(text) + (separator_tokens if parts else 0)
+        parts.append(text)
+        used.extend(block["docs"])
+        tokens += cost
+        if tokens >= budget:
+            break
+
+    text = BLOCK_SEPARATOR.join(parts)
+    return AssembledContext(
+        text=text,
+        docs=used,
+        tokens=count_tokens(text),
+        input_tokens=input_tokens,
+        dropped=len(docs) - len(used),
+    )
+
+
+HISTORY_TEMPLATE = """### Conversation so far (use it to understand the question, answer from the context):
+{history}
+
+"""
+
+
+def build_prompt(role: str, context: str, question: str, history: str = "") -> str:
+    history = HISTORY_TEMPLATE.format(history=history) if history else ""
+    return PROMPT_TEMPLATE.format(role=role, context=context, question=question, history=history)
@@ -1,10 +1,181 @@
 import duckdb
+import httpx
 import json
+import os
+import atexit
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from metrics import Histogram
 
 DB_PATH = "finsolve.db"
 
+# finsolve.db is locked by whichever process has it open; embed_doc.py and a
+# single-process API take turns, each retrying for up to this long (seconds)
+DB_LOCK_TIMEOUT = float(os.getenv("DB_LOCK_TIMEOUT", "60"))
+
+# Multi-worker mode: when set, this process never opens finsolve.db itself;
+# statements and audit rows go to the state server (state_server.py) that owns it
+STATE_URL = os.getenv("STATE_URL", "").rstrip("/")
+STATE_TOKEN = os.getenv("STATE_TOKEN", "")              # shared secret, required by the state server
+STATE_TIMEOUT = float(os.getenv("STATE_TIMEOUT", "300"))
+STATE_STARTUP_TIMEOUT = float(os.getenv("STATE_STARTUP_TIMEOUT", "60"))   # workers wait this long for it
+
+# Audit writer batching (override via env)
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))              # flush when this many rows are queued
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))    # ...or at least this often (seconds)
+
+# doc_chunks.origin / tabular_sources.origin
+ORIGIN_CORPUS = "corpus"      # indexed by embed_doc.py from resources/data
+ORIGIN_UPLOAD = "upload"      # uploaded through /upload-docs (no file embed_doc.py can see)
+
+AUDIT_FLUSH_SECONDS = Histogram("audit_flush_seconds", "Time to write one batch of audit rows to DuckDB")
+
+
+class StateServerError(RuntimeError):
+    """The state server could not be reached (status_code None) or failed a request."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+_state_client = None
+_state_client_lock = threading.Lock()
+
+
+def state_request(method, path, **kwargs):
+    """
+    Call the state server (STATE_URL) and return its JSON body. DuckDB errors
+    raised there are re-raised here with the same type (e.g. ConstraintException).
+    """
+    global _state_client
+    with _state_client_lock:
+        if _state_client is None:
+            headers = {"Authorization": f"Bearer {STATE_TOKEN}"} if STATE_TOKEN else {}
+            _state_client = httpx.Client(
+                base_url=STATE_URL, headers=headers,
+                timeout=httpx.Timeout(STATE_TIMEOUT, connect=5.0),
+            )
+    try:
+        response = _state_client.request(method, path, **kwargs)
+    except httpx.HTTPError as e:
+        raise StateServerError(f"state server {STATE_URL}: {e}") from e
+
+    if response.status_code >= 400:
+        try:
+            body = response.json()
+        except ValueError:
+            raise StateServerError(
+                f"state server {STATE_URL}: {response.status_code} {response.text}", response.status_code,
+            )
+        error = getattr(duckdb, body.get("error") or "", None)
+        if isinstance(error, type) and issubclass(error, duckdb.Error):
+            raise error(body.get("detail"))
+        raise StateServerError(f"state server {STATE_URL}: {body.get('detail')}", response.status_code)
+    return response.json()
+
+
+def wait_for_state_server(timeout=STATE_STARTUP_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return state_request("GET", "/health")
+        except StateServerError as e:
+            # only wait while it is starting up; a wrong STATE_TOKEN won't fix itself
+            if e.status_code is not None or time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+class RemoteConnection:
+    """
+    The part of the DuckDB connection API the app uses (execute / fetchone /
+    fetchall / close), run on the state server. Statements between BEGIN
+    TRANSACTION and COMMIT are sent together and run as one transaction there.
+    """
+
+    def __init__(self):
+        self._rows = []
+        self._transaction = None
+
+    def execute(self, sql, params=None):
+        statement = sql.strip().upper()
+        if statement.startswith("BEGIN"):
+            self._transaction = []
+        elif statement == "COMMIT":
+            statements, self._transaction = self._transaction or [], None
+            self._run(statements, transaction=True)
+        elif statement == "ROLLBACK":
+            self._transaction = None
+        elif self._transaction is not None:
+            self._transaction.append({"sql": sql, "params": list(params) if params else None})
+        else:
+            self._run([{"sql": sql, "params": list(params) if params else None}], transaction=False)
+        return self
+
+    def _run(self, statements, transaction):
+        self._rows = []
+        if statements:
+            result = state_request("POST", "/sql", json={"statements": statements, "transaction": transaction})
+            self._rows = [tuple(row) for row in result["rows"]]
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def close(self):
+        self._transaction = None
+
+
+# DuckDB shares one database instance between the connections of a process and
+# tears it down when the last one closes; a connect racing that teardown fails
+# ("Unique file handle conflict"), so opening and closing are serialized
+_open_close_lock = threading.Lock()
+
+
+def _is_lock_conflict(e: duckdb.IOException) -> bool:
+    return "lock" in str(e).lower()
+
+
+class LocalConnection:
+    """
+    A DuckDB connection whose close() is serialized with connect(). While
+    another process holds the file lock, connecting retries with backoff for
+    up to DB_LOCK_TIMEOUT seconds.
+    """
+
+    def __init__(self, db_path):
+        deadline = time.monotonic() + DB_LOCK_TIMEOUT
+        delay = 0.05
+        while True:
+            try:
+                with _open_close_lock:
+                    self._con = duckdb.connect(db_path, read_only=False)
+                return
+            except duckdb.IOException as e:
+                if not _is_lock_conflict(e) or time.monotonic() + delay > deadline:
+                    raise
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+    def close(self):
+        with _open_close_lock:
+            self._con.close()
+
+
 def get_conn():
-    return duckdb.connect(DB_PATH, read_only=False)
+    if STATE_URL:
+        return RemoteConnection()
+    return LocalConnection(DB_PATH)
 
 def init_db():
     con = get_conn()
@@ -20,6 +191,14 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    # content fingerprints for incremental re-indexing
+    con.execute("ALTER TABLE doc_chunks ADD COLUMN IF NOT EXISTS content_hash TEXT")
+    con.execute("ALTER TABLE doc_chunks ADD COLUMN IF NOT EXISTS file_hash TEXT")
+    # heading path of markdown chunks ("Q1 - January to March 2024 > Cash Flow Analysis")
+    con.execute("ALTER TABLE doc_chunks ADD COLUMN IF NOT EXISTS section TEXT")
+    # who indexed the file: "corpus" (embed_doc.py, resources/data) or "upload"
+    # (/upload-docs); embed_doc.py only reconciles deletions of its own files
+    con.execute("ALTER TABLE doc_chunks ADD COLUMN IF NOT EXISTS origin TEXT")
 
     # --- Chat Logs ---
     # IMPORTANT: DuckDB will auto-generate the rowid if you don't specify id
@@ -34,32 +213,343 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    # per-stage request timings in ms, JSON {"embed": 3.1, "llm": 2100.4, ...}
+    con.execute("ALTER TABLE chat_logs ADD COLUMN IF NOT EXISTS stage_timings TEXT")
+
+    # --- Tabular sources loaded as DuckDB tables (see structured.py) ---
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS tabular_sources (
+            table_name TEXT PRIMARY KEY,
+            file_name TEXT,
+            role TEXT,
+            file_hash TEXT,
+            row_count BIGINT,
+            loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    con.execute("ALTER TABLE tabular_sources ADD COLUMN IF NOT EXISTS origin TEXT")
+
+    # --- Users / roles (see auth.py) ---
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password_hash TEXT,
+            role TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS roles (
+            role TEXT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # --- Change counters that multi-worker processes poll to reload shared state ---
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS state_versions (
+            name TEXT PRIMARY KEY,
+            version BIGINT
+        )
+    """)
 
     con.close()
 
 
-def log_doc_chunk(chunk_id, file_name, role, department, source):
+# ----------------------------
+# Shared state versions
+# ----------------------------
+def bump_version(name):
+    """Record a change to shared state ("users", "tables", "index:<role>", ...)."""
     con = get_conn()
     con.execute("""
-        INSERT OR REPLACE INTO doc_chunks
-        (chunk_id, file_name, role, department, source)
-        VALUES (?, ?, ?, ?, ?)
-    """, (chunk_id, file_name, role, department, source))
+        INSERT INTO state_versions VALUES (?, 1)
+        ON CONFLICT (name) DO UPDATE SET version = version + 1
+    """, (name,))
     con.close()
 
 
-def log_chat(username, role, query, chunk_ids, answer_text):
+def load_versions():
     con = get_conn()
+    rows = con.execute("SELECT name, version FROM state_versions").fetchall()
+    con.close()
+    return dict(rows)
 
-    # Insert NULL into id → DuckDB assigns automatic internal rowid
-    con.execute("""
-        INSERT INTO chat_logs (id, username, role, query, doc_chunk_ids, answer_preview)
-        VALUES (NULL, ?, ?, ?, ?, ?)
-    """, (
-        username,
-        role,
-        query,
-        json.dumps(chunk_ids),
-        answer_text[:200] if answer_text else ""
-    ))
+
+# ----------------------------
+# Users / roles
+# ----------------------------
+def load_users():
+    """username -> {"password_hash", "role"}"""
+    con = get_conn()
+    rows = con.execute("SELECT username, password_hash, role FROM users").fetchall()
+    con.close()
+    return {u: {"password_hash": h, "role": r} for u, h, r in rows}
+
+
+def load_roles():
+    con = get_conn()
+    rows = con.execute("SELECT role FROM roles").fetchall()
+    con.close()
+    return [r for (r,) in rows]
+
+
+def insert_user(username, password_hash, role):
+    con = get_conn()
+    con.execute("INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)", (username, password_hash, role))
+    con.close()
+    bump_version("users")
+
+
+def insert_role(role):
+    con = get_conn()
+    con.execute("INSERT OR IGNORE INTO roles (role) VALUES (?)", (role,))
+    con.close()
+    bump_version("users")
+
+
+# ----------------------------
+# Buffered audit writer
+# ----------------------------
+class AuditWriter:
+    """
+    Queues audit rows in memory and writes them to DuckDB in bulk, either when
+    AUDIT_BATCH_SIZE rows are pending or every AUDIT_FLUSH_INTERVAL seconds.
+    Pending rows are flushed on close(). Each batch opens its own connection
+    and closes it again, so the file lock is only held while a batch is written
+    and embed_doc.py can run next to the API; a batch that finds the file
+    locked is retried with the next flush.
+    """
+
+    def __init__(self, db_path=DB_PATH, batch_size=AUDIT_BATCH_SIZE, flush_interval=AUDIT_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._chat_rows = []
+        self._chunk_rows = []
+        self._buffer_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _enqueue(self, rows, row):
+        with self._buffer_lock:
+            rows.append(row)
+            pending = len(self._chat_rows) + len(self._chunk_rows)
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def add_chat(self, row):
+        self._enqueue(self._chat_rows, row)
+
+    def add_doc_chunk(self, row):
+        self._enqueue(self._chunk_rows, row)
+
+    def flush(self):
+        with self._buffer_lock:
+            chat_rows, self._chat_rows = self._chat_rows, []
+            chunk_rows, self._chunk_rows = self._chunk_rows, []
+
+        if not chat_rows and not chunk_rows:
+            return
+
+        try:
+            self.write(chat_rows, chunk_rows)
+        except Exception as e:
+            print(f"❌ Audit flush failed, will retry: {e}")
+            # put rows back in front so they go out with the next flush
+            with self._buffer_lock:
+                self._chat_rows[:0] = chat_rows
+                self._chunk_rows[:0] = chunk_rows
+
+    def write(self, chat_rows, chunk_rows):
+        """Write rows now, in one transaction (raises if it fails)."""
+        with self._write_lock:
+            start = time.perf_counter()
+            con = LocalConnection(self.db_path)
+            try:
+                con.execute("BEGIN TRANSACTION")
+                if chunk_rows:
+                    self._write_doc_chunks(con, chunk_rows)
+                if chat_rows:
+                    self._write_chats(con, chat_rows)
+                con.execute("COMMIT")
+                AUDIT_FLUSH_SECONDS.observe(time.perf_counter() - start)
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+            finally:
+                con.close()
+
+    def _write_doc_chunks(self, con, rows):
+        # one row per chunk_id (last write wins), like INSERT OR REPLACE
+        batch = pd.DataFrame(rows).drop_duplicates("chunk_id", keep="last")
+        con.register("doc_chunk_batch", batch)
+        con.execute("""
+            INSERT OR REPLACE INTO doc_chunks
+            (chunk_id, file_name, role, department, source, content_hash, file_hash, section, origin)
+            SELECT chunk_id, file_name, role, department, source, content_hash, file_hash, section, origin
+            FROM doc_chunk_batch
+        """)
+        con.unregister("doc_chunk_batch")
+
+    def _write_chats(self, con, rows):
+        batch = pd.DataFrame(rows)
+        con.register("chat_batch", batch)
+        con.execute("""
+            INSERT INTO chat_logs (id, username, role, query, doc_chunk_ids, answer_preview, created_at, stage_timings)
+            SELECT NULL, username, role, query, doc_chunk_ids, answer_preview, created_at, stage_timings
+            FROM chat_batch
+        """)
+        con.unregister("chat_batch")
+
+    def write_chats(self, rows):
+        """Insert many chat rows now, in one statement (batch chat); queued for retry if it fails."""
+        if not rows:
+            return
+        try:
+            self.write(rows, [])
+        except Exception as e:
+            print(f"❌ Bulk chat insert failed, queued for the next flush: {e}")
+            with self._buffer_lock:
+                self._chat_rows.extend(rows)
+
+    def delete_doc_chunks(self, chunk_ids):
+        # flush first so a queued insert can't resurrect a deleted chunk
+        self.flush()
+        with self._write_lock:
+            con = LocalConnection(self.db_path)
+            try:
+                con.execute(
+                    "DELETE FROM doc_chunks WHERE chunk_id IN (SELECT unnest(?::VARCHAR[]))",
+                    [list(chunk_ids)],
+                )
+            finally:
+                con.close()
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+
+
+class RemoteAuditWriter(AuditWriter):
+    """AuditWriter for multi-worker mode: same batching, but batches are written by the state server."""
+
+    def write(self, chat_rows, chunk_rows):
+        start = time.perf_counter()
+        chats = [{**row, "created_at": row["created_at"].isoformat()} for row in chat_rows]
+        state_request("POST", "/audit", json={"chats": chats, "doc_chunks": chunk_rows})
+        AUDIT_FLUSH_SECONDS.observe(time.perf_counter() - start)
+
+    def delete_doc_chunks(self, chunk_ids):
+        self.flush()
+        state_request("POST", "/audit/delete-doc-chunks", json={"chunk_ids": list(chunk_ids)})
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = RemoteAuditWriter() if STATE_URL else AuditWriter()
+            _writer.start()
+            atexit.register(close_writer)
+        return _writer
+
+
+def flush_writer():
+    """Write all queued audit rows now (e.g. before reading them back)."""
+    if _writer is not None:
+        _writer.flush()
+
+
+def close_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+
+
+def log_doc_chunk(chunk_id, file_name, role, department, source, content_hash=None, file_hash=None, section=None,
+                  origin=ORIGIN_CORPUS):
+    get_writer().add_doc_chunk({
+        "chunk_id": chunk_id,
+        "file_name": file_name,
+        "role": role,
+        "department": department,
+        "source": source,
+        "content_hash": content_hash,
+        "file_hash": file_hash,
+        "section": section,
+        "origin": origin,
+    })
+
+
+def delete_doc_chunks(chunk_ids):
+    if chunk_ids:
+        get_writer().delete_doc_chunks(chunk_ids)
+
+
+def get_indexed_files(role=None, file_name=None):
+    """
+    Map (role, file_name) -> {"file_hash", "chunk_ids", "origin"} for indexed
+    files, optionally restricted to one role / file. Files indexed before
+    origins were recorded count as ORIGIN_CORPUS.
+    """
+    flush_writer()
+    con = get_conn()
+    rows = con.execute("""
+        SELECT role, file_name, max(file_hash), list(chunk_id), coalesce(max(origin), ?)
+        FROM doc_chunks
+        WHERE (? IS NULL OR role = ?) AND (? IS NULL OR file_name = ?)
+        GROUP BY role, file_name
+    """, (ORIGIN_CORPUS, role, role, file_name, file_name)).fetchall()
     con.close()
+
+    return {
+        (r, f): {"file_hash": file_hash, "chunk_ids": set(chunk_ids), "origin": origin}
+        for r, f, file_hash, chunk_ids, origin in rows
+    }
+
+
+def chat_row(username, role, query, chunk_ids, answer_text, timings=None):
+    # created_at is taken now, not when the batch is flushed
+    return {
+        "username": username,
+        "role": role,
+        "query": query,
+        "doc_chunk_ids": json.dumps(chunk_ids),
+        "answer_preview": answer_text[:200] if answer_text else "",
+        "created_at": datetime.now(),
+        "stage_timings": json.dumps({k: round(v * 1000, 1) for k, v in timings.items()}) if timings else None,
+    }
+
+
+def log_chat(username, role, query, chunk_ids, answer_text, timings=None):
+    get_writer().add_chat(chat_row(username, role, query, chunk_ids, answer_text, timings))
+
+
+def log_chats(rows):
+    """Audit rows built with chat_row(), written with one bulk insert."""
+    get_writer().write_chats(rows)
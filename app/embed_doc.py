@@ -1,133 +1,239 @@
 """
 Loads department documents, splits into chunks, generates embeddings,
 stores metadata in DuckDB, and saves embeddings into Chroma vector DB.
+
+Indexing is incremental: files whose content hash and splitter (see
+ingest.file_fingerprint) are unchanged are skipped, changed files only
+re-embed chunks whose text changed, and chunks of files that were deleted
+are removed from both Chroma and DuckDB.
+Pass --rebuild to drop the collection and re-embed everything.
+
+Vectors are stored in one Chroma collection per role (vector_store.py); an
+old single-collection chroma_db is migrated on the first run.
+Changed files go through the parallel pipeline in pipeline.py
+(see --workers / --batch-size / --queue-size).
 """
 
+import argparse
 import os
-import shutil
-import uuid
-
-from langchain_community.document_loaders import (
-    UnstructuredFileLoader,
-    CSVLoader,
-    TextLoader,
-    PyPDFLoader,
-)
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
+import time
 
-# DuckDB imports
-from db import init_db, log_doc_chunk
+from langchain_core.documents import Document
 
-# ----------------------------
-# Init DuckDB
-# ----------------------------
-init_db()
+# DuckDB imports
+from db import init_db, get_indexed_files, close_writer, bump_version, ORIGIN_UPLOAD
+from embedding_cache import CachedEmbeddings, EmbeddingCache, EMBED_CACHE
+from embeddings import create_embeddings
+from ingest import remove_file, file_sha256, file_fingerprint, is_supported
+from lexical_index import LexicalIndex
+from structured import load_table, drop_table, get_tabular_sources, table_name_for
+from pipeline import IngestPipeline, INGEST_WORKERS, EMBED_BATCH_SIZE, INGEST_QUEUE_SIZE
+from vector_store import ShardedChroma, CHROMA_DIR, index_write_lock
 
 # ----------------------------
 # Directory / DB config
 # ----------------------------
 BASE_DIR = "../resources/data"      # folder containing department subfolders
-CHROMA_DIR = "chroma_db"
-COLLECTION_NAME = "company_docs"
 
-# Embeddings
-embedding_function = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
-# Start fresh Chroma DB
-shutil.rmtree(CHROMA_DIR, ignore_errors=True)
-
-all_split_docs = []
-
-# ----------------------------
-# Process each department
-# ----------------------------
-for department in os.listdir(BASE_DIR):
-    dept_path = os.path.join(BASE_DIR, department)
-    if not os.path.isdir(dept_path):
-        continue
 
-    print(f"\n🔍 Processing department: {department}")
-    dept_docs = []
-
-    for fname in os.listdir(dept_path):
-        file_path = os.path.join(dept_path, fname)
-        if not os.path.isfile(file_path):
+def main(
+    rebuild: bool = False,
+    workers: int = INGEST_WORKERS,
+    batch_size: int = EMBED_BATCH_SIZE,
+    queue_size: int = INGEST_QUEUE_SIZE,
+):
+    # the state server may be indexing an upload: wait for it, and hold uploads
+    # off until this run is done
+    with index_write_lock(CHROMA_DIR):
+        sync_index(rebuild, workers, batch_size, queue_size)
+
+
+def sync_index(rebuild: bool, workers: int, batch_size: int, queue_size: int):
+    start = time.perf_counter()
+
+    # ----------------------------
+    # Init DuckDB + Chroma
+    # ----------------------------
+    init_db()
+
+    # Embeddings, through the on-disk cache shared with /upload-docs
+    embedding_function = create_embeddings()
+    embedding_cache = EmbeddingCache() if EMBED_CACHE else None
+    if embedding_cache is not None:
+        embedding_function = CachedEmbeddings(embedding_function, embedding_cache)
+
+    # One collection per role (see vector_store.py)
+    vectordb = ShardedChroma(CHROMA_DIR, embedding_function=embedding_function)
+
+    indexed = get_indexed_files()
+    lexical = LexicalIndex.load()
+
+    # Files uploaded through /upload-docs aren't under BASE_DIR: they are never
+    # treated as deleted, and their chunks count as known below
+    uploaded = {key: entry for key, entry in indexed.items() if entry["origin"] == ORIGIN_UPLOAD}
+    indexed = {key: entry for key, entry in indexed.items() if key not in uploaded}
+    upload_ids = set().union(*(entry["chunk_ids"] for entry in uploaded.values()))
+
+    if rebuild:
+        print("♻️ Rebuilding index from scratch")
+        # uploads have no source file to re-read: keep their text and re-embed it
+        stored = vectordb.get(ids=sorted(upload_ids), include=["documents", "metadatas"]) if upload_ids else None
+        vectordb.delete_collection()
+        vectordb.drop_legacy()
+        for entry in indexed.values():
+            remove_file(vectordb, entry["chunk_ids"])
+        lexical.clear()
+        indexed = {}
+        if stored and stored["ids"]:
+            vectordb.add_documents(
+                [Document(page_content=text, metadata=metadata)
+                 for text, metadata in zip(stored["documents"], stored["metadatas"])],
+                ids=stored["ids"],
+            )
+            print(f"📤 Re-embedded {len(stored['ids'])} chunks of {len(uploaded)} uploaded files")
+    elif vectordb.legacy_count():
+        # chroma_db from before sharding: move the vectors over instead of re-embedding
+        moved = vectordb.migrate_legacy()
+        print(f"🔀 Moved {sum(moved.values())} chunks into per-role collections")
+
+    seen = set()
+    known_ids = set(upload_ids)
+    jobs = []
+    tabular = {}
+    unchanged = 0
+
+    # ----------------------------
+    # Find new / changed files in each department
+    # ----------------------------
+    for department in sorted(os.listdir(BASE_DIR)):
+        dept_path = os.path.join(BASE_DIR, department)
+        if not os.path.isdir(dept_path):
             continue
 
-        try:
-            if fname.endswith(".md") or fname.endswith(".txt"):
-                try:
-                    loader = UnstructuredFileLoader(file_path)
-                    docs = loader.load()
-                except Exception:
-                    loader = TextLoader(file_path, encoding="utf-8")
-                    docs = loader.load()
-
-            elif fname.endswith(".csv"):
-                loader = CSVLoader(file_path)
-                docs = loader.load()
-
-            elif fname.endswith(".pdf"):
-                loader = PyPDFLoader(file_path)
-                docs = loader.load()
+        role = department.lower()
 
-            else:
+        for fname in sorted(os.listdir(dept_path)):
+            file_path = os.path.join(dept_path, fname)
+            if not os.path.isfile(file_path) or not is_supported(fname):
                 # skip unsupported formats
                 continue
 
-            # add basic metadata at document level
-            for d in docs:
-                d.metadata["file_name"] = fname
-                d.metadata["role"] = department.lower()
-                d.metadata["department"] = department.lower()
-                d.metadata["source"] = fname
-
-            dept_docs.extend(docs)
-
-        except Exception as e:
-            print(f"❌ Failed to load {file_path}: {e}")
-
-    if not dept_docs:
-        print(f"⚠️ No documents found for: {department}")
-        continue
-
-    # Split into chunks
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    split_docs = splitter.split_documents(dept_docs)
-
-    for doc in split_docs:
-        # unique ID for this chunk
-        chunk_id = str(uuid.uuid4())
-        doc.metadata["chunk_id"] = chunk_id
-
-        # make sure these are present
-        role = doc.metadata.get("role", department.lower())
-        dept = doc.metadata.get("department", department.lower())
-        source = doc.metadata.get("source", doc.metadata.get("file_name", "unknown"))
-        file_name = doc.metadata.get("file_name", source)
-
-        # log chunk metadata into DuckDB
-        log_doc_chunk(
-            chunk_id=chunk_id,
-            file_name=file_name,
-            role=role,
-            department=dept,
-            source=source,
-        )
+            key = (role, fname)
+            seen.add(key)
+            # a corpus file with an uploaded file's name replaces the upload
+            previous = indexed.get(key) or uploaded.get(key) or {"file_hash": None, "chunk_ids": set()}
 
-    all_split_docs.extend(split_docs)
-    print(f"✅ Created {len(split_docs)} chunks for {department}")
+            file_hash = file_sha256(file_path)
+            if fname.endswith(".csv"):
+                tabular[table_name_for(role, fname)] = (file_path, fname, role, file_hash)
 
-# ----------------------------
-# Store chunks in Chroma
-# ----------------------------
-vectordb = Chroma.from_documents(
-    documents=all_split_docs,
-    embedding=embedding_function,
-    persist_directory=CHROMA_DIR,
-    collection_name=COLLECTION_NAME,
-)
-
-print(f"\n🎉 Successfully stored {len(all_split_docs)} chunks in Chroma DB.")
+            # content hash + splitter: a new splitter re-chunks unchanged files too
+            fingerprint = file_fingerprint(file_hash, fname)
+            if fingerprint == previous["file_hash"]:
+                unchanged += 1
+                known_ids |= previous["chunk_ids"]
+                continue
+
+            jobs.append({
+                "file_path": file_path,
+                "file_name": fname,
+                "role": role,
+                "file_hash": fingerprint,
+                "previous_ids": previous["chunk_ids"],
+            })
+
+    print(f"🔍 {len(jobs)} new/changed files, {unchanged} unchanged")
+
+    # ----------------------------
+    # Load, split, embed and upsert changed files
+    # ----------------------------
+    totals = {"updated": 0, "added": 0, "removed": 0, "failed": 0}
+    if jobs:
+        pipeline = IngestPipeline(
+            vectordb,
+            embedding_function,
+            workers=workers,
+            batch_size=batch_size,
+            queue_size=queue_size,
+            lexical=lexical,
+        )
+        result = pipeline.run(jobs)
+        known_ids |= result.pop("chunk_ids")
+        totals.update(result)
+
+    # ----------------------------
+    # Files deleted since the last run
+    # ----------------------------
+    for key in set(indexed) - seen:
+        removed = remove_file(vectordb, indexed[key]["chunk_ids"], lexical=lexical)
+        totals["removed"] += removed
+        print(f"🗑️ {key[0]}/{key[1]} deleted, removed {removed} chunks")
+
+    # Vectors with no doc_chunks row (e.g. from the old random-id indexer)
+    orphans = [i for i in vectordb.get(include=[])["ids"] if i not in known_ids]
+    if orphans:
+        vectordb.delete(ids=orphans)
+        totals["removed"] += len(orphans)
+        print(f"🧹 Removed {len(orphans)} orphaned vectors")
+
+    # ----------------------------
+    # Tabular files -> DuckDB tables for SQL answers
+    # ----------------------------
+    loaded_tables = get_tabular_sources()
+    for table, (file_path, fname, role, file_hash) in tabular.items():
+        if loaded_tables.get(table, {}).get("file_hash") != file_hash:
+            load_table(file_path, fname, role, file_hash)
+            print(f"📊 Loaded {fname} into table {table}")
+    for table in set(loaded_tables) - set(tabular):
+        if loaded_tables[table]["origin"] == ORIGIN_UPLOAD:
+            continue
+        drop_table(table)
+        print(f"🗑️ Dropped table {table}")
+
+    # ----------------------------
+    # Lexical (BM25) index: backfill chunks indexed before it existed
+    # ----------------------------
+    lexical.remove(lexical.ids() - known_ids)
+    missing = sorted(known_ids - lexical.ids())
+    if missing:
+        stored = vectordb.get(ids=missing, include=["documents", "metadatas"])
+        for chunk_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+            lexical.add(chunk_id, metadata.get("role", ""), text)
+        print(f"🔤 Added {len(stored['ids'])} existing chunks to the lexical index")
+    lexical.save()
+
+    # API workers in multi-worker mode reopen the vector index when these change
+    if rebuild or totals["updated"] or totals["removed"]:
+        for role in vectordb.roles():
+            bump_version(f"index:{role}")
+
+    # Write any queued chunk metadata to DuckDB
+    close_writer()
+
+    if embedding_cache is not None:
+        cache = embedding_cache.stats()
+        print(f"💾 Embedding cache: {cache['hits']} hits, {cache['misses']} misses, "
+              f"{cache['entries']} entries ({cache['bytes'] / 1e6:.1f} MB)")
+
+    print(
+        f"\n🎉 Index up to date in {time.perf_counter() - start:.1f}s: "
+        f"{totals['updated']} files updated, {unchanged} unchanged, {totals['failed']} failed, "
+        f"{totals['added']} chunks embedded, {totals['removed']} removed."
+    )
+    if totals["failed"]:
+        print(f"⚠️ {totals['failed']} files failed to index and will be retried on the next run.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="drop the collection and re-embed everything")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="load/split worker processes")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="chunks per embedding batch")
+    parser.add_argument("--queue-size", type=int, default=INGEST_QUEUE_SIZE, help="batches buffered between stages")
+    args = parser.parse_args()
+    main(
+        rebuild=args.rebuild,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        queue_size=args.queue_size,
+    )
@@ -0,0 +1,236 @@
+"""
+Persistent, content-addressed cache of document embeddings, shared by
+embed_doc.py and /upload-docs.
+
+Re-running embed_doc.py --rebuild, or uploading a file again, would otherwise
+re-encode text that was embedded before. CachedEmbeddings.embed_documents()
+looks every text up first and only sends the misses to the model.
+
+- keys are the first 16 bytes of sha256(model key + text), where the model key
+  is EMBEDDING_MODEL plus EMBEDDING_BACKEND (onnx-int8 vectors differ slightly)
+- one file per model and dtype: fixed-size (key, vector) records, memory-mapped
+  for reads and appended to under an exclusive file lock, so the API and
+  embed_doc.py can use the same cache at once; the key -> row index is rebuilt
+  from the key column on open and extended as other processes append
+- vectors are stored as float16 by default (EMBED_CACHE_DTYPE), half the size
+  of float32, and returned as float32
+- the file is bounded at EMBED_CACHE_MAX_ENTRIES records: past that it is
+  compacted down to the EMBED_CACHE_KEEP fraction it used most recently
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from embeddings import EMBEDDING_MODEL, EMBEDDING_BACKEND
+
+# ----------------------------
+# Config (override via env)
+# ----------------------------
+EMBED_CACHE = os.getenv("EMBED_CACHE", "1") == "1"
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "embedding_cache")
+EMBED_CACHE_DTYPE = os.getenv("EMBED_CACHE_DTYPE", "float16")                 # float16 | float32
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "500000"))
+EMBED_CACHE_KEEP = 0.8               # fraction of max entries kept when the file is compacted
+
+KEY_BYTES = 16
+
+
+def model_key(model: str = EMBEDDING_MODEL, backend: str = EMBEDDING_BACKEND) -> str:
+    return f"{model}:{backend}"
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        key: Optional[str] = None,
+        cache_dir: str = EMBED_CACHE_DIR,
+        max_entries: int = EMBED_CACHE_MAX_ENTRIES,
+        dtype: str = EMBED_CACHE_DTYPE,
+    ):
+        self.model_key = key or model_key()
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9._-]+", "_", self.model_key)
+        self.path = os.path.join(cache_dir, f"{name}.{self.dtype.name}.bin")
+        self.meta_path = os.path.join(cache_dir, f"{name}.{self.dtype.name}.json")
+        self.lock_path = self.path + ".lock"
+
+        self._lock = threading.Lock()
+        self._record = None                  # structured dtype, known once the vector size is
+        self._rows = None                    # memmap of the file
+        self._inode = None
+        self._index: Dict[bytes, int] = {}
+        self._used = np.zeros(0, dtype=np.int64)   # recency clock per row, for compaction
+        self._clock = 0
+        self._stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0, "compactions": 0}
+
+        self._load_meta()
+
+    # ----------------------------
+    # File
+    # ----------------------------
+    def _set_dim(self, dim: int):
+        self._record = np.dtype([("key", np.uint8, (KEY_BYTES,)), ("vector", self.dtype, (dim,))])
+
+    def _load_meta(self):
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self._set_dim(json.load(f)["dim"])
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _reset(self):
+        self._rows, self._inode = None, None
+        self._index = {}
+        self._used = np.zeros(0, dtype=np.int64)
+
+    def _sync(self):
+        """Map rows other processes (or this one) appended, or reload after a compaction."""
+        if self._record is None:
+            self._load_meta()          # another process may have created the cache since
+            if self._record is None:
+                return
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset()
+            return
+        if st.st_ino != self._inode:
+            self._reset()
+            self._inode = st.st_ino
+
+        start = self._rows.shape[0] if self._rows is not None else 0
+        count = st.st_size // self._record.itemsize
+        if count <= start:
+            return
+        self._rows = np.memmap(self.path, dtype=self._record, mode="r", shape=(count,))
+        keys = np.ascontiguousarray(self._rows["key"][start:]).view(f"V{KEY_BYTES}").ravel()
+        for row, key in enumerate(keys, start):
+            self._index[key.tobytes()] = row
+        self._used = np.concatenate([self._used, np.arange(self._clock, self._clock + count - start)])
+        self._clock += count - start
+
+    def _compact(self):
+        """Rewrite the file with the most recently used EMBED_CACHE_KEEP * max_entries rows."""
+        keep = int(self.max_entries * EMBED_CACHE_KEEP)
+        rows = np.sort(np.argsort(self._used)[-keep:])
+        tmp_path = self.path + ".tmp"
+        self._rows[rows].tofile(tmp_path)
+        os.replace(tmp_path, self.path)
+
+        self._stats["evicted"] += self._rows.shape[0] - len(rows)
+        self._stats["compactions"] += 1
+        used = self._used[rows]
+        self._reset()
+        self._sync()
+        self._used = used
+
+    # ----------------------------
+    # Lookups / stores
+    # ----------------------------
+    def key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.model_key}\0{text}".encode("utf-8")).digest()[:KEY_BYTES]
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Cached vector (float32 list) per text, None for misses."""
+        keys = [self.key(t) for t in texts]
+        with self._lock:
+            if any(k not in self._index for k in keys):
+                self._sync()
+            vectors = []
+            for k in keys:
+                row = self._index.get(k)
+                if row is None:
+                    vectors.append(None)
+                    continue
+                vectors.append(self._rows[row]["vector"].astype(np.float32).tolist())
+                self._used[row] = self._clock
+                self._clock += 1
+            hits = sum(v is not None for v in vectors)
+            self._stats["hits"] += hits
+            self._stats["misses"] += len(vectors) - hits
+            return vectors
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]):
+        if not texts:
+            return
+        with self._lock:
+            if self._record is None:
+                self._set_dim(len(vectors[0]))
+                with open(self.meta_path, "w") as f:
+                    json.dump({"model": self.model_key, "dim": len(vectors[0]), "dtype": self.dtype.name}, f)
+
+            with self._file_lock():
+                self._sync()
+                new = {}
+                for text, vector in zip(texts, vectors):
+                    k = self.key(text)
+                    if k not in self._index:
+                        new[k] = vector
+                if not new:
+                    return
+
+                records = np.zeros(len(new), dtype=self._record)
+                records["key"] = np.frombuffer(b"".join(new), dtype=np.uint8).reshape(len(new), KEY_BYTES)
+                records["vector"] = np.asarray(list(new.values()), dtype=self.dtype)
+                with open(self.path, "ab") as f:
+                    f.write(records.tobytes())
+                self._stats["stored"] += len(new)
+
+                self._sync()
+                if len(self._index) > self.max_entries:
+                    self._compact()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._sync()          # count rows on disk, not just the ones this process has looked up
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+                "entries": len(self._index),
+                "max_entries": self.max_entries,
+                "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+                "dtype": self.dtype.name,
+                "path": self.path,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """Document embeddings through an EmbeddingCache; queries go straight to the model."""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.cache.get_many(texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            self.cache.put_many([texts[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
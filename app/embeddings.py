@@ -0,0 +1,236 @@
+"""
+Embedding model loading and query-time encoding.
+
+- create_embeddings(): the sentence-transformers model used for documents and
+  queries (shared by embed_doc.py and the API). EMBEDDING_BACKEND selects how
+  it runs on CPU: "torch" (full precision, default), "onnx" (exported ONNX
+  graph) or "onnx-int8" (dynamically quantized int8 ONNX graph). The ONNX
+  backends need sentence-transformers[onnx] >= 3.2.
+- LazyEmbeddings: defers loading the model so the API starts immediately; the
+  model is warmed up in a background thread and /ready reports when it is in.
+- QueryEmbedder: LRU cache of query vectors plus a micro-batcher that merges
+  query encodings arriving within a few milliseconds into one forward pass.
+"""
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+from langchain_community.embeddings import HuggingFaceEmbeddings
+
+# ----------------------------
+# Config (override via env)
+# ----------------------------
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")     # torch | onnx | onnx-int8
+# ONNX file inside the model repo for each ONNX backend (all-MiniLM-L6-v2 ships these)
+ONNX_FILES = {
+    "onnx": os.getenv("EMBEDDING_ONNX_FILE", "onnx/model.onnx"),
+    "onnx-int8": os.getenv("EMBEDDING_ONNX_INT8_FILE", "onnx/model_qint8_avx2.onnx"),
+}
+EMBEDDING_BACKENDS = ("torch", *ONNX_FILES)
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "10000"))
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "5"))   # wait this long to fill a batch
+QUERY_MAX_BATCH = int(os.getenv("QUERY_MAX_BATCH", "32"))
+
+
+def create_embeddings(backend: str = None) -> Embeddings:
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "torch":
+        return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    if backend in ONNX_FILES:
+        return HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL,
+            model_kwargs={
+                "backend": "onnx",
+                "model_kwargs": {
+                    "file_name": ONNX_FILES[backend],
+                    "provider": "CPUExecutionProvider",
+                },
+            },
+        )
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}', expected one of {EMBEDDING_BACKENDS}")
+
+
+class LazyEmbeddings(Embeddings):
+    """Embeddings wrapper that loads the real model on first use or warm_up()."""
+
+    def __init__(self, factory=create_embeddings):
+        self._factory = factory
+        self._model = None
+        self._error = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is not None:
+                return
+            try:
+                model = self._factory()
+                # one tiny forward pass so the first real query doesn't pay for it
+                model.embed_query("warm-up")
+                self._model = model
+                self._error = None
+            except Exception as e:
+                self._error = e
+                raise
+
+    def warm_up(self):
+        """Load the model in a background thread."""
+        def _run():
+            try:
+                self._load()
+            except Exception as e:
+                print(f"❌ Embedding model failed to load: {e}")
+
+        threading.Thread(target=_run, name="embedding-warmup", daemon=True).start()
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    def status(self) -> Dict:
+        if self._model is not None:
+            return {"status": "ready", "model": EMBEDDING_MODEL, "backend": EMBEDDING_BACKEND}
+        if self._error is not None:
+            return {"status": "error", "model": EMBEDDING_MODEL, "error": str(self._error)}
+        return {"status": "loading", "model": EMBEDDING_MODEL, "backend": EMBEDDING_BACKEND}
+
+    @property
+    def model(self) -> Embeddings:
+        if self._model is None:
+            self._load()
+        return self._model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.model.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.model.embed_query(text)
+
+
+class QueryEmbedder:
+    """LRU-cached, micro-batched query encoder."""
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        cache_size: int = QUERY_CACHE_SIZE,
+        window_ms: float = QUERY_BATCH_WINDOW_MS,
+        max_batch: int = QUERY_MAX_BATCH,
+    ):
+        self.embeddings = embeddings
+        self.cache_size = cache_size
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._stats = {"hits": 0, "misses": 0, "batches": 0, "batched_queries": 0}
+
+        threading.Thread(target=self._batch_loop, name="query-embed-batcher", daemon=True).start()
+
+    def _cached(self, text: str):
+        with self._lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+                self._stats["hits"] += 1
+            else:
+                self._stats["misses"] += 1
+            return vector
+
+    def _remember(self, text: str, vector: List[float]):
+        with self._lock:
+            self._cache[text] = vector
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        vector = self._cached(text)
+        if vector is not None:
+            future.set_result(vector)
+        else:
+            self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """
+        Vectors for a whole list of queries (batch chat): cache hits plus one
+        embed_documents() call for the rest, without going through the
+        micro-batcher.
+        """
+        vectors = [self._cached(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, v in zip(texts, vectors) if v is None))
+        if not missing:
+            return vectors
+
+        computed = dict(zip(missing, self.embeddings.embed_documents(missing)))
+        for text, vector in computed.items():
+            self._remember(text, vector)
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["batched_queries"] += len(missing)
+        return [v if v is not None else computed[text] for text, v in zip(texts, vectors)]
+
+    def _batch_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            # collect whatever else arrives within the window, measured from the
+            # first query so a steady stream of requests can't hold the batch back
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            waiters: Dict[str, List[Future]] = {}
+            for text, future in batch:
+                waiters.setdefault(text, []).append(future)
+            texts = list(waiters)
+
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+            except Exception as e:
+                for futures in waiters.values():
+                    for f in futures:
+                        f.set_exception(e)
+                continue
+
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["batched_queries"] += len(batch)
+
+            for text, vector in zip(texts, vectors):
+                self._remember(text, vector)
+                for f in waiters[text]:
+                    f.set_result(vector)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            batches = self._stats["batches"]
+            return {
+                **self._stats,
+                "avg_batch_size": round(self._stats["batched_queries"] / batches, 2) if batches else 0.0,
+                "cached": len(self._cache),
+            }
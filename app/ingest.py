@@ -0,0 +1,240 @@
+"""
+Shared document ingestion helpers for embed_doc.py and /upload-docs:
+loading a file, splitting it into chunks and (re-)indexing it incrementally.
+
+Chunks are fingerprinted by content hash and get stable ids derived from
+(role, file name, chunk hash, occurrence), so re-indexing a file only embeds
+chunks whose text actually changed and removes the ones that disappeared.
+"""
+
+import hashlib
+import os
+import time
+import uuid
+
+from langchain_community.document_loaders import (
+    UnstructuredFileLoader,
+    CSVLoader,
+    TextLoader,
+    PyPDFLoader,
+)
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from db import log_doc_chunk, delete_doc_chunks, get_indexed_files, bump_version, ORIGIN_CORPUS, ORIGIN_UPLOAD
+from markdown_splitter import split_markdown, MARKDOWN_CHUNK_SIZE
+from structured import load_table
+
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+
+# "markdown": header/table-aware chunks with section metadata for .md files
+# (see markdown_splitter.py); "recursive": fixed-size chunks for every file
+MARKDOWN_SPLITTER = os.getenv("MARKDOWN_SPLITTER", "markdown")
+
+# part of every file's fingerprint: bump when a splitter's output changes, so
+# embed_doc.py re-chunks files it would otherwise skip as unchanged
+SPLITTER_VERSION = 1
+
+# Namespace for stable chunk ids (uuid5 keeps the existing uuid format)
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c7a52-3c1e-4f0a-9a8e-2f6b7f1d9c41")
+
+SUPPORTED_EXTENSIONS = (".md", ".txt", ".csv", ".pdf")
+
+
+def is_supported(file_name: str) -> bool:
+    return file_name.endswith(SUPPORTED_EXTENSIONS)
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def splitter_id(file_name: str, splitter: str = None) -> str:
+    """Name + settings of the splitter split_file() uses for this file."""
+    if (splitter or MARKDOWN_SPLITTER) == "markdown" and file_name.endswith(".md"):
+        return f"markdown-{MARKDOWN_CHUNK_SIZE}-v{SPLITTER_VERSION}"
+    return f"recursive-{CHUNK_SIZE}-{CHUNK_OVERLAP}-v{SPLITTER_VERSION}"
+
+
+def file_fingerprint(file_hash: str, file_name: str, splitter: str = None) -> str:
+    """
+    What change detection compares (doc_chunks.file_hash): the content hash
+    plus the splitter, so switching MARKDOWN_SPLITTER or chunk sizes re-chunks
+    a file even when its content is unchanged.
+    """
+    return f"{file_hash}:{splitter_id(file_name, splitter)}"
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def stable_chunk_id(role: str, file_name: str, content_hash: str, occurrence: int) -> str:
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{role}/{file_name}/{content_hash}/{occurrence}"))
+
+
+def load_file(file_path: str, file_name: str):
+    """Load a file with the loader for its extension (None if unsupported)."""
+    if file_name.endswith(".md") or file_name.endswith(".txt"):
+        try:
+            loader = UnstructuredFileLoader(file_path)
+            return loader.load()
+        except Exception:
+            loader = TextLoader(file_path, encoding="utf-8")
+            return loader.load()
+    elif file_name.endswith(".csv"):
+        return CSVLoader(file_path).load()
+    elif file_name.endswith(".pdf"):
+        return PyPDFLoader(file_path).load()
+    return None
+
+
+def split_markdown_file(file_path: str):
+    # raw text: the unstructured loader would strip the headings / table syntax we split on
+    docs = TextLoader(file_path, encoding="utf-8").load()
+    return [
+        Document(page_content=text, metadata={**doc.metadata, "section": section})
+        for doc in docs
+        for text, section in split_markdown(doc.page_content)
+    ]
+
+
+def split_file(file_path: str, file_name: str, role: str, file_hash: str = None, splitter: str = None):
+    """
+    Load + split one file into chunks with role/source metadata, content
+    hashes and stable chunk ids. Returns None for unsupported files.
+    """
+    if (splitter or MARKDOWN_SPLITTER) == "markdown" and file_name.endswith(".md"):
+        split_docs = split_markdown_file(file_path)
+    else:
+        docs = load_file(file_path, file_name)
+        if docs is None:
+            return None
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+        split_docs = text_splitter.split_documents(docs)
+
+    # add basic metadata
+    for d in split_docs:
+        d.metadata["file_name"] = file_name
+        d.metadata["role"] = role
+        d.metadata["department"] = role
+        d.metadata["source"] = file_name
+
+    file_hash = file_hash or file_fingerprint(file_sha256(file_path), file_name, splitter)
+    occurrences = {}
+    for i, d in enumerate(split_docs):
+        content_hash = text_sha256(d.page_content)
+        n = occurrences.get(content_hash, 0)
+        occurrences[content_hash] = n + 1
+
+        d.metadata["chunk_id"] = stable_chunk_id(role, file_name, content_hash, n)
+        d.metadata["content_hash"] = content_hash
+        d.metadata["file_hash"] = file_hash
+        d.metadata["chunk_index"] = i
+
+    return split_docs
+
+
+def plan_chunks(split_docs, previous_ids=()):
+    """Return (chunks to embed, chunks kept from the previous version, stale chunk ids)."""
+    previous_ids = set(previous_ids)
+    new_ids = {d.metadata["chunk_id"] for d in split_docs}
+
+    stale_ids = sorted(previous_ids - new_ids)
+    to_add = [d for d in split_docs if d.metadata["chunk_id"] not in previous_ids]
+    kept = [d for d in split_docs if d.metadata["chunk_id"] in previous_ids]
+    return to_add, kept, stale_ids
+
+
+def refresh_kept(vectordb, kept):
+    """
+    Rewrite the stored metadata of unchanged chunks: an edit elsewhere in the
+    file moves their chunk_index (and changes file_hash / section), and
+    context.py merges chunks by chunk_index.
+    """
+    if kept:
+        vectordb.update_metadata(ids=[d.metadata["chunk_id"] for d in kept], metadatas=[d.metadata for d in kept])
+
+
+def log_chunks(split_docs, origin=ORIGIN_CORPUS):
+    # (re)write metadata for every chunk so file_hash reflects this version
+    for d in split_docs:
+        log_doc_chunk(
+            chunk_id=d.metadata["chunk_id"],
+            file_name=d.metadata["file_name"],
+            role=d.metadata["role"],
+            department=d.metadata["department"],
+            source=d.metadata["source"],
+            content_hash=d.metadata["content_hash"],
+            file_hash=d.metadata["file_hash"],
+            section=d.metadata.get("section"),
+            origin=origin,
+        )
+
+
+def index_chunks(vectordb, split_docs, previous_ids=(), lexical=None, origin=ORIGIN_CORPUS):
+    """
+    Sync one file's chunks into Chroma + DuckDB (and the lexical index, if
+    given): embed only chunks whose id is new, delete chunks of the previous
+    version that no longer exist. Returns (added, removed).
+    """
+    to_add, kept, stale_ids = plan_chunks(split_docs, previous_ids)
+
+    if stale_ids:
+        vectordb.delete(ids=stale_ids)
+        delete_doc_chunks(stale_ids)
+        if lexical is not None:
+            lexical.remove(stale_ids)
+
+    if to_add:
+        vectordb.add_documents(to_add, ids=[d.metadata["chunk_id"] for d in to_add])
+        if lexical is not None:
+            lexical.add_documents(to_add)
+    refresh_kept(vectordb, kept)
+
+    log_chunks(split_docs, origin)
+    return len(to_add), len(stale_ids)
+
+
+def remove_file(vectordb, chunk_ids, lexical=None):
+    """Drop every chunk of a file that no longer exists."""
+    chunk_ids = sorted(chunk_ids)
+    if chunk_ids:
+        vectordb.delete(ids=chunk_ids)
+        delete_doc_chunks(chunk_ids)
+        if lexical is not None:
+            lexical.remove(chunk_ids)
+    return len(chunk_ids)
+
+
+def ingest_upload(vectordb, lexical, file_path: str, file_name: str, role: str, timings: dict) -> dict:
+    """
+    Index one uploaded file (/upload-docs, or the state server in multi-worker
+    mode): split it, load CSVs as a SQL table, and sync its chunks.
+    """
+    t0 = time.perf_counter()
+    file_hash = file_sha256(file_path)
+    split_docs = split_file(file_path, file_name, role, file_hash=file_fingerprint(file_hash, file_name))
+    t1 = time.perf_counter()
+
+    # Tabular uploads are also loaded as a DuckDB table for SQL answers
+    if file_name.endswith(".csv"):
+        load_table(file_path, file_name, role, file_hash, origin=ORIGIN_UPLOAD)
+
+    # Re-uploading a file only embeds chunks whose content changed
+    previous = get_indexed_files(role=role, file_name=file_name).get((role, file_name))
+    added, removed = index_chunks(
+        vectordb, split_docs, previous["chunk_ids"] if previous else (), lexical=lexical, origin=ORIGIN_UPLOAD,
+    )
+    lexical.save()
+    bump_version(f"index:{role}")
+    t2 = time.perf_counter()
+
+    timings["parse"] = t1 - t0
+    timings["index"] = t2 - t1
+    return {"chunks": len(split_docs), "embedded": added, "removed": removed}
@@ -0,0 +1,111 @@
+"""
+Background ingestion jobs for /upload-docs.
+
+Uploads are streamed into a private temp directory and handed to a small
+worker pool; the request returns a job id straight away and clients poll
+GET /jobs/{job_id} for status, chunk counts and per-step timings.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from metrics import observe_stages
+
+# ----------------------------
+# Config (override via env)
+# ----------------------------
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "2"))
+MAX_JOBS_KEPT = int(os.getenv("MAX_JOBS_KEPT", "1000"))     # finished jobs remembered for /jobs
+UPLOAD_COPY_BUFFER = 1 << 20                                # 1 MiB
+
+
+class IngestJob:
+    def __init__(self, role: str, file_name: str, username: str):
+        self.id = str(uuid.uuid4())
+        self.role = role
+        self.file_name = file_name
+        self.username = username
+        self.status = "queued"          # queued -> running -> done | failed
+        self.error: Optional[str] = None
+        self.result: Dict = {}
+        self.timings: Dict[str, float] = {}
+        self.created_at = time.time()
+        self._queued_at = time.perf_counter()
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "role": self.role,
+            "file_name": self.file_name,
+            "username": self.username,
+            "status": self.status,
+            "error": self.error,
+            **self.result,
+            "timings": {k: round(v, 3) for k, v in self.timings.items()},
+            "created_at": self.created_at,
+        }
+
+
+class JobManager:
+    def __init__(self, max_workers: int = INGEST_JOB_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest-job")
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        # private (0700) spool area for uploaded files
+        self.upload_dir = tempfile.mkdtemp(prefix="finsolve_uploads_")
+
+    def save_upload(self, fileobj, file_name: str) -> str:
+        """Stream an upload to a private temp file without reading it into memory."""
+        suffix = os.path.splitext(file_name)[1]
+        fd, path = tempfile.mkstemp(dir=self.upload_dir, suffix=suffix)
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(fileobj, f, UPLOAD_COPY_BUFFER)
+        return path
+
+    def submit(self, job: IngestJob, temp_path: str, work: Callable[[IngestJob, str], Dict]) -> IngestJob:
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        self._pool.submit(self._run, job, temp_path, work)
+        return job
+
+    def _run(self, job: IngestJob, temp_path: str, work):
+        started = time.perf_counter()
+        job.timings["queued"] = started - job._queued_at
+        job.status = "running"
+        try:
+            job.result = work(job, temp_path)
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            traceback.print_exc()
+        finally:
+            job.timings["total"] = time.perf_counter() - started
+            observe_stages("upload", job.timings)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _trim(self):
+        # forget the oldest finished jobs once we're over the limit
+        while len(self._jobs) > MAX_JOBS_KEPT:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest.status not in ("done", "failed"):
+                break
+            del self._jobs[oldest_id]
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+        shutil.rmtree(self.upload_dir, ignore_errors=True)
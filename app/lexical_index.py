@@ -0,0 +1,199 @@
+"""
+Per-role BM25 inverted index used alongside Chroma for hybrid retrieval.
+
+Dense search is weak on exact terms (employee ids like FINEMP1000, quarter
+names, metric names), so chunks are also indexed lexically, partitioned by
+the same `role` metadata as the vectors. The index is built by embed_doc.py,
+updated incrementally by /upload-docs, and persisted next to chroma_db.
+Results are fused with vector results via reciprocal rank fusion.
+"""
+
+import math
+import os
+import pickle
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "chroma_db/lexical_index.pkl")
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Reciprocal rank fusion constant (60 is the usual choice)
+RRF_K = 60
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[._-][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class _Partition:
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, int]] = {}   # term -> {chunk_id: term frequency}
+        self.doc_len: Dict[str, int] = {}              # chunk_id -> number of tokens
+        self.total_len = 0
+
+
+class LexicalIndex:
+    def __init__(self, path: str = LEXICAL_INDEX_PATH):
+        self.path = path
+        self._partitions: Dict[str, _Partition] = {}
+        self._chunk_role: Dict[str, str] = {}
+        self._chunk_terms: Dict[str, List[str]] = {}    # for removal without a full scan
+        self._lock = threading.RLock()
+
+    # ----------------------------
+    # Persistence
+    # ----------------------------
+    @classmethod
+    def load(cls, path: str = LEXICAL_INDEX_PATH) -> "LexicalIndex":
+        index = cls(path)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+            index._partitions = state["partitions"]
+            index._chunk_role = state["chunk_role"]
+            index._chunk_terms = state["chunk_terms"]
+        return index
+
+    def save(self):
+        with self._lock:
+            state = {
+                "partitions": self._partitions,
+                "chunk_role": self._chunk_role,
+                "chunk_terms": self._chunk_terms,
+            }
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+
+    # ----------------------------
+    # Updates
+    # ----------------------------
+    def ids(self) -> set:
+        with self._lock:
+            return set(self._chunk_role)
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+            self._chunk_role.clear()
+            self._chunk_terms.clear()
+
+    def add(self, chunk_id: str, role: str, text: str):
+        with self._lock:
+            if chunk_id in self._chunk_role:
+                self.remove([chunk_id])
+
+            tf = Counter(tokenize(text))
+            part = self._partitions.setdefault(role, _Partition())
+            for term, count in tf.items():
+                part.postings.setdefault(term, {})[chunk_id] = count
+            length = sum(tf.values())
+            part.doc_len[chunk_id] = length
+            part.total_len += length
+
+            self._chunk_role[chunk_id] = role
+            self._chunk_terms[chunk_id] = list(tf)
+
+    def add_documents(self, docs):
+        for d in docs:
+            self.add(d.metadata["chunk_id"], d.metadata["role"], d.page_content)
+
+    def remove(self, chunk_ids: Iterable[str]):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                role = self._chunk_role.pop(chunk_id, None)
+                if role is None:
+                    continue
+                part = self._partitions[role]
+                for term in self._chunk_terms.pop(chunk_id, []):
+                    postings = part.postings.get(term)
+                    if postings is not None:
+                        postings.pop(chunk_id, None)
+                        if not postings:
+                            del part.postings[term]
+                part.total_len -= part.doc_len.pop(chunk_id, 0)
+                if not part.doc_len:
+                    del self._partitions[role]
+
+    # ----------------------------
+    # Search
+    # ----------------------------
+    def _search_partition(self, part: _Partition, terms: List[str]) -> Dict[str, float]:
+        n_docs = len(part.doc_len)
+        avg_len = part.total_len / n_docs if n_docs else 0.0
+        scores: Dict[str, float] = {}
+        for term in terms:
+            postings = part.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * part.doc_len[chunk_id] / avg_len)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        return scores
+
+    def search(self, query: str, k: int, role: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Top-k (chunk_id, score); role=None searches every partition."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        with self._lock:
+            if role is None:
+                partitions = list(self._partitions.values())
+            else:
+                partitions = [self._partitions[role]] if role in self._partitions else []
+
+            scores: Dict[str, float] = {}
+            for part in partitions:
+                scores.update(self._search_partition(part, terms))
+
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[str]:
+    """Fuse several ranked id lists into one ranking (best first)."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)
+
+
+def hybrid_search(vectordb, lexical: LexicalIndex, query: str, query_vector,
+                  role: Optional[str], k: int, candidates: int,
+                  dense: Optional[List[Document]] = None) -> List[Document]:
+    """
+    Top-k chunks for `role` (None = all roles): dense and BM25 candidates
+    fused with RRF. Lexical-only hits are fetched from Chroma by id. `dense`
+    takes candidates that were already searched (batched queries).
+    """
+    role_filter = None if role is None else {"role": role}
+    if dense is None:
+        dense = vectordb.similarity_search_by_vector(query_vector, k=candidates, filter=role_filter)
+    sparse = lexical.search(query, candidates, role=role)
+
+    by_id = {d.metadata.get("chunk_id"): d for d in dense}
+    fused = reciprocal_rank_fusion([
+        [d.metadata.get("chunk_id") for d in dense],
+        [chunk_id for chunk_id, _ in sparse],
+    ])[:k]
+
+    missing = [chunk_id for chunk_id in fused if chunk_id not in by_id]
+    if missing:
+        stored = vectordb.get(ids=missing, where=role_filter, include=["documents", "metadatas"])
+        for chunk_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+            by_id[chunk_id] = Document(page_content=text, metadata=metadata)
+
+    return [by_id[chunk_id] for chunk_id in fused if chunk_id in by_id]
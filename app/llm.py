@@ -0,0 +1,341 @@
+"""
+Async client for the Ollama generation backends.
+
+A single httpx.AsyncClient (shared connection pool) is created at app startup
+and closed on shutdown. Generations are spread over a pool of Ollama
+instances (OLLAMA_BACKENDS, default: just OLLAMA_URL):
+
+- each backend has its own concurrency limit; requests beyond it wait in
+  line, and once LLM_MAX_QUEUE requests are waiting in total new ones are
+  rejected instead of piling up
+- a request goes to the healthy backend with the fewest outstanding
+  (running + waiting) requests relative to its limit
+- backends are health-checked via /api/tags, which also tells us which
+  models each one has pulled
+- a backend that errors is marked down and the request fails over to the
+  next one (for streams, only until the first token has been sent)
+
+Short, simple questions can be sent to a smaller model (OLLAMA_SMALL_MODEL).
+"""
+
+import asyncio
+import json
+import os
+import re
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+# ----------------------------
+# Config (override via env)
+# ----------------------------
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2")
+
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "300"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))    # generations running at once, per backend
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "500"))              # generations allowed to wait, in total
+
+# Comma-separated Ollama base (or /api/generate) URLs, each optionally with its
+# own concurrency limit: "http://gpu1:11434=8,http://cpu1:11434=2"
+OLLAMA_BACKENDS = os.getenv("OLLAMA_BACKENDS", OLLAMA_URL)
+LLM_HEALTH_INTERVAL = float(os.getenv("LLM_HEALTH_INTERVAL", "10"))  # seconds between /api/tags checks
+
+# Questions of at most this many words, without "explain / compare / why"-type
+# wording, go to OLLAMA_SMALL_MODEL (disabled while it is unset)
+OLLAMA_SMALL_MODEL = os.getenv("OLLAMA_SMALL_MODEL", "")
+SMALL_MODEL_MAX_WORDS = int(os.getenv("SMALL_MODEL_MAX_WORDS", "12"))
+
+_COMPLEX_RE = re.compile(
+    r"\b(why|how|explain|compare|comparison|analy[sz]e|analysis|summari[sz]e|summary|"
+    r"difference|trend|impact|recommend|evaluate|versus|vs)\b"
+)
+
+
+class LLMError(Exception):
+    """Generation backend returned an error or could not be reached."""
+
+
+class LLMBusyError(LLMError):
+    """Too many generations are already waiting for a slot."""
+
+
+def pick_model(question: str) -> str:
+    """OLLAMA_SMALL_MODEL for short, simple questions (if configured), else OLLAMA_MODEL."""
+    if OLLAMA_SMALL_MODEL and len(question.split()) <= SMALL_MODEL_MAX_WORDS \
+            and not _COMPLEX_RE.search(question.lower()):
+        return OLLAMA_SMALL_MODEL
+    return OLLAMA_MODEL
+
+
+def build_payload(prompt: str, stream: bool, model: Optional[str] = None) -> Dict:
+    # Call Ollama LLM with extended generation parameters
+    return {
+        "model": model or OLLAMA_MODEL,
+        "prompt": prompt,
+        "stream": stream,
+
+        # Important: allow long answers
+        "num_predict": -1,        # unlimited tokens
+        "temperature": 0.2,       # more factual
+        "top_p": 0.9,             # smoother generation
+        "repeat_penalty": 1.1     # avoid short repetitive output
+    }
+
+
+def parse_stats(response: Dict) -> Dict:
+    """
+    Token counts and timings from Ollama's final response (durations are in
+    nanoseconds there): prompt/completion tokens, *_seconds, tokens_per_second.
+    """
+    stats = {
+        "prompt_tokens": response.get("prompt_eval_count", 0),
+        "completion_tokens": response.get("eval_count", 0),
+    }
+    for phase in ("load", "prompt_eval", "eval", "total"):
+        if response.get(f"{phase}_duration") is not None:
+            stats[f"{phase}_seconds"] = response[f"{phase}_duration"] / 1e9
+    if stats.get("eval_seconds"):
+        stats["tokens_per_second"] = stats["completion_tokens"] / stats["eval_seconds"]
+    return stats
+
+
+def parse_backends(spec: str, default_concurrency: int = LLM_MAX_CONCURRENCY) -> List[Tuple[str, int]]:
+    """"url[=limit],..." -> [(base url, concurrency limit)]"""
+    backends = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, limit = item.rpartition("=") if re.search(r"=\d+$", item) else (item, "", "")
+        base = url.split("/api/")[0].rstrip("/")
+        backends.append((base, int(limit) if limit else default_concurrency))
+    return backends
+
+
+def _model_names(name: str) -> Set[str]:
+    # Ollama lists "llama3.2:latest"; requests may say "llama3.2"
+    return {name, name + ":latest"} if ":" not in name else {name, name.split(":")[0]}
+
+
+class Backend:
+    def __init__(self, base_url: str, max_concurrency: int):
+        self.base_url = base_url
+        self.generate_url = base_url + "/api/generate"
+        self.max_concurrency = max_concurrency
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.running = 0
+        self.waiting = 0
+        self.healthy = True
+        self.models: Set[str] = set()       # empty until the first health check
+        self.requests = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def load(self) -> float:
+        return (self.running + self.waiting) / self.max_concurrency
+
+    def serves(self, model: str) -> bool:
+        return not self.models or bool(self.models & _model_names(model))
+
+    def mark_down(self, error: str):
+        self.healthy = False
+        self.failures += 1
+        self.last_error = error
+
+    def stats(self) -> Dict:
+        return {
+            "url": self.base_url,
+            "healthy": self.healthy,
+            "running": self.running,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "models": sorted(self.models),
+        }
+
+
+class OllamaClient:
+    def __init__(
+        self,
+        backends: Optional[List[Tuple[str, int]]] = None,
+        max_queue: int = LLM_MAX_QUEUE,
+        health_interval: float = LLM_HEALTH_INTERVAL,
+    ):
+        self.backends = [Backend(url, limit) for url, limit in (backends or parse_backends(OLLAMA_BACKENDS))]
+        self.max_queue = max_queue
+        self.health_interval = health_interval
+        self._client: Optional[httpx.AsyncClient] = None
+        self._health_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS,
+            ),
+        )
+        await self.check_health()
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict:
+        return {
+            "running": sum(b.running for b in self.backends),
+            "waiting": sum(b.waiting for b in self.backends),
+            "max_concurrency": sum(b.max_concurrency for b in self.backends),
+            "max_queue": self.max_queue,
+            "backends": [b.stats() for b in self.backends],
+        }
+
+    # ----------------------------
+    # Health checks
+    # ----------------------------
+    async def _check(self, backend: Backend):
+        try:
+            response = await self._client.get(backend.base_url + "/api/tags", timeout=LLM_CONNECT_TIMEOUT)
+            response.raise_for_status()
+            backend.models = {m["name"] for m in response.json().get("models", [])}
+            backend.healthy = True
+        except (httpx.HTTPError, ValueError) as e:
+            backend.healthy = False
+            backend.last_error = f"health check: {e}"
+
+    async def check_health(self):
+        await asyncio.gather(*(self._check(b) for b in self.backends))
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_health()
+
+    # ----------------------------
+    # Backend selection
+    # ----------------------------
+    def _pick(self, model: str, exclude: Set[Backend]) -> Optional[Backend]:
+        candidates = [b for b in self.backends if b not in exclude]
+        # prefer healthy backends that have the model; a stale health check
+        # shouldn't make us refuse outright, so fall back to the rest
+        for pool in (
+            [b for b in candidates if b.healthy and b.serves(model)],
+            [b for b in candidates if b.healthy],
+            candidates,
+        ):
+            if pool:
+                return min(pool, key=lambda b: b.load)
+        return None
+
+    @asynccontextmanager
+    async def _slot(self, backend: Backend):
+        if sum(b.waiting for b in self.backends) >= self.max_queue:
+            raise LLMBusyError("Too many pending generations, try again later")
+
+        backend.waiting += 1
+        try:
+            await backend.slots.acquire()
+        finally:
+            backend.waiting -= 1
+
+        backend.running += 1
+        backend.requests += 1
+        try:
+            yield
+        finally:
+            backend.running -= 1
+            backend.slots.release()
+
+    # ----------------------------
+    # Generation
+    # ----------------------------
+    async def generate(self, payload: Dict) -> Dict:
+        tried: Set[Backend] = set()
+        last_error = "no generation backends configured"
+
+        while True:
+            backend = self._pick(payload["model"], tried)
+            if backend is None:
+                raise LLMError(last_error)
+            tried.add(backend)
+
+            async with self._slot(backend):
+                try:
+                    response = await self._client.post(backend.generate_url, json=payload)
+                except httpx.HTTPError as e:
+                    last_error = f"{backend.base_url}: {e}"
+                    backend.mark_down(last_error)
+                    continue
+
+            if response.status_code == 200:
+                try:
+                    return response.json()
+                except ValueError as e:
+                    raise LLMError(f"{backend.base_url}: invalid response {response.text[:200]!r}") from e
+            last_error = f"{backend.base_url}: {response.text}"
+            if response.status_code < 500:
+                # the request itself is bad (e.g. unknown model); retrying elsewhere won't help
+                raise LLMError(last_error)
+            backend.mark_down(last_error)
+
+    async def stream(self, payload: Dict) -> AsyncIterator[Dict]:
+        """Yield Ollama's streamed JSON chunks as they arrive."""
+        tried: Set[Backend] = set()
+        last_error = "no generation backends configured"
+
+        while True:
+            backend = self._pick(payload["model"], tried)
+            if backend is None:
+                raise LLMError(last_error)
+            tried.add(backend)
+
+            started = False
+            async with self._slot(backend):
+                try:
+                    async with self._client.stream("POST", backend.generate_url, json=payload) as response:
+                        if response.status_code != 200:
+                            body = (await response.aread()).decode(errors="replace")
+                            last_error = f"{backend.base_url}: {body}"
+                            if response.status_code < 500:
+                                raise LLMError(last_error)
+                            backend.mark_down(last_error)
+                            continue
+
+                        async for line in response.aiter_lines():
+                            if not line:
+                                continue
+                            try:
+                                chunk = json.loads(line)
+                            except ValueError as e:
+                                # truncated / malformed line: surface it like any other backend failure
+                                raise LLMError(f"{backend.base_url}: invalid stream line {line[:200]!r}") from e
+                            if chunk.get("error"):
+                                # Ollama reports failures mid-stream in-band, still with a 200
+                                raise LLMError(f"{backend.base_url}: {chunk['error']}")
+                            started = True
+                            yield chunk
+                            if chunk.get("done"):
+                                return
+
+                        # the body ended without a final "done" chunk
+                        last_error = f"{backend.base_url}: stream ended before completion"
+                        if started:
+                            raise LLMError(last_error)
+                except httpx.HTTPError as e:
+                    last_error = f"{backend.base_url}: {e}"
+                    backend.mark_down(last_error)
+                    # tokens already went to the client; can't restart elsewhere
+                    if started:
+                        raise LLMError(last_error) from e
@@ -1,63 +1,140 @@
 # main.py
-from typing import Dict
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form
+from contextlib import asynccontextmanager
+from typing import Dict, Iterator, List, Optional
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pydantic import BaseModel
 
-from langchain_chroma import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import (
-    UnstructuredFileLoader,
-    CSVLoader,
-    TextLoader,
-    PyPDFLoader,
+
+from analytics import ChatAnalytics, init_rollups
+from answer_cache import AnswerCache, ALL_ROLES, normalize_query
+from auth import UserStore, UserExistsError
+from context import assemble_context, build_prompt, count_tokens
+from db import (
+    STATE_URL, init_db, chat_row, log_chat, log_chats, close_writer, load_versions,
+    state_request, wait_for_state_server, StateServerError,
 )
+from embedding_cache import CachedEmbeddings, EmbeddingCache, EMBED_CACHE
+from embeddings import LazyEmbeddings, QueryEmbedder
+from ingest import ingest_upload, is_supported
+from jobs import JobManager, IngestJob
+from lexical_index import LexicalIndex, hybrid_search
+from llm import OllamaClient, LLMBusyError, LLMError, build_payload, parse_stats, pick_model
+from metrics import Gauge, Spans, PROMPT_TOKENS, observe_llm, render as render_metrics
+from reranker import CrossEncoderReranker, RERANK, RERANK_CANDIDATES, RERANK_TOP_K
+from sessions import Session, SessionStore
+from single_flight import Flight, SingleFlight
+from structured import TableRouter
+from vector_store import ShardedChroma, CHROMA_DIR, index_write_lock
+
+import asyncio
+import json
+import os
+import time
 
-from db import init_db, log_chat, log_doc_chunk
+import anyio
+import duckdb
 
-import uuid
-import os
-import requests
+# Shared async client (one connection pool) for the LLM backend
+llm_client = OllamaClient()
+
+# Worker pool for /upload-docs ingestion
+job_manager = JobManager()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # load the embedding model in the background; /ready reports when it's in
+    embedding_function.warm_up()
+    if RERANK:
+        reranker.warm_up()
+    await llm_client.start()
+    # multi-worker mode: pick up users, tables and index changes made by other processes
+    follower = asyncio.create_task(follow_shared_state()) if STATE_URL else None
+    yield
+    if follower is not None:
+        follower.cancel()
+    await llm_client.close()
+    # let running ingestion jobs finish, then flush queued audit rows
+    job_manager.shutdown()
+    close_writer()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 security = HTTPBasic()
 
 # -----------------------------
 # Init DB + Vector DB
 # -----------------------------
+# Multi-worker mode (STATE_URL): DuckDB is owned by state_server.py, which must be up first
+if STATE_URL:
+    wait_for_state_server()
 init_db()
+init_rollups()
+
+# Model is loaded lazily (warmed up at startup) so the API comes up immediately
+embedding_function = LazyEmbeddings()
 
-embedding_function = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+# LRU-cached, micro-batched query encoder for /chat
+query_embedder = QueryEmbedder(embedding_function)
 
-vectordb = Chroma(
-    persist_directory="chroma_db",
-    embedding_function=embedding_function,
-    collection_name="company_docs",
+# Uploaded chunks are embedded through the on-disk cache shared with embed_doc.py
+embedding_cache = EmbeddingCache() if EMBED_CACHE else None
+document_embeddings = (
+    CachedEmbeddings(embedding_function, embedding_cache) if embedding_cache is not None else embedding_function
 )
 
+# One Chroma collection per role; c-level searches fan out across all of them
+# (read-only per worker in multi-worker mode: uploads are indexed by the state server)
+vectordb = ShardedChroma(CHROMA_DIR, embedding_function=document_embeddings, read_only=bool(STATE_URL))
+if vectordb.legacy_count():
+    print("⚠️ chroma_db still has the single company_docs collection, run migrate_shards.py (or embed_doc.py)")
+
+# Per-role BM25 index built by embed_doc.py, fused with vector results
+lexical_index = LexicalIndex.load()
+
+# Retrieval settings
+RETRIEVAL_K = 4                                         # chunks sent to the LLM
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"  # BM25 + vector (RRF)
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "10"))
+
+# /chat/batch: generations one batch keeps in flight, so interactive /chat keeps the rest
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "4"))
+CHAT_BATCH_MAX_QUESTIONS = int(os.getenv("CHAT_BATCH_MAX_QUESTIONS", "1000"))
+
+# Optional cross-encoder pass over RERANK_CANDIDATES retrieved chunks (RERANK=1)
+reranker = CrossEncoderReranker()
+
+# Aggregate / lookup questions over tabular sources are answered with SQL
+table_router = TableRouter()
+
+# Admin reports over chat_logs, served from incrementally refreshed rollups
+chat_analytics = ChatAnalytics()
+
+# Answers keyed by role partition + query (exact or near-duplicate embedding)
+answer_cache = AnswerCache()
+
+# Concurrent identical questions (same role) share one retrieval + generation
+in_flight = SingleFlight()
+
+# Per-user conversation memory (rolling summary + recent turns), LRU-bounded
+session_store = SessionStore()
+
 # -----------------------------
-# Dummy Users DB
+# Users / roles (DuckDB, hashed passwords, cached verification)
 # -----------------------------
-users_db: Dict[str, Dict[str, str]] = {
-    "Deb": {"password": "password123", "role": "engineering"},
-    "Ved": {"password": "securepass", "role": "marketing"},
-    "Binoy": {"password": "financepass", "role": "finance"},
-    "sangit": {"password": "hrpass123", "role": "hr"},
-    "sandhya": {"password": "ceopass", "role": "c-levelexecutives"},
-    "Karabi": {"password": "employeepass", "role": "employee"},
-}
+user_store = UserStore()
+user_store.load()
 
 
 def authenticate(credentials: HTTPBasicCredentials = Depends(security)):
-    username = credentials.username
-    password = credentials.password
-    user = users_db.get(username)
-
-    if not user or user["password"] != password:
+    user = user_store.authenticate(credentials.username, credentials.password)
+    if user is None:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    return {"username": username, "role": user["role"]}
+    return user
 
 
 @app.get("/login")
@@ -71,131 +148,659 @@ def login(user: Dict[str, str] = Depends(authenticate)):
 class ChatRequest(BaseModel):
     user: Dict[str, str]
     message: str
+    session_id: Optional[str] = None     # server-side conversation memory (see sessions.py)
 
 
 # -----------------------------
-# CHAT Endpoint
+# RAG helpers (shared by /chat and /chat/stream)
 # -----------------------------
-@app.post("/chat")
-def chat(req: ChatRequest):
-    user = req.user
-    message = req.message
-    role = user["role"].lower()
-
-    # Determine allowed docs
+def role_partition(role: str) -> str:
+    # Which docs a role may retrieve: everything, "general", or its own department
     if "c-levelexecutives" in role:
-        docs = vectordb.similarity_search(message, k=4)
+        return ALL_ROLES
     elif role == "employee":
-        docs = vectordb.similarity_search(message, k=4, filter={"role": "general"})
+        return "general"
     else:
-        docs = vectordb.similarity_search(message, k=4, filter={"role": role})
+        return role
+
+
+def retrieve_docs(partition: str, message: str, query_vector, k: int = RETRIEVAL_K):
+    # Determine allowed docs
+    role = None if partition == ALL_ROLES else partition
+
+    if not HYBRID_SEARCH:
+        role_filter = None if role is None else {"role": role}
+        return vectordb.similarity_search_by_vector(query_vector, k=k, filter=role_filter)
+
+    return hybrid_search(
+        vectordb, lexical_index, message, query_vector,
+        role=role, k=k, candidates=max(HYBRID_CANDIDATES, k),
+    )
+
+
+def retrieve_docs_many(partition: str, messages: List[str], query_vectors, k: int = RETRIEVAL_K):
+    """retrieve_docs for many questions, with one batched Chroma query per shard for the dense side."""
+    role = None if partition == ALL_ROLES else partition
+    role_filter = None if role is None else {"role": role}
+
+    if not HYBRID_SEARCH:
+        return vectordb.similarity_search_by_vectors(query_vectors, k=k, filter=role_filter)
+
+    candidates = max(HYBRID_CANDIDATES, k)
+    dense = vectordb.similarity_search_by_vectors(query_vectors, k=candidates, filter=role_filter)
+    return [
+        hybrid_search(
+            vectordb, lexical_index, message, vector,
+            role=role, k=k, candidates=candidates, dense=docs,
+        )
+        for message, vector, docs in zip(messages, query_vectors, dense)
+    ]
+
+
+NO_DOCS_ANSWER = "No relevant documents found for your role."
+
+
+# -----------------------------
+# CHAT Endpoint
+# -----------------------------
+async def answer_from_tables(role: str, message: str, spans: Spans):
+    """SQL answer over a tabular source visible to `role`, or None to fall through to RAG."""
+    with spans.span("sql_route"):
+        try:
+            return await run_in_threadpool(table_router.answer, role_partition(role), message, ALL_ROLES)
+        except (duckdb.Error, StateServerError) as e:
+            # e.g. finsolve.db locked by embed_doc.py: the documents can still answer
+            print(f"⚠️ SQL route failed, falling back to RAG: {e}")
+            return None
+
+
+def prepare_prompt(user_role: str, docs, message: str, spans: Spans, history: str = ""):
+    """Dedupe / merge / budget the retrieved chunks and build the prompt."""
+    with spans.span("prompt"):
+        context = assemble_context(docs)
+        prompt = build_prompt(user_role, context.text, message, history)
+    prompt_tokens = count_tokens(prompt)
+
+    PROMPT_TOKENS.observe(context.input_tokens, part="retrieved")
+    PROMPT_TOKENS.observe(context.tokens, part="context")
+    PROMPT_TOKENS.observe(prompt_tokens, part="prompt")
+    return context, prompt, prompt_tokens
+
+
+async def lookup_or_retrieve(role: str, message: str, spans: Spans, use_cache: bool = True):
+    """Return (partition, query_vector, cached_answer, docs) for a chat query."""
+    partition = role_partition(role)
+
+    # Query encodings are cached and batched across concurrent requests
+    with spans.span("embed"):
+        query_vector = await query_embedder.aembed(message)
+
+    if use_cache:
+        with spans.span("cache_lookup"):
+            cached = answer_cache.lookup(partition, message, query_vector)
+        if cached is not None:
+            return partition, query_vector, cached, []
+
+    # Vector search is CPU-bound; keep it off the event loop
+    with spans.span("retrieve"):
+        k = RERANK_CANDIDATES if RERANK else RETRIEVAL_K
+        docs = await run_in_threadpool(retrieve_docs, partition, message, query_vector, k)
+
+    if RERANK:
+        # falls back to the plain top RETRIEVAL_K while the model loads or when over budget
+        with spans.span("rerank"):
+            docs = await run_in_threadpool(reranker.rerank, message, docs, RERANK_TOP_K, RETRIEVAL_K)
+    return partition, query_vector, None, docs
+
+
+def resolve_question(req: ChatRequest, spans: Spans):
+    """
+    (session, query, history) for a chat request. `query` is what retrieval
+    sees: the message, or for a follow-up in a session the message rewritten
+    with the terms it refers back to. `history` (prompt conversation) is only
+    set for follow-ups.
+    """
+    if not req.session_id:
+        return None, req.message, ""
+
+    try:
+        session = session_store.get(req.session_id, req.user["username"])
+    except PermissionError:
+        raise HTTPException(status_code=403, detail="Session belongs to another user")
+
+    with spans.span("rewrite"):
+        query = session_store.rewrite(session, req.message)
+    if query is None:
+        return session, req.message, ""
+    return session, query, session.history()
+
+
+async def generate_answer(
+    role: str, user_role: str, message: str, spans: Spans, flight: Flight,
+    query: str, history: str,
+) -> Dict:
+    """
+    Retrieval + generation for one (role, question) flight. Tokens are
+    published on `flight` as Ollama emits them; the result also carries
+    `outcome` (cache / no_docs / rag) for the request metrics. Follow-ups
+    (with `history`) depend on the conversation, so they skip the answer cache.
+    """
+    partition, query_vector, cached, docs = await lookup_or_retrieve(role, query, spans, use_cache=not history)
+
+    if cached is not None:
+        flight.publish(cached["response"])
+        return {**cached, "cached": True, "prompt_tokens": None, "outcome": "cache"}
 
     if not docs:
+        flight.publish(NO_DOCS_ANSWER)
         return {
-            "username": user["username"],
-            "role": user["role"],
-            "query": message,
-            "response": "No relevant documents found for your role.",
-            "sources": []
+            "response": NO_DOCS_ANSWER, "sources": [], "chunk_ids": [],
+            "cached": False, "prompt_tokens": None, "outcome": "no_docs",
         }
 
-    # Build extended context
-    context = "\n\n-----\n\n".join([d.page_content for d in docs])
-
-    # High-quality system prompt
-    prompt = f"""
-You are FinSolve-AI, an enterprise assistant. 
-Your task is to give **long, detailed, well-structured answers** using ONLY the context provided.
-
-### Instructions:
-- Provide a **clear, multi-paragraph answer**
-- Include explanations, examples, reasoning steps
-- If the context contains multiple points, **summarize and connect them**
-- Never guess beyond the provided context
-- Write in a professional but easy-to-understand tone
-- Minimum length: **6–10 sentences**
-
-### User Role:
-{user['role']}
-
-### Context:
-{context}
-
-### Question:
-{message}
-
-### Final Answer (detailed and structured):
-"""
-
-    # Call Ollama LLM with extended generation parameters
-    payload = {
-        "model": "llama3.2",
-        "prompt": prompt,
-        "stream": False,
-
-        # Important: allow long answers
-        "num_predict": -1,        # unlimited tokens
-        "temperature": 0.2,       # more factual
-        "top_p": 0.9,             # smoother generation
-        "repeat_penalty": 1.1     # avoid short repetitive output
+    context, prompt, prompt_tokens = prepare_prompt(user_role, docs, message, spans, history)
+    answer_parts = []
+
+    llm_start = time.perf_counter()
+    async for chunk in llm_client.stream(build_payload(prompt, stream=True, model=pick_model(message))):
+        token = chunk.get("response", "")
+        if token:
+            if not answer_parts:
+                spans.add("llm_first_token", time.perf_counter() - llm_start)
+            answer_parts.append(token)
+            flight.publish(token)
+        if chunk.get("done"):
+            observe_llm(parse_stats(chunk))
+    spans.add("llm", time.perf_counter() - llm_start)
+
+    answer = {
+        "response": "".join(answer_parts).strip(),
+        "sources": context.sources,
+        "chunk_ids": context.chunk_ids,
     }
+    if not history:
+        answer_cache.store(partition, message, query_vector, answer)
+    return {**answer, "cached": False, "prompt_tokens": prompt_tokens, "outcome": "rag"}
+
+
+def join_answer(role: str, user_role: str, message: str, spans: Spans, query: str, history: str):
+    """
+    (flight, leader): identical questions from one role (with the same
+    conversation, for follow-ups) that are in flight at the same time share
+    a single retrieval + generation.
+    """
+    return in_flight.join(
+        (role, normalize_query(query), history),
+        lambda flight: generate_answer(role, user_role, message, spans, flight, query, history),
+    )
 
-    response = requests.post("http://localhost:11434/api/generate", json=payload)
-
-    if response.status_code != 200:
-        raise HTTPException(500, f"Ollama error: {response.text}")
-
-    llm_answer = response.json().get("response", "").strip()
-
-    sources_list = [d.metadata.get("source", "unknown") for d in docs]
-    chunk_ids = [d.metadata.get("chunk_id", "") for d in docs]
 
-    # Save audit log
+def finish_answer(
+    user: Dict[str, str], message: str, spans: Spans, result: Dict, leader: bool,
+    session: Optional[Session], query: str,
+) -> Dict:
+    """Audit-log one user's answer (every user gets a row, coalesced or not) and add it to their session."""
+    if session is not None:
+        session_store.add_turn(session, message, result["response"], query)
     log_chat(
         username=user["username"],
         role=user["role"],
         query=message,
-        chunk_ids=chunk_ids,
-        answer_text=llm_answer
+        chunk_ids=result["chunk_ids"],
+        answer_text=result["response"],
+        timings=spans.finish(result["outcome"] if leader else "coalesced"),
     )
+    return {
+        "sources": result["sources"],
+        "cached": result["cached"],
+        "coalesced": not leader,
+        "route": "rag",
+        "prompt_tokens": result["prompt_tokens"],
+        "session_id": session.id if session is not None else None,
+        "rewritten_query": query if query != message else None,
+    }
+
+
+@app.post("/chat")
+async def chat(req: ChatRequest):
+    user = req.user
+    message = req.message
+    role = user["role"].lower()
+    spans = Spans("chat")
+    session, query, history = resolve_question(req, spans)
+
+    structured = await answer_from_tables(role, query, spans)
+    if structured is not None:
+        if session is not None:
+            session_store.add_turn(session, message, structured["response"], query)
+        log_chat(
+            username=user["username"],
+            role=user["role"],
+            query=message,
+            chunk_ids=[],
+            answer_text=structured["response"],
+            timings=spans.finish("sql"),
+        )
+        return {
+            "username": user["username"],
+            "role": user["role"],
+            "query": message,
+            "response": structured["response"],
+            "sources": structured["sources"],
+            "cached": False,
+            "route": "sql",
+            "sql": structured["sql"],
+            "session_id": req.session_id,
+        }
+
+    flight, leader = join_answer(role, user["role"], message, spans, query, history)
+    try:
+        result = await flight.wait()
+    except LLMBusyError as e:
+        spans.finish("busy")
+        raise HTTPException(503, str(e))
+    except LLMError as e:
+        spans.finish("error")
+        raise HTTPException(500, f"Ollama error: {e}")
 
     return {
         "username": user["username"],
         "role": user["role"],
         "query": message,
-        "response": llm_answer,
-        "sources": sources_list
+        "response": result["response"],
+        **finish_answer(user, message, spans, result, leader, session, query),
     }
 
-    # Prepare for UI + logging
-    docs_list = [{"content": d.page_content, "metadata": d.metadata} for d in docs]
-    sources_list = [d.metadata.get("source", "unknown") for d in docs]
-    # ✅ use chunk_id everywhere
-    chunk_ids = [d.metadata.get("chunk_id", "") for d in docs]
 
-    # Log into DuckDB
-    log_chat(
-        username=user["username"],
-        role=user["role"],
-        query=message,
-        chunk_ids=chunk_ids,
-        answer_text=llm_answer,
-    )
+# -----------------------------
+# CHAT Streaming Endpoint (NDJSON)
+# -----------------------------
+# Each line is one JSON event:
+#   {"type": "token", "content": "..."}   -> forwarded as Ollama emits it
+#   {"type": "done", "sources": [...]}    -> end of answer
+#   {"type": "error", "detail": "..."}    -> generation failed
+def _ndjson(event: Dict) -> str:
+    return json.dumps(event) + "\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    user = req.user
+    message = req.message
+    role = user["role"].lower()
+    spans = Spans("chat_stream")
+    session, query, history = resolve_question(req, spans)
+
+    structured = await answer_from_tables(role, query, spans)
+    if structured is not None:
+        if session is not None:
+            session_store.add_turn(session, message, structured["response"], query)
+        log_chat(
+            username=user["username"],
+            role=user["role"],
+            query=message,
+            chunk_ids=[],
+            answer_text=structured["response"],
+            timings=spans.finish("sql"),
+        )
+
+        async def sql_stream():
+            yield _ndjson({"type": "token", "content": structured["response"]})
+            yield _ndjson({
+                "type": "done", "sources": structured["sources"], "cached": False, "route": "sql",
+                "session_id": req.session_id,
+            })
+
+        return StreamingResponse(sql_stream(), media_type="application/x-ndjson")
 
+    flight, leader = join_answer(role, user["role"], message, spans, query, history)
+
+    async def event_stream():
+        # a follower that joins mid-answer first gets the tokens it missed
+        async for token in flight.follow():
+            yield _ndjson({"type": "token", "content": token})
+        try:
+            result = await flight.wait()
+        except LLMError as e:
+            spans.finish("busy" if isinstance(e, LLMBusyError) else "error")
+            yield _ndjson({"type": "error", "detail": f"Ollama error: {e}"})
+            return
+
+        # Save audit log once the full answer has been streamed
+        yield _ndjson({"type": "done", **finish_answer(user, message, spans, result, leader, session, query)})
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+
+# -----------------------------
+# CHAT Batch Endpoint (NDJSON)
+# -----------------------------
+# For offline question sets (e.g. nightly compliance runs, see chat_batch.py).
+# The SQL route, embedding, cache lookup and retrieval run once for the whole
+# batch; generations run CHAT_BATCH_CONCURRENCY at a time. One line per
+# question as it completes, then a summary:
+#   {"type": "result", "index": 3, "query": "...", "response": "...", ...}
+#   {"type": "error", "index": 7, "query": "...", "detail": "..."}
+#   {"type": "done", "questions": 120, "answered": 119, "errors": 1, ...}
+# Repeated questions (same normalized text) are answered once and the answer
+# is sent for every index that asked it ("coalesced": true on the repeats).
+# Audit rows for the whole batch go to chat_logs in one bulk insert.
+class BatchChatRequest(BaseModel):
+    user: Dict[str, str]
+    questions: List[str]
+
+
+def batch_sql_route(partition: str, questions: List[str], spans: List[Spans]):
+    results = []
+    for message, question_spans in zip(questions, spans):
+        with question_spans.span("sql_route"):
+            results.append(table_router.answer(partition, message, ALL_ROLES))
+    return results
+
+
+def batch_rerank(messages: List[str], docs: List[list], spans: List[Spans]):
+    reranked = []
+    for message, candidates, question_spans in zip(messages, docs, spans):
+        with question_spans.span("rerank"):
+            reranked.append(reranker.rerank(message, candidates, RERANK_TOP_K, RETRIEVAL_K))
+    return reranked
+
+
+async def batch_generate(user_role: str, partition: str, message: str, query_vector, docs,
+                         spans: Spans, slots: asyncio.Semaphore) -> Dict:
+    context, prompt, prompt_tokens = prepare_prompt(user_role, docs, message, spans)
+    async with slots:
+        llm_start = time.perf_counter()
+        response = await llm_client.generate(build_payload(prompt, stream=False, model=pick_model(message)))
+        spans.add("llm", time.perf_counter() - llm_start)
+    observe_llm(parse_stats(response))
+
+    answer = {
+        "response": response.get("response", "").strip(),
+        "sources": context.sources,
+        "chunk_ids": context.chunk_ids,
+    }
+    answer_cache.store(partition, message, query_vector, answer)
+    return {**answer, "cached": False, "route": "rag", "prompt_tokens": prompt_tokens, "outcome": "rag"}
+
+
+@app.post("/chat/batch")
+async def chat_batch(req: BatchChatRequest):
+    user = req.user
+    role = user["role"].lower()
+    partition = role_partition(role)
+    questions = req.questions
+    if not questions:
+        raise HTTPException(400, "No questions given")
+    if len(questions) > CHAT_BATCH_MAX_QUESTIONS:
+        raise HTTPException(413, f"At most {CHAT_BATCH_MAX_QUESTIONS} questions per batch")
+    blank = [i for i, question in enumerate(questions) if not question.strip()]
+    if blank:
+        raise HTTPException(422, f"Empty questions at index {', '.join(map(str, blank[:20]))}")
+
+    # index of the first occurrence -> every index asking the same question
+    repeats: Dict[int, List[int]] = {}
+    first_index: Dict[str, int] = {}
+    for i, question in enumerate(questions):
+        repeats.setdefault(first_index.setdefault(normalize_query(question), i), []).append(i)
+    unique = list(repeats)
+
+    spans = [Spans("chat_batch") for _ in questions]
+    start = time.perf_counter()
+
+    async def event_stream():
+        audit_rows, counts = [], {"answered": 0, "errors": 0, "cached": 0}
+
+        def emit(i: int, result: Dict) -> Iterator[str]:
+            for j in repeats[i]:
+                counts["answered"] += 1
+                counts["cached"] += result["cached"]
+                audit_rows.append(chat_row(
+                    username=user["username"],
+                    role=user["role"],
+                    query=questions[j],
+                    chunk_ids=result["chunk_ids"],
+                    answer_text=result["response"],
+                    timings=spans[j].finish(result["outcome"]),
+                ))
+                yield _ndjson({
+                    "type": "result", "index": j, "query": questions[j],
+                    **{key: value for key, value in result.items() if key not in ("chunk_ids", "outcome")},
+                    **({"coalesced": True} if j != i else {}),
+                })
+
+        def emit_error(i: int, error: LLMError) -> Iterator[str]:
+            for j in repeats[i]:
+                counts["errors"] += 1
+                spans[j].finish("busy" if isinstance(error, LLMBusyError) else "error")
+                yield _ndjson({"type": "error", "index": j, "query": questions[j], "detail": f"Ollama error: {error}"})
+
+        try:
+            structured = await run_in_threadpool(
+                batch_sql_route, partition, [questions[i] for i in unique], [spans[i] for i in unique],
+            )
+            for i, answer in zip(unique, structured):
+                if answer is not None:
+                    for line in emit(i, {**answer, "chunk_ids": [], "cached": False, "route": "sql", "outcome": "sql"}):
+                        yield line
+
+            pending = [i for i, answer in zip(unique, structured) if answer is None]
+            if pending:
+                messages = [questions[i] for i in pending]
+
+                # one embedding call for every question the query cache doesn't have
+                embed_start = time.perf_counter()
+                vectors = await run_in_threadpool(query_embedder.embed_many, messages)
+                for i in pending:
+                    spans[i].add("embed", time.perf_counter() - embed_start)
+
+                to_retrieve = []
+                for i, vector in zip(pending, vectors):
+                    with spans[i].span("cache_lookup"):
+                        cached = answer_cache.lookup(partition, questions[i], vector)
+                    if cached is not None:
+                        for line in emit(i, {**cached, "cached": True, "route": "rag", "prompt_tokens": None, "outcome": "cache"}):
+                            yield line
+                    else:
+                        to_retrieve.append((i, vector))
+
+                if to_retrieve:
+                    indexes = [i for i, _ in to_retrieve]
+                    messages = [questions[i] for i in indexes]
+                    vectors = [vector for _, vector in to_retrieve]
+
+                    retrieve_start = time.perf_counter()
+                    k = RERANK_CANDIDATES if RERANK else RETRIEVAL_K
+                    docs = await run_in_threadpool(retrieve_docs_many, partition, messages, vectors, k)
+                    for i in indexes:
+                        spans[i].add("retrieve", time.perf_counter() - retrieve_start)
+                    if RERANK:
+                        docs = await run_in_threadpool(batch_rerank, messages, docs, [spans[i] for i in indexes])
+
+                    slots = asyncio.Semaphore(max(1, CHAT_BATCH_CONCURRENCY))
+
+                    async def generate(i: int, vector, question_docs):
+                        try:
+                            return i, await batch_generate(
+                                user["role"], partition, questions[i], vector, question_docs, spans[i], slots,
+                            ), None
+                        except LLMError as e:
+                            return i, None, e
+
+                    tasks = []
+                    for i, vector, question_docs in zip(indexes, vectors, docs):
+                        if question_docs:
+                            tasks.append(asyncio.create_task(generate(i, vector, question_docs)))
+                        else:
+                            for line in emit(i, {
+                                "response": NO_DOCS_ANSWER, "sources": [], "chunk_ids": [], "cached": False,
+                                "route": "rag", "prompt_tokens": None, "outcome": "no_docs",
+                            }):
+                                yield line
+
+                    try:
+                        for next_done in asyncio.as_completed(tasks):
+                            i, result, error = await next_done
+                            for line in (emit(i, result) if error is None else emit_error(i, error)):
+                                yield line
+                    finally:
+                        # client went away: don't keep generating for nobody
+                        for task in tasks:
+                            task.cancel()
+
+            yield _ndjson({
+                "type": "done", "questions": len(questions), **counts,
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+            })
+        finally:
+            # one bulk insert for the batch, also when the client disconnected part-way;
+            # off the event loop (in multi-worker mode it is an HTTP call to the state server),
+            # shielded so a disconnect's cancellation doesn't drop the rows
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(log_chats, audit_rows)
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+
+# -----------------------------
+# LLM queue status
+# -----------------------------
+@app.get("/llm/stats")
+def llm_stats():
+    return llm_client.stats()
+
+
+# -----------------------------
+# Answer cache stats
+# -----------------------------
+@app.get("/cache/stats")
+def cache_stats():
     return {
-        "username": user["username"],
-        "role": user["role"],
-        "query": message,
-        "response": llm_answer,
-        "docs": docs_list,
-        "sources": sources_list,
+        "answers": answer_cache.stats(),
+        "query_embeddings": query_embedder.stats(),
+        "document_embeddings": embedding_cache.stats() if embedding_cache is not None else None,
+        "single_flight": in_flight.stats(),
+        "auth": user_store.stats(),
+        "sessions": session_store.stats(),
+        "rerank": reranker.stats(),
     }
 
 
+# -----------------------------
+# Conversation sessions
+# -----------------------------
+@app.get("/sessions/{session_id}")
+def get_session(session_id: str, user: Dict[str, str] = Depends(authenticate)):
+    try:
+        return session_store.get(session_id, user["username"]).to_dict()
+    except PermissionError:
+        raise HTTPException(status_code=403, detail="Session belongs to another user")
+
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str, user: Dict[str, str] = Depends(authenticate)):
+    if not session_store.delete(session_id, user["username"]):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"message": f"Session '{session_id}' cleared."}
+
+
+# -----------------------------
+# Prometheus metrics
+# -----------------------------
+LLM_QUEUE = Gauge("llm_generations", "Generations running / waiting for a slot", ("state",))
+LLM_BACKEND_UP = Gauge("llm_backend_up", "1 if the Ollama backend passed its last health check", ("backend",))
+LLM_BACKEND_OUTSTANDING = Gauge("llm_backend_outstanding", "Generations running or waiting on the backend", ("backend",))
+LLM_BACKEND_FAILURES = Gauge("llm_backend_failures", "Failed generations on the backend since startup", ("backend",))
+ANSWER_CACHE_ENTRIES = Gauge("answer_cache_entries", "Answers held in the semantic cache", ("partition",))
+ANSWER_CACHE_LOOKUPS = Gauge("answer_cache_lookups", "Answer cache lookups since startup", ("result",))
+CHAT_FLIGHTS = Gauge("chat_flights", "Chat answers generated vs. coalesced onto an in-flight one", ("kind",))
+
+
+@app.get("/metrics")
+def metrics():
+    llm = llm_client.stats()
+    LLM_QUEUE.set(llm["running"], state="running")
+    LLM_QUEUE.set(llm["waiting"], state="waiting")
+    for backend in llm["backends"]:
+        LLM_BACKEND_UP.set(int(backend["healthy"]), backend=backend["url"])
+        LLM_BACKEND_OUTSTANDING.set(backend["running"] + backend["waiting"], backend=backend["url"])
+        LLM_BACKEND_FAILURES.set(backend["failures"], backend=backend["url"])
+    cache = answer_cache.stats()
+    for partition, entries in cache["entries"].items():
+        ANSWER_CACHE_ENTRIES.set(entries, partition=partition)
+    ANSWER_CACHE_LOOKUPS.set(cache["hits"], result="hit")
+    ANSWER_CACHE_LOOKUPS.set(cache["misses"], result="miss")
+    flights = in_flight.stats()
+    CHAT_FLIGHTS.set(flights["flights"], kind="generated")
+    CHAT_FLIGHTS.set(flights["coalesced"], kind="coalesced")
+    CHAT_FLIGHTS.set(flights["in_flight"], kind="in_flight")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+# -----------------------------
+# Shared state (multi-worker mode)
+# -----------------------------
+STATE_POLL_SECONDS = float(os.getenv("STATE_POLL_SECONDS", "2"))
+
+
+def apply_state_changes(changed):
+    """Reload what another process changed (names as passed to db.bump_version)."""
+    global lexical_index
+    if "users" in changed:
+        user_store.load()
+    if "tables" in changed:
+        table_router.refresh()
+    roles = [name.split(":", 1)[1] for name in changed if name.startswith("index:")]
+    if roles:
+        vectordb.reopen()
+        lexical_index = LexicalIndex.load()
+        for role in roles:
+            answer_cache.invalidate(role)
+
+
+async def follow_shared_state():
+    versions = await run_in_threadpool(load_versions)
+    while True:
+        await asyncio.sleep(STATE_POLL_SECONDS)
+        try:
+            latest = await run_in_threadpool(load_versions)
+            changed = {name for name, version in latest.items() if versions.get(name) != version}
+            if changed:
+                await run_in_threadpool(apply_state_changes, changed)
+            versions = latest
+        except Exception as e:
+            print(f"⚠️ Shared state refresh failed, will retry: {e}")
+
+
+# -----------------------------
+# Readiness probe
+# -----------------------------
+@app.get("/ready")
+def ready():
+    status = embedding_function.status()
+    return JSONResponse(status, status_code=200 if embedding_function.ready else 503)
+
+
 # -----------------------------
 # Upload Documents (Admin Only)
 # -----------------------------
-@app.post("/upload-docs")
+def state_server_unavailable(e: StateServerError) -> HTTPException:
+    # 503 when it can't be reached / timed out, 502 when it answered with an error
+    return HTTPException(status_code=503 if e.status_code is None else 502, detail=str(e))
+
+
+def run_ingest_job(job: IngestJob, temp_path: str) -> Dict:
+    with index_write_lock(CHROMA_DIR):
+        result = ingest_upload(vectordb, lexical_index, temp_path, job.file_name, job.role, job.timings)
+    if job.file_name.endswith(".csv"):
+        table_router.refresh()
+
+    # New chunks may change answers for this role (and for c-level)
+    answer_cache.invalidate(job.role)
+    return result
+
+
+@app.post("/upload-docs", status_code=202)
 def upload_docs(
     role: str = Form(...),
     file: UploadFile = File(...),
@@ -205,65 +810,101 @@ def upload_docs(
     if "c-levelexecutives" not in user["role"].lower():
         raise HTTPException(status_code=403, detail="Not allowed")
 
-    filename = file.filename
-    temp_path = f"temp_{filename}"
+    filename = os.path.basename(file.filename or "")
+    if not is_supported(filename):
+        raise HTTPException(status_code=400, detail="Unsupported file type")
+
+    role = role.lower()
+    if STATE_URL:
+        # multi-worker mode: the state server is the only process that writes the index
+        try:
+            job = state_request(
+                "POST", "/ingest",
+                data={"role": role, "username": user["username"]}, files={"file": (filename, file.file)},
+            )
+        except StateServerError as e:
+            raise state_server_unavailable(e)
+        return {
+            "message": f"Upload of '{filename}' to role '{role}' queued.",
+            "job_id": job["job_id"],
+            "status": job["status"],
+        }
+
+    temp_path = job_manager.save_upload(file.file, filename)
+
+    # Parsing + embedding happen on the job pool; poll /jobs/{job_id}
+    job = job_manager.submit(IngestJob(role, filename, user["username"]), temp_path, run_ingest_job)
+
+    return {
+        "message": f"Upload of '{filename}' to role '{role}' queued.",
+        "job_id": job.id,
+        "status": job.status,
+    }
+
 
-    with open(temp_path, "wb") as f:
-        f.write(file.file.read())
+# -----------------------------
+# Ingestion Job Status
+# -----------------------------
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, user: Dict[str, str] = Depends(authenticate)):
+    if "c-levelexecutives" not in user["role"].lower():
+        raise HTTPException(status_code=403, detail="Not allowed")
 
-    # Load file
-    if filename.endswith(".md") or filename.endswith(".txt"):
+    if STATE_URL:
         try:
-            loader = UnstructuredFileLoader(temp_path)
-            docs = loader.load()
-        except Exception:
-            loader = TextLoader(temp_path, encoding="utf-8")
-            docs = loader.load()
-    elif filename.endswith(".csv"):
-        loader = CSVLoader(temp_path)
-        docs = loader.load()
-    elif filename.endswith(".pdf"):
-        loader = PyPDFLoader(temp_path)
-        docs = loader.load()
-    else:
-        os.remove(temp_path)
-        raise HTTPException(status_code=400, detail="Unsupported file type")
+            return state_request("GET", f"/jobs/{job_id}")
+        except StateServerError as e:
+            if e.status_code == 404:
+                raise HTTPException(status_code=404, detail="Job not found")
+            raise state_server_unavailable(e)
+
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+# -----------------------------
+# Chat Log Analytics (Admin Only)
+# -----------------------------
+def require_admin(user: Dict[str, str] = Depends(authenticate)):
+    if "c-levelexecutives" not in user["role"].lower():
+        raise HTTPException(status_code=403, detail="Not allowed")
+    return user
 
-    # Split docs
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    split_docs = splitter.split_documents(docs)
-
-    # Store in Chroma + DuckDB
-    for d in split_docs:
-        d.metadata["role"] = role.lower()
-        d.metadata["department"] = role.lower()
-        d.metadata["source"] = filename
-        d.metadata["file_name"] = filename
-
-        chunk_id = str(uuid.uuid4())
-        d.metadata["chunk_id"] = chunk_id  # ✅ consistent
-
-        log_doc_chunk(
-            chunk_id=chunk_id,
-            file_name=filename,
-            role=role.lower(),
-            department=role.lower(),
-            source=filename,
-        )
 
-    vectordb.add_documents(split_docs)
+@app.get("/analytics/top-queries")
+def analytics_top_queries(days: int = 30, limit: int = 10, role: Optional[str] = None,
+                          user: Dict[str, str] = Depends(require_admin)):
+    return {"days": days, "top_queries": chat_analytics.top_queries(days, limit, role)}
 
-    os.remove(temp_path)
 
-    return {"message": f"Uploaded {len(split_docs)} chunks to role '{role}'."}
+@app.get("/analytics/chunks")
+def analytics_chunks(days: int = 30, limit: int = 20, user: Dict[str, str] = Depends(require_admin)):
+    return {"days": days, "chunks": chat_analytics.chunk_hits(days, limit)}
+
+
+@app.get("/analytics/latency")
+def analytics_latency(days: int = 30, role: Optional[str] = None, user: Dict[str, str] = Depends(require_admin)):
+    return {"days": days, "role": role, **chat_analytics.latency(days, role)}
+
+
+@app.get("/analytics/volume")
+def analytics_volume(days: int = 30, user: Dict[str, str] = Depends(require_admin)):
+    return {"days": days, "volume": chat_analytics.daily_volume(days)}
 
 
 # -----------------------------
 # Roles Endpoint (for UI)
 # -----------------------------
 @app.get("/roles")
-def get_roles():
-    return {"roles": sorted(list(set([u["role"] for u in users_db.values()])))}
+def get_roles(request: Request):
+    roles, etag = user_store.roles()
+    # clients revalidate with If-None-Match and get an empty 304 while roles are unchanged
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({"roles": roles}, headers=headers)
 
 
 # -----------------------------
@@ -279,16 +920,16 @@ def create_user(
     if "c-levelexecutives" not in user["role"].lower():
         raise HTTPException(status_code=403, detail="Not allowed")
 
-    if username in users_db:
+    try:
+        user_store.create_user(username, password, role)
+    except UserExistsError:
         raise HTTPException(status_code=400, detail="User already exists")
 
-    users_db[username] = {"password": password, "role": role}
-
     return {"message": f"User '{username}' created."}
 
 
 # -----------------------------
-# Create Role (dummy, stored in memory)
+# Create Role
 # -----------------------------
 @app.post("/create-role")
 def create_role(
@@ -298,5 +939,5 @@ def create_role(
     if "c-levelexecutives" not in user["role"].lower():
         raise HTTPException(status_code=403, detail="Not allowed")
 
-    # In a real app you would persist this in DB; for now, just echo back
+    user_store.create_role(role_name)
     return {"message": f"Role '{role_name}' added."}
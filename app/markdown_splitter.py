@@ -0,0 +1,215 @@
+"""
+Header- and table-aware splitting for markdown documents.
+
+RecursiveCharacterTextSplitter cuts at fixed sizes, so a chunk often starts
+mid-section (without its heading) or splits a table away from its header row.
+split_markdown() instead:
+
+- parses the text into blocks: headings (ATX "#" and setext "----" style),
+  tables, fenced code, and paragraphs / lists
+- tracks the heading path of every block ("Q1 - January to March 2024 >
+  Quarterly Financial Overview") and returns it as the chunk's `section`
+- packs whole blocks into chunks of up to MARKDOWN_CHUNK_SIZE characters,
+  starting a new chunk at a top-level heading once the current one is half
+  full; a chunk that starts mid-section is prefixed with its heading path
+- keeps a table in one chunk when it fits, otherwise splits it by rows and
+  repeats the header row in every piece
+- only falls back to character splitting (with overlap) for a single block
+  larger than a chunk
+"""
+
+import os
+import re
+from typing import List, Tuple
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+MARKDOWN_CHUNK_SIZE = int(os.getenv("MARKDOWN_CHUNK_SIZE", "1000"))
+MARKDOWN_CHUNK_OVERLAP = 50          # only used when one block has to be cut
+SECTION_BREAK_LEVEL = 2              # "#" / "##" headings start a new chunk when it's half full
+
+_ATX_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_SETEXT_RE = re.compile(r"^(={3,}|-{3,})\s*$")
+_FENCE_RE = re.compile(r"^(```|~~~)")
+_TABLE_RE = re.compile(r"^\s*\|")
+_TABLE_RULE_RE = re.compile(r"^\s*\|?[\s:\-|]+\|?\s*$")
+
+
+class _Block:
+    __slots__ = ("text", "path", "kind", "level")
+
+    def __init__(self, text: str, path: Tuple[str, ...], kind: str, level: int = 0):
+        self.text = text
+        self.path = path
+        self.kind = kind       # heading / table / code / text
+        self.level = level     # heading level, 0 for content
+
+
+def _clean_heading(text: str) -> str:
+    return re.sub(r"[*_`]", "", text).strip().rstrip(":").strip()
+
+
+def _parse(text: str) -> List[_Block]:
+    lines = text.splitlines()
+    blocks: List[_Block] = []
+    path: List[Tuple[int, str]] = []
+    buffer: List[str] = []
+
+    def current_path():
+        return tuple(title for _, title in path)
+
+    def flush(kind="text"):
+        if buffer and any(l.strip() for l in buffer):
+            blocks.append(_Block("\n".join(buffer).strip("\n"), current_path(), kind))
+        buffer.clear()
+
+    def heading(level: int, title: str, line: str):
+        flush()
+        while path and path[-1][0] >= level:
+            path.pop()
+        path.append((level, _clean_heading(title)))
+        blocks.append(_Block(line, current_path(), "heading", level))
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+
+        if _FENCE_RE.match(line):
+            flush()
+            fence = _FENCE_RE.match(line).group(1)
+            buffer.append(line)
+            i += 1
+            while i < len(lines):
+                buffer.append(lines[i])
+                i += 1
+                if lines[i - 1].startswith(fence):
+                    break
+            flush("code")
+            continue
+
+        atx = _ATX_RE.match(line)
+        if atx:
+            heading(len(atx.group(1)), atx.group(2), line.strip())
+            i += 1
+            continue
+
+        # setext heading: a single text line underlined with === / ---
+        if (line.strip() and i + 1 < len(lines) and _SETEXT_RE.match(lines[i + 1])
+                and not _TABLE_RE.match(line) and (not buffer or not buffer[-1].strip())):
+            heading(1 if lines[i + 1].lstrip().startswith("=") else 2, line, line.strip())
+            i += 2
+            continue
+
+        if _TABLE_RE.match(line):
+            flush()
+            while i < len(lines) and _TABLE_RE.match(lines[i]):
+                buffer.append(lines[i])
+                i += 1
+            flush("table")
+            continue
+
+        if not line.strip() or _SETEXT_RE.match(line):
+            # blank line / horizontal rule ends a paragraph (list items stay together)
+            if buffer and not _is_list_continuation(lines, i):
+                flush()
+            i += 1
+            continue
+
+        buffer.append(line)
+        i += 1
+
+    flush()
+    return blocks
+
+
+def _is_list_continuation(lines: List[str], i: int) -> bool:
+    """A blank line inside a list (the next non-blank line is indented or another item)."""
+    j = i
+    while j < len(lines) and not lines[j].strip():
+        j += 1
+    if j >= len(lines) or _SETEXT_RE.match(lines[j]):
+        return False
+    following = lines[j]
+    return following.startswith((" ", "\t")) or bool(re.match(r"^\s*([-*+]|\d+[.)])\s", following))
+
+
+def _split_table(text: str, size: int) -> List[str]:
+    rows = text.split("\n")
+    header = rows[:2] if len(rows) > 1 and _TABLE_RULE_RE.match(rows[1]) else rows[:1]
+    pieces, current = [], list(header)
+    for row in rows[len(header):]:
+        if len(current) > len(header) and len("\n".join(current + [row])) > size:
+            pieces.append("\n".join(current))
+            current = list(header)
+        current.append(row)
+    pieces.append("\n".join(current))
+    return pieces
+
+
+def _fit(block: _Block, size: int, overlap: int) -> List[str]:
+    """A block's text, cut into pieces of at most `size` characters if needed."""
+    if len(block.text) <= size:
+        return [block.text]
+    if block.kind == "table":
+        return _split_table(block.text, size)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=size, chunk_overlap=overlap)
+    return splitter.split_text(block.text)
+
+
+def _breadcrumb(path: Tuple[str, ...]) -> str:
+    return f"[{' > '.join(path)}]" if path else ""
+
+
+def split_markdown(
+    text: str,
+    chunk_size: int = MARKDOWN_CHUNK_SIZE,
+    chunk_overlap: int = MARKDOWN_CHUNK_OVERLAP,
+) -> List[Tuple[str, str]]:
+    """[(chunk text, section path)] for a markdown document."""
+    chunks: List[Tuple[str, str]] = []
+    parts: List[str] = []
+    kinds: List[str] = []
+    section: Tuple[str, ...] = ()
+    length = 0
+
+    def emit():
+        nonlocal length
+        if any(k != "heading" for k in kinds):
+            chunks.append(("\n\n".join(parts), " > ".join(section)))
+        parts.clear()
+        kinds.clear()
+        length = 0
+
+    def add(text: str, kind: str):
+        nonlocal length
+        parts.append(text)
+        kinds.append(kind)
+        length += len(text) + 2
+
+    for block in _parse(text):
+        if block.kind == "heading" and block.level <= SECTION_BREAK_LEVEL and length >= chunk_size // 2:
+            emit()
+
+        # leave room for the breadcrumb a continuation chunk starts with
+        budget = chunk_size - len(_breadcrumb(block.path)) - 2
+        for piece in _fit(block, budget, chunk_overlap):
+            if parts and length + len(piece) + 2 > chunk_size:
+                # headings go with the content under them, not at the end of the previous chunk
+                carried = []
+                while kinds and kinds[-1] == "heading":
+                    carried.insert(0, parts.pop())
+                    kinds.pop()
+                    length -= len(carried[0]) + 2
+                emit()
+                for heading in carried:
+                    add(heading, "heading")
+                if carried:
+                    section = block.path
+            if not parts:
+                section = block.path
+                if block.kind != "heading" and block.path:
+                    add(_breadcrumb(block.path), "breadcrumb")
+            add(piece, block.kind)
+
+    emit()
+    return chunks
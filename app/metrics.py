@@ -0,0 +1,183 @@
+"""
+Prometheus-style metrics served on GET /metrics.
+
+A minimal in-process registry of counters, gauges and histograms rendered in
+the Prometheus text exposition format, so nothing beyond the standard library
+is needed. Request paths time their stages with Spans: each finished request
+feeds the `rag_stage_seconds` histogram, and the same per-stage timings are
+stored with the request's chat_logs row.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# seconds; covers cache hits (ms) through long local generations (minutes)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts..., sum, count]
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state):
+                    cumulative += count
+                    le = _labels(self.labelnames, key, f'le="{_number(bound)}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                inf = _labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{inf} {state[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(state[-2])}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(line for m in metrics for line in m.render()) + "\n"
+
+
+# ----------------------------
+# Metrics shared across the app
+# ----------------------------
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time spent in each stage of a request", ("path", "stage"))
+REQUESTS = Counter("rag_requests_total", "Requests by path and how they were answered", ("path", "route"))
+
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens processed by the LLM", ("kind",))
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_tokens_per_second", "Generation speed reported by Ollama",
+    buckets=(1, 2, 5, 10, 20, 40, 80, 160, 320),
+)
+LLM_SECONDS = Histogram("llm_duration_seconds", "Durations reported by Ollama", ("phase",))
+PROMPT_TOKENS = Histogram(
+    "rag_prompt_tokens", "Estimated prompt tokens per generation (retrieved = context before assembly)",
+    ("part",), buckets=(64, 128, 256, 512, 1024, 1536, 2048, 3072, 4096, 8192),
+)
+
+
+def observe_stages(path: str, timings: Dict[str, float]):
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, path=path, stage=stage)
+
+
+def observe_llm(stats: Dict):
+    """Record token counts / durations parsed by llm.parse_stats()."""
+    LLM_TOKENS.inc(stats.get("prompt_tokens", 0), kind="prompt")
+    LLM_TOKENS.inc(stats.get("completion_tokens", 0), kind="completion")
+    if stats.get("tokens_per_second"):
+        LLM_TOKENS_PER_SECOND.observe(stats["tokens_per_second"])
+    for phase in ("load", "prompt_eval", "eval", "total"):
+        if f"{phase}_seconds" in stats:
+            LLM_SECONDS.observe(stats[f"{phase}_seconds"], phase=phase)
+
+
+class Spans:
+    """Per-request stage timer: `with spans.span("retrieve"): ...`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.timings: Dict[str, float] = {}
+        self._start = time.perf_counter()
+        self._finished: Optional[Dict[str, float]] = None
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage: str, seconds: float):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def finish(self, route: str) -> Dict[str, float]:
+        """Record the request (once) and return its stage timings incl. total."""
+        if self._finished is None:
+            self.timings["total"] = time.perf_counter() - self._start
+            observe_stages(self.path, self.timings)
+            REQUESTS.inc(path=self.path, route=route)
+            self._finished = dict(self.timings)
+        return self._finished
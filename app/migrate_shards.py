@@ -0,0 +1,40 @@
+"""
+Moves an existing chroma_db from the single `company_docs` collection to the
+per-role shard layout (`company_docs_<role>`, see vector_store.py).
+
+Stored embeddings, documents and metadata are copied as-is, so nothing is
+re-embedded. The old collection is dropped afterwards unless --keep-legacy
+is given. embed_doc.py runs the same migration automatically.
+"""
+
+import argparse
+
+from vector_store import ShardedChroma, CHROMA_DIR, MIGRATE_BATCH_SIZE
+
+
+def main(persist_directory: str = CHROMA_DIR, batch_size: int = MIGRATE_BATCH_SIZE, keep_legacy: bool = False):
+    store = ShardedChroma(persist_directory)
+
+    pending = store.legacy_count()
+    if not pending:
+        print(f"✅ Nothing to migrate, shards: {store.counts()}")
+        return
+
+    print(f"🔀 Migrating {pending} chunks into per-role collections")
+    moved = store.migrate_legacy(batch_size=batch_size, drop=not keep_legacy)
+    for role, count in sorted(moved.items()):
+        print(f"  {role}: {count} chunks")
+
+    skipped = pending - sum(moved.values())
+    if skipped:
+        print(f"⚠️ {skipped} chunks had no role and were not migrated (re-run embed_doc.py)")
+    print(f"🎉 Done, shards: {store.counts()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chroma-dir", default=CHROMA_DIR, help="Chroma persist directory")
+    parser.add_argument("--batch-size", type=int, default=MIGRATE_BATCH_SIZE, help="chunks copied per batch")
+    parser.add_argument("--keep-legacy", action="store_true", help="don't drop the old company_docs collection")
+    args = parser.parse_args()
+    main(args.chroma_dir, batch_size=args.batch_size, keep_legacy=args.keep_legacy)
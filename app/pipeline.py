@@ -0,0 +1,275 @@
+"""
+Staged, parallel ingestion pipeline used by embed_doc.py.
+
+    load + split  ──►  embed  ──►  upsert
+    (process pool)     (batches)    (Chroma, streaming)
+
+Files are loaded and split across a process pool; changed chunks flow through
+bounded queues to an embedding stage that encodes them in fixed-size batches
+(torch uses every CPU core for each batch) and then to an upsert stage that
+streams them into Chroma. Each file's DuckDB metadata (and its lexical index
+entries) is written once all of its chunks are in Chroma, so a crash mid-run
+just re-indexes that file next time. Every stage reports its own progress and
+throughput.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import get_context
+
+from db import delete_doc_chunks
+from ingest import split_file, plan_chunks, refresh_kept, log_chunks
+
+# ----------------------------
+# Config (override via env / CLI)
+# ----------------------------
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "8"))    # batches buffered between stages
+PROGRESS_EVERY = 2.0                                            # seconds between progress lines
+
+_DONE = object()
+
+
+def _load_and_split(job):
+    # runs in a worker process
+    return split_file(job["file_path"], job["file_name"], job["role"], file_hash=job["file_hash"])
+
+
+class StageStats:
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, items: int, seconds: float):
+        with self.lock:
+            self.items += items
+            self.busy += seconds
+
+    def line(self, wall: float) -> str:
+        rate = self.items / wall if wall > 0 else 0.0
+        return f"{self.name}: {self.items} {self.unit} ({rate:.1f}/s, busy {self.busy:.1f}s)"
+
+
+class IngestPipeline:
+    def __init__(
+        self,
+        vectordb,
+        embedding_function,
+        workers: int = INGEST_WORKERS,
+        batch_size: int = EMBED_BATCH_SIZE,
+        queue_size: int = INGEST_QUEUE_SIZE,
+        lexical=None,
+    ):
+        self.vectordb = vectordb
+        self.embedding_function = embedding_function
+        self.lexical = lexical
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+
+        # chunks waiting to be embedded / embedded batches waiting for upsert
+        self._to_embed = queue.Queue(maxsize=queue_size * self.batch_size)
+        self._to_upsert = queue.Queue(maxsize=queue_size)
+
+        # file key -> [chunks still to upsert, all chunks of the file, chunks to upsert]
+        self._pending = {}
+        self._failed = set()
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "load": StageStats("load+split", "files"),
+            "embed": StageStats("embed", "chunks"),
+            "upsert": StageStats("upsert", "chunks"),
+        }
+        # files / chunks are counted once their chunks are in Chroma, not when queued
+        self.totals = {"updated": 0, "added": 0, "removed": 0, "failed": 0}
+        self._started = 0.0
+        self._last_report = 0.0
+
+    # ----------------------------
+    # Progress
+    # ----------------------------
+    def _report(self, force: bool = False):
+        now = time.perf_counter()
+        if not force and now - self._last_report < PROGRESS_EVERY:
+            return
+        self._last_report = now
+        wall = now - self._started
+        print("⏱️ " + " | ".join(s.line(wall) for s in self.stats.values()))
+
+    # ----------------------------
+    # Stage 2: embed
+    # ----------------------------
+    def _embed_stage(self):
+        finished = False
+        while not finished:
+            batch = []
+            item = self._to_embed.get()
+            while item is not _DONE:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._to_embed.get(timeout=0.05)
+                except queue.Empty:
+                    break
+            finished = item is _DONE
+
+            if batch:
+                start = time.perf_counter()
+                try:
+                    vectors = self.embedding_function.embed_documents([d.page_content for _, d in batch])
+                except Exception as e:
+                    print(f"❌ Embedding batch failed: {e}")
+                    self._mark_failed(key for key, _ in batch)
+                    for key, _ in batch:
+                        self._chunk_done(key)
+                    continue
+                self.stats["embed"].add(len(batch), time.perf_counter() - start)
+                self._to_upsert.put((batch, vectors))
+
+        self._to_upsert.put(_DONE)
+
+    # ----------------------------
+    # Stage 3: upsert
+    # ----------------------------
+    def _upsert_stage(self):
+        while True:
+            item = self._to_upsert.get()
+            if item is _DONE:
+                break
+            batch, vectors = item
+
+            start = time.perf_counter()
+            try:
+                self.vectordb.upsert(
+                    ids=[d.metadata["chunk_id"] for _, d in batch],
+                    embeddings=vectors,
+                    metadatas=[d.metadata for _, d in batch],
+                    documents=[d.page_content for _, d in batch],
+                )
+            except Exception as e:
+                print(f"❌ Upsert batch failed: {e}")
+                self._mark_failed(key for key, _ in batch)
+            self.stats["upsert"].add(len(batch), time.perf_counter() - start)
+
+            for key, _ in batch:
+                self._chunk_done(key)
+            self._report()
+
+    def _mark_failed(self, keys):
+        with self._lock:
+            self._failed.update(keys)
+
+    def _chunk_done(self, key):
+        with self._lock:
+            entry = self._pending[key]
+            entry[0] -= 1
+            if entry[0] > 0:
+                return
+            del self._pending[key]
+            failed = key in self._failed
+
+        if failed:
+            # leave the old file_hash in DuckDB so the next run retries this file
+            self._count(failed=1)
+            print(f"❌ {key[0]}/{key[1]} not fully indexed, will retry next run")
+        else:
+            if self.lexical is not None:
+                self.lexical.add_documents(entry[1])
+            log_chunks(entry[1])
+            self._count(updated=1, added=entry[2])
+
+    def _count(self, **counts):
+        # called from the driver and the upsert thread
+        with self._lock:
+            for name, n in counts.items():
+                self.totals[name] += n
+
+    # ----------------------------
+    # Stage 1 (driver): load + split, diff, feed the embed stage
+    # ----------------------------
+    def _handle_split(self, job, split_docs):
+        key = (job["role"], job["file_name"])
+        to_add, kept, stale_ids = plan_chunks(split_docs, job["previous_ids"])
+
+        if stale_ids:
+            self.vectordb.delete(ids=stale_ids)
+            delete_doc_chunks(stale_ids)
+            if self.lexical is not None:
+                self.lexical.remove(stale_ids)
+            self._count(removed=len(stale_ids))
+        refresh_kept(self.vectordb, kept)
+
+        print(f"✅ {job['file_name']}: {len(split_docs)} chunks ({len(to_add)} to embed, {len(stale_ids)} removed)")
+
+        if not to_add:
+            if self.lexical is not None:
+                self.lexical.add_documents(split_docs)
+            log_chunks(split_docs)
+            self._count(updated=1)
+            return
+
+        with self._lock:
+            self._pending[key] = [len(to_add), split_docs, len(to_add)]
+        for d in to_add:
+            self._to_embed.put((key, d))    # blocks when the embed stage is behind
+
+    def run(self, jobs):
+        """
+        jobs: dicts with file_path, file_name, role, file_hash, previous_ids.
+        Returns totals; per-file ids of successfully split files in "chunk_ids".
+        """
+        self._started = self._last_report = time.perf_counter()
+        chunk_ids = set()
+
+        embedder = threading.Thread(target=self._embed_stage, name="ingest-embed")
+        upserter = threading.Thread(target=self._upsert_stage, name="ingest-upsert")
+        embedder.start()
+        upserter.start()
+
+        try:
+            jobs = list(jobs)
+            workers = min(self.workers, len(jobs)) or 1
+            with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+                jobs = iter(jobs)
+                in_flight = {}
+
+                # keep at most 2x workers files loaded but not yet handed on
+                while True:
+                    while len(in_flight) < workers * 2:
+                        job = next(jobs, None)
+                        if job is None:
+                            break
+                        in_flight[pool.submit(_load_and_split, job)] = (job, time.perf_counter())
+                    if not in_flight:
+                        break
+
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job, submitted = in_flight.pop(future)
+                        self.stats["load"].add(1, time.perf_counter() - submitted)
+                        try:
+                            split_docs = future.result()
+                        except Exception as e:
+                            print(f"❌ Failed to load {job['file_path']}: {e}")
+                            self._count(failed=1)
+                            chunk_ids |= set(job["previous_ids"])
+                            continue
+                        chunk_ids |= {d.metadata["chunk_id"] for d in split_docs}
+                        self._handle_split(job, split_docs)
+                    self._report()
+        finally:
+            self._to_embed.put(_DONE)
+            embedder.join()
+            upserter.join()
+
+        self._report(force=True)
+        with self._lock:
+            return {**self.totals, "chunk_ids": chunk_ids}
@@ -0,0 +1,171 @@
+"""
+Optional cross-encoder re-ranking of retrieved chunks (RERANK=1).
+
+Retrieval over-fetches RERANK_CANDIDATES chunks; a small cross-encoder scores
+every (query, chunk) pair in one batched CPU pass and the best RERANK_TOP_K
+go to the prompt. A sharper top-k means fewer chunks sent to Ollama, so
+shorter prefill.
+
+- scores are cached per (query hash, chunk_id) in an LRU, so repeated and
+  coalesced questions only score chunks they haven't seen
+- the stage has a latency budget (RERANK_BUDGET_MS): the per-pair cost is
+  tracked as a moving average, and when scoring the uncached pairs is
+  predicted to blow the budget (or the model isn't loaded yet) re-ranking is
+  skipped and the plain retrieval top-k is used
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from answer_cache import normalize_query
+
+# ----------------------------
+# Config (override via env)
+# ----------------------------
+RERANK = os.getenv("RERANK", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "12"))     # chunks retrieved for scoring
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "3"))                # chunks kept for the prompt
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "50000"))  # (query, chunk) scores
+RERANK_MAX_CHARS = 2000              # chunk text passed to the model (it truncates at 512 tokens anyway)
+
+_COST_SMOOTHING = 0.2                # weight of the latest batch in the per-pair cost average
+_PROBE_EVERY = 50                    # re-measure the cost after this many budget skips in a row
+
+
+class CrossEncoderReranker:
+    def __init__(
+        self,
+        model_name: str = RERANK_MODEL,
+        budget_ms: float = RERANK_BUDGET_MS,
+        batch_size: int = RERANK_BATCH_SIZE,
+        cache_size: int = RERANK_CACHE_SIZE,
+    ):
+        self.model_name = model_name
+        self.budget = budget_ms / 1000.0
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pair_seconds = None            # moving average, unknown until the model is loaded
+        self._skips_in_row = 0
+        self._stats = {"reranked": 0, "skipped_budget": 0, "skipped_loading": 0,
+                       "pairs_scored": 0, "cache_hits": 0}
+
+    # ----------------------------
+    # Model
+    # ----------------------------
+    def _load(self):
+        with self._load_lock:
+            if self._model is None:
+                # imported here so the API doesn't pay for it unless RERANK is on
+                from sentence_transformers import CrossEncoder
+                model = CrossEncoder(self.model_name)
+                # a candidate-sized batch of chunk-length pairs gives the first per-pair cost estimate
+                pairs = [("warm-up query", "warm-up " * 100)] * RERANK_CANDIDATES
+                start = time.perf_counter()
+                model.predict(pairs, batch_size=self.batch_size)
+                self._pair_seconds = (time.perf_counter() - start) / len(pairs)
+                self._model = model
+
+    def warm_up(self):
+        """Load the model in a background thread."""
+        def _run():
+            try:
+                self._load()
+            except Exception as e:
+                print(f"❌ Re-ranking model failed to load: {e}")
+
+        threading.Thread(target=_run, name="rerank-warmup", daemon=True).start()
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    # ----------------------------
+    # Scoring
+    # ----------------------------
+    @staticmethod
+    def query_hash(query: str) -> str:
+        return hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()
+
+    def _score(self, query: str, docs) -> List[float]:
+        key = self.query_hash(query)
+        scores: Dict[int, float] = {}
+        pending = []
+        with self._lock:
+            for i, d in enumerate(docs):
+                cache_key = (key, d.metadata.get("chunk_id") or d.page_content)
+                score = self._cache.get(cache_key)
+                if score is None:
+                    pending.append((i, cache_key))
+                else:
+                    self._cache.move_to_end(cache_key)
+                    scores[i] = score
+            self._stats["cache_hits"] += len(scores)
+
+        if pending:
+            pairs = [(query, docs[i].page_content[:RERANK_MAX_CHARS]) for i, _ in pending]
+            start = time.perf_counter()
+            predicted = self._model.predict(pairs, batch_size=self.batch_size)
+            per_pair = (time.perf_counter() - start) / len(pairs)
+
+            with self._lock:
+                self._pair_seconds = (1 - _COST_SMOOTHING) * self._pair_seconds + _COST_SMOOTHING * per_pair
+                self._stats["pairs_scored"] += len(pairs)
+                for (i, cache_key), score in zip(pending, predicted):
+                    scores[i] = float(score)
+                    self._cache[cache_key] = float(score)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return [scores[i] for i in range(len(docs))]
+
+    def _uncached(self, query: str, docs) -> int:
+        key = self.query_hash(query)
+        with self._lock:
+            return sum((key, d.metadata.get("chunk_id") or d.page_content) not in self._cache for d in docs)
+
+    def rerank(self, query: str, docs, k: int = RERANK_TOP_K, fallback_k: int = None):
+        """
+        The `k` best of `docs` by cross-encoder score, or, when re-ranking
+        is skipped (model loading / over budget), the first `fallback_k`
+        (default k) in retrieval order.
+        """
+        fallback_k = fallback_k or k
+        if len(docs) <= 1:
+            return docs[:k]
+        if self._model is None:
+            self._stats["skipped_loading"] += 1
+            return docs[:fallback_k]
+        if self._uncached(query, docs) * self._pair_seconds > self.budget:
+            self._skips_in_row += 1
+            # an occasional probe keeps one slow batch from disabling the stage for good
+            if self._skips_in_row < _PROBE_EVERY:
+                self._stats["skipped_budget"] += 1
+                return docs[:fallback_k]
+        self._skips_in_row = 0
+
+        scores = self._score(query, docs)
+        self._stats["reranked"] += 1
+        ranked = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+        return [docs[i] for i in ranked[:k]]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "model": self.model_name,
+                "ready": self.ready,
+                "cached_scores": len(self._cache),
+                "pair_ms": round(self._pair_seconds * 1000, 3) if self._pair_seconds is not None else None,
+            }
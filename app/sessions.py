@@ -0,0 +1,199 @@
+"""
+Server-side conversation memory for multi-turn chat.
+
+Clients send a session_id with each /chat request instead of their whole
+history. Each session keeps:
+
+- the last SESSION_WINDOW_TURNS question/answer pairs verbatim
+- a rolling summary of older turns: one line per turn (the question and the
+  first sentence of its answer), oldest lines dropped once it exceeds
+  SESSION_SUMMARY_TOKENS
+
+Sessions are an LRU capped at SESSION_MAX and expire after
+SESSION_TTL_SECONDS idle, so memory stays bounded however many users chat.
+
+Follow-up questions ("what about Q4?", "who approves it?") are rewritten
+before retrieval by appending the key terms of the previous question, so the
+embedding and BM25 search see what the follow-up refers to; the conversation
+itself only goes into the prompt for follow-ups.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from context import count_tokens
+
+# ----------------------------
+# Config (override via env)
+# ----------------------------
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+SESSION_WINDOW_TURNS = int(os.getenv("SESSION_WINDOW_TURNS", "3"))
+SESSION_SUMMARY_TOKENS = int(os.getenv("SESSION_SUMMARY_TOKENS", "200"))
+ANSWER_PREVIEW_CHARS = 300           # answer text kept per turn in the window
+MAX_CARRIED_TERMS = 8                # terms a rewrite carries over from the previous query
+
+_FOLLOW_UP_RE = re.compile(
+    r"^(and|also|what about|how about|and what|same for|then)\b"
+    r"|\b(it|its|they|them|their|this|that|these|those|he|she|his|her|there|above|previous|same)\b"
+)
+# a short fragment that opens with a preposition ("in Q4?", "for marketing?") continues
+# the previous question; other short questions ("What is EBITDA?") stand on their own
+_FRAGMENT_RE = re.compile(r"^(in|for|during|on|at|by|from|per|with|without|versus|vs)\b")
+_FOLLOW_UP_MAX_WORDS = 4
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "in", "on", "for", "to", "is", "are", "was", "were", "be",
+    "what", "which", "who", "whom", "how", "why", "when", "where", "do", "does", "did", "can", "could",
+    "me", "my", "our", "we", "you", "your", "i", "it", "its", "this", "that", "these", "those",
+    "about", "tell", "give", "show", "list", "please", "with", "by", "from", "at", "as", "any", "all",
+}
+
+
+def _first_sentence(text: str) -> str:
+    match = re.match(r"(.+?[.!?])(\s|$)", text.strip(), re.S)
+    sentence = match.group(1) if match else text.strip()
+    return " ".join(sentence.split())[:200]
+
+
+def _key_terms(question: str) -> List[str]:
+    words = re.findall(r"[A-Za-z0-9][\w\-]*", question)
+    return [w for w in words if w.lower() not in _STOPWORDS]
+
+
+def is_follow_up(message: str) -> bool:
+    lowered = message.strip().lower()
+    if _FOLLOW_UP_RE.search(lowered):
+        return True
+    return len(lowered.split()) <= _FOLLOW_UP_MAX_WORDS and bool(_FRAGMENT_RE.search(lowered))
+
+
+class Session:
+    def __init__(self, session_id: str, username: str):
+        self.id = session_id
+        self.username = username
+        self.turns: List[Tuple[str, str]] = []      # (question, answer) window
+        self.summary: List[str] = []                 # one line per older turn
+        self.last_query = ""                         # what the previous turn retrieved with
+        self.expires_at = 0.0
+
+    def add_turn(self, question: str, answer: str, query: str, window: int, summary_tokens: int):
+        self.turns.append((question, answer[:ANSWER_PREVIEW_CHARS]))
+        self.last_query = query
+        while len(self.turns) > window:
+            old_q, old_a = self.turns.pop(0)
+            self.summary.append(f"- Asked: {old_q} → {_first_sentence(old_a)}")
+        while self.summary and count_tokens("\n".join(self.summary)) > summary_tokens:
+            self.summary.pop(0)
+
+    def rewrite(self, message: str) -> Optional[str]:
+        """Standalone retrieval query for a follow-up, or None if `message` stands on its own."""
+        if not self.turns or not is_follow_up(message):
+            return None
+        # the previous query was itself rewritten for a follow-up, so chains keep their subject
+        own = {w.lower() for w in _key_terms(message)}
+        carried = []
+        for w in _key_terms(self.last_query):
+            if w.lower() not in own and w not in carried:
+                carried.append(w)
+        carried = carried[:MAX_CARRIED_TERMS]
+        if not carried:
+            return None
+        return f"{message.strip()} ({' '.join(carried)})"
+
+    def history(self) -> str:
+        """Summary + recent turns, for the prompt."""
+        lines = []
+        if self.summary:
+            lines.append("Earlier in the conversation:")
+            lines.extend(self.summary)
+        for question, answer in self.turns:
+            lines.append(f"User: {question}")
+            lines.append(f"Assistant: {answer}")
+        return "\n".join(lines)
+
+    def to_dict(self) -> Dict:
+        return {
+            "session_id": self.id,
+            "username": self.username,
+            "turns": [{"question": q, "answer": a} for q, a in self.turns],
+            "summary": self.summary,
+            "tokens": count_tokens(self.history()),
+        }
+
+
+class SessionStore:
+    def __init__(
+        self,
+        max_sessions: int = SESSION_MAX,
+        ttl_seconds: float = SESSION_TTL_SECONDS,
+        window_turns: int = SESSION_WINDOW_TURNS,
+        summary_tokens: int = SESSION_SUMMARY_TOKENS,
+    ):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.window_turns = window_turns
+        self.summary_tokens = summary_tokens
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"created": 0, "evictions": 0, "expired": 0, "rewrites": 0}
+
+    def _purge_expired(self, now: float):
+        # access order == expiry order (TTL is refreshed on use), so expired sessions sit at the front
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.expires_at > now:
+                break
+            self._sessions.popitem(last=False)
+            self._stats["expired"] += 1
+
+    def get(self, session_id: str, username: str) -> Session:
+        """
+        The user's session, created if new or expired. Raises PermissionError
+        for another user's session id rather than leaking its history.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._purge_expired(now)
+            session = self._sessions.get(session_id)
+            if session is not None and session.username != username:
+                raise PermissionError(session_id)
+            if session is None:
+                session = Session(session_id, username)
+                self._sessions[session_id] = session
+                self._stats["created"] += 1
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self._stats["evictions"] += 1
+            self._sessions.move_to_end(session_id)
+            session.expires_at = now + self.ttl_seconds
+            return session
+
+    def rewrite(self, session: Session, message: str) -> Optional[str]:
+        query = session.rewrite(message)
+        if query is not None:
+            self._stats["rewrites"] += 1
+        return query
+
+    def add_turn(self, session: Session, question: str, answer: str, query: str):
+        with self._lock:
+            session.add_turn(question, answer, query, self.window_turns, self.summary_tokens)
+
+    def delete(self, session_id: str, username: str) -> bool:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.username != username:
+                return False
+            del self._sessions[session_id]
+            return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "sessions": len(self._sessions),
+                "history_chars": sum(len(s.history()) for s in self._sessions.values()),
+            }
@@ -0,0 +1,99 @@
+"""
+Single-flight coalescing of identical in-flight chat questions.
+
+When many users of one role ask the same question at once (say, right after a
+policy announcement) only the first request runs retrieval + generation; the
+others join its flight and get the same answer. The work runs in its own task
+so a streaming leader that disconnects doesn't cut off the followers, and its
+tokens are buffered so a follower that joins mid-answer replays what it missed
+before following live. Once the flight lands it is dropped; later repeats are
+served by the answer cache.
+"""
+
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class Flight:
+    def __init__(self):
+        self.tokens: List[str] = []
+        self.followers = 0
+        self._result: Optional[Dict] = None
+        self._error: Optional[BaseException] = None
+        self._done = False
+        self._changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, token: str):
+        self.tokens.append(token)
+        self._notify()
+
+    def finish(self, result: Optional[Dict] = None, error: Optional[BaseException] = None):
+        self._result = result
+        self._error = error
+        self._done = True
+        self._notify()
+
+    async def follow(self) -> AsyncIterator[str]:
+        """Every token of the answer, from the start, as it is generated."""
+        seen = 0
+        while True:
+            changed = self._changed
+            while seen < len(self.tokens):
+                yield self.tokens[seen]
+                seen += 1
+            if self._done:
+                return
+            await changed.wait()
+
+    async def wait(self) -> Dict:
+        """The flight's result; re-raises its error."""
+        while not self._done:
+            await self._changed.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[Hashable, Flight] = {}
+        self._stats = {"flights": 0, "coalesced": 0}
+
+    def join(self, key: Hashable, work: Callable[[Flight], Awaitable[Dict]]) -> Tuple[Flight, bool]:
+        """
+        Join the flight for `key`, starting `work(flight)` if there is none.
+        Returns (flight, leader) where leader is True for the request that started it.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.followers += 1
+            self._stats["coalesced"] += 1
+            return flight, False
+
+        flight = Flight()
+        self._flights[key] = flight
+        self._stats["flights"] += 1
+
+        async def run():
+            try:
+                flight.finish(result=await work(flight))
+            except Exception as e:
+                flight.finish(error=e)
+            except BaseException as e:
+                # cancelled (e.g. at shutdown): release the followers, then stop
+                flight.finish(error=e)
+                raise
+            finally:
+                self._flights.pop(key, None)
+
+        # held on the flight (and so by _flights) until it lands
+        flight.task = asyncio.create_task(run())
+        return flight, True
+
+    def stats(self) -> Dict:
+        return {**self._stats, "in_flight": len(self._flights)}
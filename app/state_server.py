@@ -0,0 +1,219 @@
+"""
+State server for multi-worker deployments.
+
+DuckDB allows one read-write process per database file, and Chroma keeps
+each collection's HNSW graph in the memory of the process that writes it, so
+`uvicorn main:app --workers N` can't have every worker open finsolve.db and
+write the vector index. In multi-worker mode this one process owns both:
+
+- finsolve.db: workers' db.get_conn() statements (POST /sql, a BEGIN..COMMIT
+  block arrives as one request and runs as one transaction) and their batched
+  audit rows (POST /audit) run here, through the same AuditWriter
+- uploads: /upload-docs on a worker forwards the file here (POST /ingest), so
+  Chroma, the BM25 index and the embedding cache have a single writer; workers
+  search read-only handles
+- users, roles, tabular sources and the vector index have change counters
+  (state_versions) that workers poll to reload what changed
+
+    STATE_TOKEN=... uvicorn state_server:app --host 127.0.0.1 --port 8100
+    STATE_TOKEN=... STATE_URL=http://127.0.0.1:8100 uvicorn main:app --workers 8
+
+/sql runs whatever it is sent, so every endpoint requires the shared
+STATE_TOKEN bearer token and the server refuses to start without one; keep
+it on a private interface as well.
+
+embed_doc.py can run while the server is up: run it with the same STATE_URL
+and STATE_TOKEN so its DuckDB statements go through this process. It writes
+Chroma and the BM25 index itself, and this process reloads them before its
+next upload.
+"""
+
+import os
+
+# this process is the owner: never forward its own statements to a state server
+os.environ.pop("STATE_URL", None)
+
+import hmac
+import json
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import duckdb
+from fastapi import Depends, FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+from db import STATE_TOKEN
+
+if not STATE_TOKEN:
+    raise SystemExit("STATE_TOKEN must be set: the state server runs SQL sent by its clients")
+
+from analytics import ChatAnalytics, init_rollups
+from auth import UserStore
+from db import init_db, get_conn, get_writer, close_writer, load_versions
+from embedding_cache import CachedEmbeddings, EmbeddingCache, EMBED_CACHE
+from embeddings import LazyEmbeddings
+from ingest import ingest_upload, is_supported
+from jobs import JobManager, IngestJob
+from lexical_index import LexicalIndex
+from vector_store import ShardedChroma, CHROMA_DIR, index_write_lock
+
+# -----------------------------
+# Init DB + writable vector store
+# -----------------------------
+init_db()
+init_rollups()
+# seeds the default users on first start, before any worker reads the table
+UserStore().load()
+
+chat_analytics = ChatAnalytics()
+
+embedding_function = LazyEmbeddings()
+embedding_cache = EmbeddingCache() if EMBED_CACHE else None
+document_embeddings = (
+    CachedEmbeddings(embedding_function, embedding_cache) if embedding_cache is not None else embedding_function
+)
+vectordb = ShardedChroma(CHROMA_DIR, embedding_function=document_embeddings)
+lexical_index = LexicalIndex.load()
+lexical_lock = threading.Lock()       # one upload at a time writes the BM25 pickle
+index_versions = load_versions()
+
+job_manager = JobManager()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    embedding_function.warm_up()
+    yield
+    job_manager.shutdown()
+    close_writer()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def check_token(request: Request):
+    supplied = request.headers.get("authorization", "")
+    if not hmac.compare_digest(supplied.encode(), f"Bearer {STATE_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid state server token")
+
+
+@app.exception_handler(duckdb.Error)
+async def duckdb_error(request: Request, exc: duckdb.Error):
+    # the worker re-raises the same DuckDB exception type (see db.state_request)
+    return JSONResponse({"error": type(exc).__name__, "detail": str(exc)}, status_code=409)
+
+
+@app.get("/health", dependencies=[Depends(check_token)])
+def health():
+    return {"status": "ok", "embedding_model": embedding_function.status()["status"]}
+
+
+# -----------------------------
+# SQL
+# -----------------------------
+class Statement(BaseModel):
+    sql: str
+    params: Optional[List[Any]] = None
+
+
+class SqlRequest(BaseModel):
+    statements: List[Statement]
+    transaction: bool = False
+
+
+def run_statements(statements: List[Statement], transaction: bool) -> List[tuple]:
+    con = get_conn()
+    try:
+        if transaction:
+            con.execute("BEGIN TRANSACTION")
+        rows = []
+        for statement in statements:
+            rows = con.execute(statement.sql, statement.params or []).fetchall()
+        if transaction:
+            con.execute("COMMIT")
+        return rows
+    except Exception:
+        if transaction:
+            con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+
+
+@app.post("/sql", dependencies=[Depends(check_token)])
+def sql(req: SqlRequest):
+    rows = run_statements(req.statements, req.transaction)
+    # dates, decimals etc. as strings
+    return Response(json.dumps({"rows": rows}, default=str), media_type="application/json")
+
+
+# -----------------------------
+# Audit rows (workers' batched AuditWriter flushes)
+# -----------------------------
+class AuditBatch(BaseModel):
+    chats: List[Dict[str, Any]] = []
+    doc_chunks: List[Dict[str, Any]] = []
+
+
+class ChunkIds(BaseModel):
+    chunk_ids: List[str]
+
+
+@app.post("/audit", dependencies=[Depends(check_token)])
+def audit(batch: AuditBatch):
+    chats = [{**row, "created_at": datetime.fromisoformat(row["created_at"])} for row in batch.chats]
+    get_writer().write(chats, batch.doc_chunks)
+    return {"chats": len(chats), "doc_chunks": len(batch.doc_chunks)}
+
+
+@app.post("/audit/delete-doc-chunks", dependencies=[Depends(check_token)])
+def audit_delete(req: ChunkIds):
+    get_writer().delete_doc_chunks(req.chunk_ids)
+    return {"deleted": len(req.chunk_ids)}
+
+
+@app.post("/analytics/refresh", dependencies=[Depends(check_token)])
+def analytics_refresh():
+    return {"rows": chat_analytics.refresh()}
+
+
+# -----------------------------
+# Uploads (forwarded by workers' /upload-docs)
+# -----------------------------
+def index_changed(versions: Dict[str, int]) -> bool:
+    return any(v != index_versions.get(k) for k, v in versions.items() if k.startswith("index:"))
+
+
+def run_ingest_job(job: IngestJob, temp_path: str) -> Dict:
+    global lexical_index, index_versions
+    # embed_doc.py writes the index from its own process: wait for it to finish,
+    # then reload before writing on top of it
+    with lexical_lock, index_write_lock(CHROMA_DIR):
+        if index_changed(load_versions()):
+            vectordb.reopen()
+            lexical_index = LexicalIndex.load()
+        result = ingest_upload(vectordb, lexical_index, temp_path, job.file_name, job.role, job.timings)
+        index_versions = load_versions()
+        return result
+
+
+@app.post("/ingest", status_code=202, dependencies=[Depends(check_token)])
+def ingest(role: str = Form(...), username: str = Form(...), file: UploadFile = File(...)):
+    filename = os.path.basename(file.filename or "")
+    if not is_supported(filename):
+        raise HTTPException(status_code=400, detail="Unsupported file type")
+
+    temp_path = job_manager.save_upload(file.file, filename)
+    job = job_manager.submit(IngestJob(role.lower(), filename, username), temp_path, run_ingest_job)
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}", dependencies=[Depends(check_token)])
+def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
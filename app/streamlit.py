@@ -1,5 +1,10 @@
 
+import json
+import time
+import uuid
+
 import streamlit as st
+import pandas as pd
 import requests
 from requests.auth import HTTPBasicAuth
 
@@ -94,6 +99,20 @@ footer { visibility: hidden; }
 </style>
 """, unsafe_allow_html=True)
 
+# --- Background job polling (upload ingestion) ---
+def poll_job(job_id, auth, interval=1.0):
+    """Poll /jobs/{job_id} until the ingestion job finishes; returns the job status dict."""
+    with st.spinner("Indexing document…"):
+        while True:
+            resp = requests.get(f"{API_URL}/jobs/{job_id}", auth=auth)
+            if resp.status_code != 200:
+                return {"status": "failed", "error": f"{resp.status_code} — {resp.text}"}
+            job = resp.json()
+            if job.get("status") in ("done", "failed"):
+                return job
+            time.sleep(interval)
+
+
 # --- Header title banner ---
 st.markdown('<div class="app-header"><h1>FinSolve-AI Document Assistant</h1></div>', unsafe_allow_html=True)
 
@@ -107,6 +126,10 @@ if "roles" not in st.session_state:
 if "history" not in st.session_state:
     st.session_state.history = []
 
+# server-side conversation memory; a new id starts a fresh conversation
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
 # --- Sidebar: login or logged-in user info + logout ---
 with st.sidebar:
     if st.session_state.user is None:
@@ -138,7 +161,7 @@ with st.sidebar:
         st.write(f"**User:** {st.session_state.user.get('username')}")
         st.write(f"**Role:** {st.session_state.user.get('role')}")
         if st.button("Logout"):
-            for key in ("auth", "user", "roles", "history"):
+            for key in ("auth", "user", "roles", "history", "session_id"):
                 if key in st.session_state:
                     del st.session_state[key]
             st.rerun()
@@ -190,23 +213,35 @@ with tabs[0]:
         with st.chat_message("user"):
             st.markdown(prompt)
 
-        with st.spinner("Fetching answer..."):
+        # Stream tokens into the assistant bubble as Ollama emits them
+        with st.chat_message("assistant"):
+            placeholder = st.empty()
+            answer = ""
             try:
-                resp = requests.post(
-                    f"{API_URL}/chat",
-                    json={"user": user, "message": prompt},
-                    auth=HTTPBasicAuth(*st.session_state.auth)
-                )
-                if resp.status_code == 200:
-                    answer = resp.json().get("response", "")
-                else:
-                    answer = f"⚠️ Server error: {resp.status_code}"
+                with requests.post(
+                    f"{API_URL}/chat/stream",
+                    json={"user": user, "session_id": st.session_state.session_id, "message": prompt},
+                    auth=HTTPBasicAuth(*st.session_state.auth),
+                    stream=True,
+                ) as resp:
+                    if resp.status_code == 200:
+                        for line in resp.iter_lines():
+                            if not line:
+                                continue
+                            event = json.loads(line)
+                            if event.get("type") == "token":
+                                answer += event.get("content", "")
+                                placeholder.markdown(answer + "▌")
+                            elif event.get("type") == "error":
+                                answer = f"⚠️ {event.get('detail', 'Server error')}"
+                                break
+                    else:
+                        answer = f"⚠️ Server error: {resp.status_code}"
             except Exception as e:
                 answer = f"🚫 Connection error: {e}"
+            placeholder.markdown(answer)
 
         st.session_state.history.append(("assistant", answer))
-        with st.chat_message("assistant"):
-            st.markdown(answer)
 
 ### --- Upload Docs Tab (only for admin) ---
 if "c-levelexecutives" in role and len(tabs) >= 2:
@@ -225,8 +260,18 @@ if "c-levelexecutives" in role and len(tabs) >= 2:
                         data=data,
                         auth=HTTPBasicAuth(*st.session_state.auth)
                     )
-                    if res.status_code == 200 or res.ok:
-                        st.success(res.json().get("message", "Upload successful."))
+                    if res.status_code in (200, 202) or res.ok:
+                        job_id = res.json().get("job_id")
+                        st.info(res.json().get("message", "Upload queued."))
+                        job = poll_job(job_id, HTTPBasicAuth(*st.session_state.auth))
+                        if job.get("status") == "done":
+                            st.success(
+                                f"Indexed {job.get('chunks', 0)} chunks "
+                                f"({job.get('embedded', 0)} embedded, {job.get('removed', 0)} removed) "
+                                f"in {job.get('timings', {}).get('total', 0):.1f}s."
+                            )
+                        else:
+                            st.error(f"Ingestion failed: {job.get('error', 'unknown error')}")
                     else:
                         st.error(f"Upload failed: {res.status_code} — {res.text}")
                 except Exception as e:
@@ -284,3 +329,39 @@ if "c-levelexecutives" in role and len(tabs) >= 3:
                 st.error("Connection error: " + str(e))
 
 
+
+        st.markdown("---")
+
+        st.markdown("#### 📊 Chat Analytics")
+        days = st.selectbox("Period (days)", [1, 7, 30, 90], index=2, key="analytics_days")
+        try:
+            auth = HTTPBasicAuth(*st.session_state.auth)
+            params = {"days": days}
+            volume = requests.get(f"{API_URL}/analytics/volume", params=params, auth=auth).json()["volume"]
+            latency = requests.get(f"{API_URL}/analytics/latency", params=params, auth=auth).json()
+            top = requests.get(f"{API_URL}/analytics/top-queries", params=params, auth=auth).json()["top_queries"]
+            chunks = requests.get(f"{API_URL}/analytics/chunks", params=params, auth=auth).json()["chunks"]
+
+            cols = st.columns(4)
+            cols[0].metric("Queries", latency["requests"])
+            cols[1].metric("p50 latency", f"{latency['p50_ms'] or 0:.0f} ms")
+            cols[2].metric("p95 latency", f"{latency['p95_ms'] or 0:.0f} ms")
+            cols[3].metric("p99 latency", f"{latency['p99_ms'] or 0:.0f} ms")
+
+            st.markdown("##### Daily volume")
+            if volume:
+                # one bar per day, stacked by role
+                st.bar_chart(pd.DataFrame({v["day"]: v["by_role"] for v in volume}).T.fillna(0))
+            else:
+                st.caption("No chats logged in this period.")
+
+            st.markdown("##### Top queries per role")
+            for r, queries in top.items():
+                with st.expander(f"{r} ({sum(q['hits'] for q in queries)} hits)"):
+                    st.table(queries)
+
+            st.markdown("##### Most retrieved chunks")
+            if chunks:
+                st.table(chunks)
+        except Exception as e:
+            st.error("Could not load analytics: " + str(e))
@@ -0,0 +1,327 @@
+"""
+Structured query engine for tabular sources (CSV files such as hr_data.csv).
+
+Row-per-chunk RAG can't answer "average attendance_pct in Finance" or "who
+reports to FINEMP1006" - it retrieves a few random rows and the LLM guesses.
+Tabular files are therefore also loaded into DuckDB tables (registered in
+`tabular_sources` with their role), and /chat first asks TableRouter whether
+the question is an aggregate or lookup it can answer with SQL. Anything it
+doesn't recognise falls through to the normal RAG path.
+"""
+
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+from db import get_conn, bump_version, ORIGIN_CORPUS
+
+MAX_ROWS_SHOWN = 50
+CATEGORICAL_MAX_DISTINCT = 50   # text columns with fewer values can be used as filters
+
+_NUMERIC_TYPES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "FLOAT", "DOUBLE", "DECIMAL")
+
+_AGGREGATES = [
+    ("count", re.compile(r"\b(how many|number of|count)\b")),
+    ("avg", re.compile(r"\b(average|avg|mean)\b")),
+    ("sum", re.compile(r"\b(total|sum)\b")),
+    ("max", re.compile(r"\b(max|maximum|highest|most)\b")),
+    ("min", re.compile(r"\b(min|minimum|lowest|least)\b")),
+]
+_AGG_WORDS = {"how", "many", "number", "count", "average", "avg", "mean", "total", "sum",
+              "max", "maximum", "highest", "most", "min", "minimum", "lowest", "least"}
+_AGG_LABELS = {"count": "Count", "avg": "Average", "sum": "Total", "max": "Highest", "min": "Lowest"}
+
+_GROUP_RE = re.compile(r"\b(?:per|by|for each|each|across)\s+([a-z_]+)")
+_REPORTS_TO_RE = re.compile(r"\b(reports? to|reporting to|managed by|direct reports|team of|under)\b")
+_ID_TOKEN_RE = re.compile(r"\b(?=[A-Za-z0-9]*\d)(?=[A-Za-z0-9]*[A-Za-z])[A-Za-z0-9]{4,}\b")
+
+# nouns that mean "rows of this table" in count questions
+_ROW_NOUNS_RE = re.compile(r"\b(employees?|people|staff|headcount|records?|rows?)\b")
+
+# words too generic to identify a column on their own
+_WEAK_WORDS = {"id", "pct", "date", "name", "full", "last", "of", "taken"}
+
+# questions about what is allowed / required are policy questions for RAG,
+# even when they mention a column ("maximum leave balance allowed by policy")
+_POLICY_RE = re.compile(
+    r"\b(polic(y|ies)|allowed|permitted|required|requirement|eligible|eligibility|entitled|"
+    r"can|could|should|must|may|carry forward|rules?|guidelines?)\b"
+)
+
+# words that carry no meaning for routing
+_FILLER_WORDS = {
+    "what", "whats", "which", "who", "whose", "is", "are", "was", "were", "the", "a", "an", "of",
+    "in", "on", "at", "for", "from", "to", "with", "and", "or", "do", "does", "did", "has", "have",
+    "there", "me", "show", "give", "list", "tell", "find", "get", "all", "our", "their", "its",
+    "it", "be", "value", "values", "overall", "current", "currently", "across", "per", "by",
+    "each", "please", "whole", "company",
+}
+
+# share of a question's content words that must name this table's columns,
+# values or rows before an aggregate is answered with SQL
+ROUTE_MIN_COVERAGE = 0.75
+
+
+def table_name_for(role: str, file_name: str) -> str:
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    return re.sub(r"[^a-z0-9]+", "_", f"{role}_{stem}".lower()).strip("_")
+
+
+def load_table(file_path: str, file_name: str, role: str, file_hash: str, origin: str = ORIGIN_CORPUS) -> str:
+    """(Re)load a CSV into its own DuckDB table and register it."""
+    table = table_name_for(role, file_name)
+    con = get_conn()
+    con.execute(f'CREATE OR REPLACE TABLE "{table}" AS SELECT * FROM read_csv_auto(?, header = true)', [file_path])
+    row_count = con.execute(f'SELECT count(*) FROM "{table}"').fetchone()[0]
+    con.execute("""
+        INSERT OR REPLACE INTO tabular_sources (table_name, file_name, role, file_hash, row_count, origin)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (table, file_name, role, file_hash, row_count, origin))
+    con.close()
+    bump_version("tables")
+    return table
+
+
+def drop_table(table: str):
+    con = get_conn()
+    con.execute(f'DROP TABLE IF EXISTS "{table}"')
+    con.execute("DELETE FROM tabular_sources WHERE table_name = ?", [table])
+    con.close()
+    bump_version("tables")
+
+
+def get_tabular_sources() -> Dict[str, Dict]:
+    """table_name -> {file_name, role, file_hash, row_count, origin}"""
+    con = get_conn()
+    rows = con.execute(
+        "SELECT table_name, file_name, role, file_hash, row_count, coalesce(origin, ?) FROM tabular_sources",
+        [ORIGIN_CORPUS],
+    ).fetchall()
+    con.close()
+    return {
+        t: {"file_name": f, "role": r, "file_hash": h, "row_count": n, "origin": o}
+        for t, f, r, h, n, o in rows
+    }
+
+
+def _markdown_table(columns: List[str], rows) -> str:
+    lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    for row in rows[:MAX_ROWS_SHOWN]:
+        lines.append("| " + " | ".join("" if v is None else str(v) for v in row) + " |")
+    if len(rows) > MAX_ROWS_SHOWN:
+        lines.append(f"\n_{len(rows) - MAX_ROWS_SHOWN} more rows not shown._")
+    return "\n".join(lines)
+
+
+class _TableInfo:
+    def __init__(self, name: str, file_name: str, role: str, con):
+        self.name = name
+        self.file_name = file_name
+        self.role = role
+
+        schema = con.execute(f'DESCRIBE "{name}"').fetchall()
+        self.columns = [c[0] for c in schema]
+        self.numeric = [c[0] for c in schema if c[1].upper().startswith(_NUMERIC_TYPES)]
+        self.id_columns = [c for c in self.columns if c.lower().endswith("_id")]
+
+        # low-cardinality text columns -> their values (lowercased -> original)
+        self.categorical: Dict[str, Dict[str, str]] = {}
+        for column, col_type, *_ in schema:
+            if column in self.id_columns or not col_type.upper().startswith("VARCHAR"):
+                continue
+            values = con.execute(
+                f'SELECT DISTINCT "{column}" FROM "{name}" WHERE "{column}" IS NOT NULL LIMIT {CATEGORICAL_MAX_DISTINCT + 1}'
+            ).fetchall()
+            if len(values) <= CATEGORICAL_MAX_DISTINCT:
+                self.categorical[column] = {str(v[0]).lower(): v[0] for v in values}
+
+        # words that refer to this table: file name, column name parts, categorical values
+        self.vocabulary = set(re.findall(r"[a-z0-9]+", os.path.splitext(file_name)[0].lower()))
+        for column in self.columns:
+            self.vocabulary.update(w for w in column.lower().split("_") if w)
+        for values in self.categorical.values():
+            for lowered in values:
+                self.vocabulary.update(re.findall(r"[a-z0-9]+", lowered))
+
+    def column_score(self, column: str, question: str) -> int:
+        name = column.lower()
+        if name in question or name.replace("_", " ") in question:
+            return 2
+        words = [w for w in name.split("_") if w not in _WEAK_WORDS and len(w) > 2]
+        return 1 if any(re.search(rf"\b{re.escape(w)}", question) for w in words) else 0
+
+    def best_column(self, columns: List[str], question: str) -> Optional[str]:
+        scored = [(self.column_score(c, question), c) for c in columns]
+        scored = [s for s in scored if s[0] > 0]
+        return max(scored)[1] if scored else None
+
+    def mentioned(self, question: str) -> bool:
+        stem = os.path.splitext(self.file_name)[0].lower().replace("_", " ")
+        return stem in question
+
+    def coverage(self, question: str) -> float:
+        """Fraction of the question's content words that refer to this table."""
+        words = [w for w in re.findall(r"[a-z0-9]+", question) if w not in _FILLER_WORDS and w not in _AGG_WORDS]
+        if not words:
+            return 0.0
+
+        def known(word: str) -> bool:
+            # "leaves" -> leave_balance, "employees" -> employee_id
+            return (word in self.vocabulary or _ROW_NOUNS_RE.fullmatch(word) is not None
+                    or any(len(v) > 3 and word.startswith(v) for v in self.vocabulary))
+
+        return sum(map(known, words)) / len(words)
+
+    def filters(self, question: str) -> Dict[str, str]:
+        found = {}
+        for column, values in self.categorical.items():
+            for lowered, original in values.items():
+                if len(lowered) > 2 and re.search(rf"\b{re.escape(lowered)}\b", question):
+                    found[column] = original
+                    break
+        return found
+
+
+class TableRouter:
+    """Answers aggregate / lookup questions over tabular sources with SQL."""
+
+    def __init__(self):
+        self._tables: List[_TableInfo] = []
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """Reload table metadata (after embed_doc.py or a CSV upload)."""
+        con = get_conn()
+        tables = [
+            _TableInfo(name, info["file_name"], info["role"], con)
+            for name, info in get_tabular_sources().items()
+        ]
+        con.close()
+        with self._lock:
+            self._tables = tables
+
+    def _visible_tables(self, partition: str, all_roles: str) -> List[_TableInfo]:
+        with self._lock:
+            return [t for t in self._tables if partition == all_roles or t.role == partition]
+
+    def answer(self, partition: str, message: str, all_roles: str = "*") -> Optional[Dict]:
+        """
+        {"response", "sources", "sql"} if the question can be answered from a
+        table visible to `partition`, else None.
+        """
+        tables = self._visible_tables(partition, all_roles)
+        if not tables:
+            return None
+
+        # most chats are neither an id lookup nor an aggregate: rule them out
+        # before taking a DuckDB connection
+        question = message.lower()
+        lookup = _ID_TOKEN_RE.search(message) is not None and any(t.id_columns for t in tables)
+        aggregate = any(pattern.search(question) for _, pattern in _AGGREGATES) and not _POLICY_RE.search(question)
+        if not (lookup or aggregate):
+            return None
+
+        con = get_conn()
+        try:
+            for table in tables:
+                result = self._lookup(con, table, message) or self._aggregate(con, table, message)
+                if result is not None:
+                    result["sources"] = [table.file_name]
+                    return result
+        finally:
+            con.close()
+        return None
+
+    # ----------------------------
+    # "who is FINEMP1000", "who reports to FINEMP1006"
+    # ----------------------------
+    def _lookup(self, con, table: _TableInfo, message: str) -> Optional[Dict]:
+        if not table.id_columns:
+            return None
+        question = message.lower()
+
+        for token in _ID_TOKEN_RE.findall(message):
+            # which id columns hold this value?
+            matches = [
+                c for c in table.id_columns
+                if con.execute(f'SELECT 1 FROM "{table.name}" WHERE upper("{c}") = upper(?) LIMIT 1', [token]).fetchone()
+            ]
+            if not matches:
+                continue
+
+            primary = table.id_columns[0]
+            column = primary if primary in matches else matches[0]
+            if _REPORTS_TO_RE.search(question):
+                others = [c for c in matches if c != primary]
+                column = others[0] if others else column
+
+            sql = f'SELECT * FROM "{table.name}" WHERE upper("{column}") = upper(?) ORDER BY "{primary}"'
+            rows = con.execute(sql, [token]).fetchall()
+
+            if column == primary and len(rows) == 1:
+                details = "\n".join(f"- **{c}**: {v}" for c, v in zip(table.columns, rows[0]))
+                response = f"Record for **{token}** in `{table.file_name}`:\n\n{details}"
+            else:
+                response = f"{len(rows)} rows in `{table.file_name}` where `{column}` = **{token}**:\n\n"
+                response += _markdown_table(table.columns, rows)
+            return {"response": response, "sql": sql, "params": [token]}
+
+        return None
+
+    # ----------------------------
+    # "average attendance_pct in Finance", "how many employees per location"
+    # ----------------------------
+    def _aggregate(self, con, table: _TableInfo, message: str) -> Optional[Dict]:
+        question = message.lower()
+        func = next((name for name, pattern in _AGGREGATES if pattern.search(question)), None)
+        if func is None:
+            return None
+
+        column = table.best_column(table.numeric, question)
+        if func != "count" and column is None:
+            # "total employees in Sales" is a count, not a sum
+            if func != "sum":
+                return None
+            func = "count"
+
+        filters = table.filters(question)
+
+        group_by = None
+        match = _GROUP_RE.search(question)
+        if match:
+            group_by = table.best_column(list(table.categorical), match.group(1))
+            filters.pop(group_by, None)
+
+        # only answer when the question is clearly about this table: it names a
+        # column or a value in it, and nearly every other word is explained too
+        if _POLICY_RE.search(question):
+            return None
+        if func == "count" and not (filters or group_by or table.mentioned(question)):
+            return None
+        if table.coverage(question) < ROUTE_MIN_COVERAGE:
+            return None
+
+        expr = "count(*)" if func == "count" else f'round({func}("{column}"), 2)'
+        where = " AND ".join(f'"{c}" = ?' for c in filters)
+        params = list(filters.values())
+
+        select = (f'"{group_by}", ' if group_by else "") + f"{expr} AS value, count(*) AS n"
+        sql = f'SELECT {select} FROM "{table.name}"'
+        if where:
+            sql += f" WHERE {where}"
+        if group_by:
+            sql += f' GROUP BY "{group_by}" ORDER BY value DESC'
+
+        rows = con.execute(sql, params).fetchall()
+
+        label = _AGG_LABELS[func] + ("" if func == "count" else f" `{column}`")
+        scope = ", ".join(f"{c} = {v}" for c, v in filters.items()) or "all rows"
+        if group_by:
+            response = f"{label} by `{group_by}` ({scope}) from `{table.file_name}`:\n\n"
+            response += _markdown_table([group_by, "value", "rows"], rows)
+        else:
+            value, n = rows[0]
+            response = f"{label} ({scope}) from `{table.file_name}`: **{value}** (over {n} rows)."
+        return {"response": response, "sql": sql, "params": params}
@@ -0,0 +1,74 @@
+import os
+
+import duckdb
+import pytest
+
+import structured
+from structured import TableRouter
+
+HR_CSV = os.path.join(os.path.dirname(__file__), "..", "..", "resources", "data", "hr", "hr_data.csv")
+
+
+@pytest.fixture
+def router(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "test.db")
+    monkeypatch.setattr(structured, "get_conn", lambda: duckdb.connect(db_path))
+    monkeypatch.setattr(structured, "bump_version", lambda name: None)
+
+    con = duckdb.connect(db_path)
+    con.execute("""
+        CREATE TABLE tabular_sources (
+            table_name TEXT PRIMARY KEY, file_name TEXT, role TEXT, file_hash TEXT, row_count BIGINT,
+            origin TEXT
+        )
+    """)
+    con.close()
+    structured.load_table(HR_CSV, "hr_data.csv", "hr", "hash")
+    return TableRouter()
+
+
+@pytest.mark.parametrize("question", [
+    "How many leaves can an employee carry forward per year?",
+    "What is the maximum leave balance allowed by policy?",
+    "How many people attended the marketing events in Q2?",
+    "What is the minimum attendance required for a bonus?",
+    "What is the most important value of the company?",
+    "How many days of annual leave do employees get?",
+])
+def test_policy_questions_fall_through_to_rag(router, question):
+    assert router.answer("*", question) is None
+
+
+@pytest.mark.parametrize("question, sql", [
+    ("What is the average attendance_pct in Finance?", 'avg("attendance_pct")'),
+    ("Highest salary in Sales", 'max("salary")'),
+    ("How many employees per location?", 'GROUP BY "location"'),
+    ("Total employees in Marketing", "count(*)"),
+])
+def test_aggregates_answered_with_sql(router, question, sql):
+    result = router.answer("*", question)
+    assert result is not None
+    assert sql in result["sql"]
+    assert result["sources"] == ["hr_data.csv"]
+
+
+def test_lookup_by_id(router):
+    result = router.answer("hr", "Who reports to FINEMP1006?")
+    assert result is not None
+    assert '"manager_id"' in result["sql"]
+
+
+def test_tables_are_scoped_to_role(router):
+    assert router.answer("finance", "What is the average attendance_pct in Finance?") is None
+
+
+@pytest.mark.parametrize("question", [
+    "What was revenue in Q3?",
+    "How many leaves can an employee carry forward per year?",
+])
+def test_questions_without_cues_skip_duckdb(router, monkeypatch, question):
+    def fail():
+        raise AssertionError("opened a DuckDB connection")
+
+    monkeypatch.setattr(structured, "get_conn", fail)
+    assert router.answer("*", question) is None
@@ -0,0 +1,305 @@
+"""
+Per-role sharded Chroma vector store.
+
+Every role gets its own collection (`company_docs_<role>`) instead of one
+`company_docs` collection filtered by `role` metadata at query time, so a
+department user's search only walks that department's HNSW graph. Searches
+without a role (c-levelexecutives) fan out across all shards in parallel and
+merge the top-k by distance.
+
+ShardedChroma implements the subset of the langchain Chroma API the app uses
+(similarity_search_by_vector / add_documents / get / delete), routing on the
+`role` key of the filter or of each chunk's metadata, so it is a drop-in
+replacement for a single collection. migrate_shards.py (or embed_doc.py, on
+its next run) moves vectors from the old single collection into the shards.
+
+In multi-worker mode API workers open the store read_only (writes go through
+the state server) and reopen() it when another process changed the index:
+Chroma keeps each collection's HNSW graph in memory per process, so a handle
+doesn't see vectors another process added until it is reopened.
+
+embed_doc.py and the state server (or a single-process API handling an upload)
+both write the index. Each holds index_write_lock(), an flock on
+<persist_directory>/index.lock, while it writes Chroma and the BM25 pickle, so
+one process never writes on top of the other.
+"""
+
+import fcntl
+import os
+import re
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import chromadb
+from chromadb.api.client import SharedSystemClient
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+# ----------------------------
+# Config (override via env)
+# ----------------------------
+CHROMA_DIR = os.getenv("CHROMA_DIR", "chroma_db")
+LEGACY_COLLECTION = "company_docs"          # pre-sharding single collection
+SHARD_PREFIX = "company_docs_"
+SHARD_SEARCH_WORKERS = int(os.getenv("SHARD_SEARCH_WORKERS", "8"))
+MIGRATE_BATCH_SIZE = 1000
+
+
+def shard_name(role: str) -> str:
+    # Chroma names: 3-63 chars of [a-zA-Z0-9._-], starting and ending alphanumeric
+    return (SHARD_PREFIX + re.sub(r"[^a-z0-9_-]+", "_", role.lower()).strip("_-"))[:63]
+
+
+@contextmanager
+def index_write_lock(persist_directory: str = CHROMA_DIR):
+    """Cross-process lock for writing the index (Chroma + the BM25 pickle)."""
+    os.makedirs(persist_directory, exist_ok=True)
+    with open(os.path.join(persist_directory, "index.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _collection_name(collection) -> str:
+    # list_collections() returns names on newer chromadb, Collection objects on older
+    return collection if isinstance(collection, str) else collection.name
+
+
+class ShardedChroma:
+    def __init__(self, persist_directory: str = CHROMA_DIR, embedding_function=None,
+                 search_workers: int = SHARD_SEARCH_WORKERS, read_only: bool = False):
+        self.persist_directory = persist_directory
+        self.embedding_function = embedding_function
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, search_workers), thread_name_prefix="shard-search")
+        self.client, self._shards = self._connect()
+
+    def _connect(self):
+        client = chromadb.PersistentClient(path=self.persist_directory)
+        shards: Dict[str, Chroma] = {}
+        for name in map(_collection_name, client.list_collections()):
+            if name.startswith(SHARD_PREFIX):
+                role = (client.get_collection(name).metadata or {}).get("role")
+                if role:
+                    shards[role] = self._open(client, role)
+        return client, shards
+
+    def reopen(self):
+        """Drop the cached Chroma client and load the shards again from disk."""
+        # the client looks its system up in the cache, so grab it before clearing
+        old_system = self.client._system
+        SharedSystemClient.clear_system_cache()
+        client, shards = self._connect()
+        with self._lock:
+            self.client, self._shards = client, shards
+        # release the old system's sqlite connections and HNSW segments
+        old_system.stop()
+
+    # ----------------------------
+    # Shards
+    # ----------------------------
+    def _open(self, client, role: str) -> Chroma:
+        return Chroma(
+            client=client,
+            collection_name=shard_name(role),
+            embedding_function=self.embedding_function,
+            collection_metadata={"role": role},
+        )
+
+    def shard(self, role: str, create: bool = True) -> Optional[Chroma]:
+        with self._lock:
+            shard = self._shards.get(role)
+            if shard is None and create:
+                self._check_writable()
+                shard = self._shards[role] = self._open(self.client, role)
+            return shard
+
+    def _check_writable(self):
+        if self.read_only:
+            raise PermissionError("vector store is read-only in this process (writes go through the state server)")
+
+    def roles(self) -> List[str]:
+        with self._lock:
+            return sorted(self._shards)
+
+    def _all(self) -> List[Chroma]:
+        with self._lock:
+            return list(self._shards.values())
+
+    def _route(self, filter: Optional[Dict]):
+        """(shards to query, remaining filter) for a langchain-style filter."""
+        if not filter or "role" not in filter:
+            return self._all(), filter or None
+        rest = {k: v for k, v in filter.items() if k != "role"}
+        shard = self.shard(filter["role"], create=False)
+        return ([shard] if shard is not None else []), rest or None
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {role: shard._collection.count() for role, shard in self._shards.items()}
+
+    # ----------------------------
+    # Search
+    # ----------------------------
+    def similarity_search_by_vector(self, embedding, k: int = 4, filter: Optional[Dict] = None) -> List[Document]:
+        shards, rest = self._route(filter)
+        if len(shards) == 1:
+            return shards[0].similarity_search_by_vector(embedding, k=k, filter=rest)
+
+        # fan out across shards and keep the global top-k by distance
+        futures = [
+            self._pool.submit(s.similarity_search_by_vector_with_relevance_scores, embedding, k, rest)
+            for s in shards
+        ]
+        hits = [hit for f in futures for hit in f.result()]
+        hits.sort(key=lambda hit: hit[1])
+        return [doc for doc, _ in hits[:k]]
+
+    @staticmethod
+    def _query_many(shard: Chroma, embeddings, k: int, where: Optional[Dict]) -> List[List[tuple]]:
+        # one collection.query() call for all embeddings instead of one per query
+        result = shard._collection.query(
+            query_embeddings=embeddings, n_results=k, where=where,
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            [(Document(page_content=text, metadata=metadata or {}), distance)
+             for text, metadata, distance in zip(texts, metadatas, distances)]
+            for texts, metadatas, distances in zip(result["documents"], result["metadatas"], result["distances"])
+        ]
+
+    def similarity_search_by_vectors(self, embeddings, k: int = 4, filter: Optional[Dict] = None) -> List[List[Document]]:
+        """similarity_search_by_vector for many query vectors at once (top-k list per vector)."""
+        if not embeddings:
+            return []
+        shards, rest = self._route(filter)
+        futures = [self._pool.submit(self._query_many, s, embeddings, k, rest) for s in shards]
+        per_shard = [f.result() for f in futures]
+
+        results = []
+        for i in range(len(embeddings)):
+            hits = [hit for shard_hits in per_shard for hit in shard_hits[i]]
+            hits.sort(key=lambda hit: hit[1])
+            results.append([doc for doc, _ in hits[:k]])
+        return results
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None,
+            include: Optional[List[str]] = None) -> Dict[str, List]:
+        shards, rest = self._route(where)
+        kwargs = {"ids": ids, "where": rest}
+        if include is not None:
+            kwargs["include"] = include
+
+        merged: Dict[str, List] = {"ids": []}
+        for shard in shards:
+            result = shard.get(**kwargs)
+            merged["ids"].extend(result["ids"])
+            for key in ("documents", "metadatas", "embeddings"):
+                if result.get(key) is not None:
+                    merged.setdefault(key, []).extend(result[key])
+        return merged
+
+    # ----------------------------
+    # Writes
+    # ----------------------------
+    def _by_role(self, metadatas: List[Dict]) -> Dict[str, List[int]]:
+        groups: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault(metadata["role"], []).append(i)
+        return groups
+
+    def add_documents(self, documents: List[Document], ids: List[str]) -> List[str]:
+        self._check_writable()
+        for role, idx in self._by_role([d.metadata for d in documents]).items():
+            self.shard(role).add_documents([documents[i] for i in idx], ids=[ids[i] for i in idx])
+        return ids
+
+    def upsert(self, ids: List[str], embeddings, metadatas: List[Dict], documents: List[str]):
+        """Write pre-computed embeddings (used by the ingestion pipeline)."""
+        self._check_writable()
+        for role, idx in self._by_role(metadatas).items():
+            self.shard(role)._collection.upsert(
+                ids=[ids[i] for i in idx],
+                embeddings=[embeddings[i] for i in idx],
+                metadatas=[metadatas[i] for i in idx],
+                documents=[documents[i] for i in idx],
+            )
+
+    def update_metadata(self, ids: List[str], metadatas: List[Dict]):
+        """Replace the metadata of existing chunks (vectors and text unchanged)."""
+        self._check_writable()
+        for role, idx in self._by_role(metadatas).items():
+            self.shard(role)._collection.update(
+                ids=[ids[i] for i in idx],
+                metadatas=[metadatas[i] for i in idx],
+            )
+
+    def delete(self, ids: List[str]):
+        self._check_writable()
+        if not ids:
+            return
+        for shard in self._all():
+            # only the ids this shard holds (chroma warns about every missing one)
+            present = shard.get(ids=list(ids), include=[])["ids"]
+            if present:
+                shard.delete(ids=present)
+
+    def delete_collection(self):
+        """Drop every shard."""
+        self._check_writable()
+        with self._lock:
+            shards, self._shards = list(self._shards.values()), {}
+        for shard in shards:
+            shard.delete_collection()
+
+    # ----------------------------
+    # Migration from the single collection
+    # ----------------------------
+    def _has_legacy(self) -> bool:
+        return LEGACY_COLLECTION in set(map(_collection_name, self.client.list_collections()))
+
+    def legacy_count(self) -> int:
+        return self.client.get_collection(LEGACY_COLLECTION).count() if self._has_legacy() else 0
+
+    def drop_legacy(self):
+        self._check_writable()
+        if self._has_legacy():
+            self.client.delete_collection(LEGACY_COLLECTION)
+
+    def migrate_legacy(self, batch_size: int = MIGRATE_BATCH_SIZE, drop: bool = True) -> Dict[str, int]:
+        """
+        Copy vectors from the old `company_docs` collection into the role
+        shards (no re-embedding), then drop it. Returns chunks moved per role.
+        """
+        self._check_writable()
+        if not self.legacy_count():
+            return {}
+        legacy = self.client.get_collection(LEGACY_COLLECTION)
+
+        moved: Dict[str, int] = {}
+        offset = 0
+        while True:
+            page = legacy.get(limit=batch_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+            if not page["ids"]:
+                break
+            metadatas = [m or {} for m in page["metadatas"]]
+            # chunks without a role can't be routed; embed_doc.py re-indexes their files
+            keep = [i for i, m in enumerate(metadatas) if m.get("role")]
+            self.upsert(
+                ids=[page["ids"][i] for i in keep],
+                embeddings=[page["embeddings"][i] for i in keep],
+                metadatas=[metadatas[i] for i in keep],
+                documents=[page["documents"][i] for i in keep],
+            )
+            for i in keep:
+                moved[metadatas[i]["role"]] = moved.get(metadatas[i]["role"], 0) + 1
+            offset += len(page["ids"])
+
+        if drop:
+            self.drop_legacy()
+        return moved